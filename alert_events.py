@@ -0,0 +1,234 @@
+# alert_events.py
+# Pub/sub para /alerts/stream (SSE). Cada conexión tiene una cola acotada; si
+# el cliente no la vacía a tiempo se le pide resincronizar con
+# GET /alerts?cursor=... en lugar de acumular memoria. Entre procesos los
+# eventos viajan por un canal broadcast de Supabase Realtime (ver más abajo).
+# Usa queue/threading: con el worker gevent quedan parcheados y son cooperativos.
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+
+QUEUE_SIZE = int(os.getenv("ALERTS_STREAM_QUEUE_SIZE", "100"))
+# Con gthread/sync cada conexión ocupa un hilo del worker hasta MAX_SECONDS:
+# se permite a lo más una cuarta parte de WEB_THREADS para que el resto de la
+# API siga atendiendo. Con gevent una conexión abierta cuesta poco.
+_WORKER_CLASS = os.getenv("WEB_WORKER_CLASS", "gthread")
+_THREAD_CAP = 0 if _WORKER_CLASS == "sync" else max(1, int(os.getenv("WEB_THREADS", "16")) // 4)
+if _WORKER_CLASS == "gevent":
+    MAX_CLIENTS = int(os.getenv("ALERTS_STREAM_MAX_CLIENTS", "1000"))
+else:
+    MAX_CLIENTS = min(int(os.getenv("ALERTS_STREAM_MAX_CLIENTS", str(_THREAD_CAP))), _THREAD_CAP)
+HEARTBEAT_SECONDS = float(os.getenv("ALERTS_STREAM_HEARTBEAT_SECONDS", "15"))
+# Tiempo máximo por conexión; EventSource reconecta solo (libera hilos en gthread)
+MAX_SECONDS = float(os.getenv("ALERTS_STREAM_MAX_SECONDS", "300"))
+RETRY_MS = 5000
+
+class TooManySubscribers(Exception):
+    pass
+
+class Subscriber:
+    def __init__(self, id_usuario: str):
+        self.id_usuario = id_usuario
+        self.queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, event: Dict[str, Any]) -> None:
+        if self.overflowed: return
+        try: self.queue.put_nowait(event)
+        except queue.Full: self.overflowed = True
+
+_lock = threading.Lock()
+_subscribers: Dict[str, Set[Subscriber]] = {}
+_stats = {"published": 0, "delivered": 0, "overflows": 0, "bus_sent": 0, "bus_received": 0, "bus_fallbacks": 0}
+
+def _conexiones() -> int:
+    return sum(len(s) for s in _subscribers.values())
+
+def has_capacity() -> bool:
+    """Comprobación previa para responder 503 antes de abrir el stream."""
+    with _lock: return _conexiones() < MAX_CLIENTS
+
+def subscribe(id_usuario: str) -> Subscriber:
+    with _lock:
+        if _conexiones() >= MAX_CLIENTS:
+            raise TooManySubscribers()
+        sub = Subscriber(id_usuario)
+        _subscribers.setdefault(id_usuario, set()).add(sub)
+        return sub
+
+def unsubscribe(sub: Subscriber) -> None:
+    with _lock:
+        subs = _subscribers.get(sub.id_usuario)
+        if subs is None: return
+        subs.discard(sub)
+        if not subs: del _subscribers[sub.id_usuario]
+
+def publish(id_usuario: str, event: str, data: Any) -> None:
+    """
+    Publica el evento para las conexiones del usuario en todos los procesos:
+    por el canal si está conectado (también vuelve a este), si no solo aquí.
+    """
+    with _lock: _stats["published"] += 1
+    mensaje = {"u": str(id_usuario), "e": event, "d": data}
+    if _bus is not None and _bus.send(mensaje): return
+    if _bus is not None:
+        with _lock: _stats["bus_fallbacks"] += 1
+    _deliver(mensaje)
+
+def _deliver(mensaje: Dict[str, Any]) -> None:
+    """Entrega a las conexiones abiertas del usuario en este proceso."""
+    with _lock:
+        subs = list(_subscribers.get(mensaje["u"], ()))
+    for sub in subs:
+        was_overflowed = sub.overflowed
+        sub.offer({"event": mensaje["e"], "data": mensaje["d"]})
+        with _lock:
+            if sub.overflowed and not was_overflowed: _stats["overflows"] += 1
+            elif not sub.overflowed: _stats["delivered"] += 1
+
+def publish_rows(event: str, filas: List[Dict[str, Any]], formatter=None) -> None:
+    """Publica un evento por fila de usuarioalerta, al usuario dueño de cada una."""
+    for fila in filas:
+        if fila.get("idusuario") is None: continue
+        publish(fila["idusuario"], event, formatter(fila) if formatter else fila)
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        return {
+            **_stats,
+            "users": len(_subscribers),
+            "connections": _conexiones(),
+            "queue_size": QUEUE_SIZE,
+            "max_clients": MAX_CLIENTS,
+            "bus": "realtime" if _bus is not None else "local",
+            "bus_connected": _bus is not None and _bus.connected(),
+        }
+
+# ---------- Canal entre procesos (Supabase Realtime) ----------
+# La escritura y la conexión SSE del usuario pueden caer en workers o réplicas
+# distintos. Con el canal, publish() manda cada evento por broadcast (con
+# self=True, así también regresa al proceso que lo envió) y cada proceso
+# entrega lo que recibe a sus conexiones. Si el canal no está unido en ese
+# momento, el evento se entrega solo en el proceso; el cliente se pone al día
+# con el cursor al reconectar (a más tardar tras MAX_SECONDS).
+BUS = os.getenv("ALERTS_STREAM_BUS", "realtime")  # realtime | local
+BUS_TOPIC = os.getenv("ALERTS_STREAM_BUS_TOPIC", "alert-events")
+BUS_SEND_TIMEOUT = float(os.getenv("ALERTS_STREAM_BUS_SEND_TIMEOUT_SECONDS", "2"))
+BUS_EVENT = "alert"
+
+class _RealtimeBus:
+    """Cliente de Realtime en su propio hilo con un event loop de asyncio."""
+    def __init__(self, url: str, key: str):
+        self.url = f"{url.rstrip('/')}/realtime/v1"
+        self.key = key
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.client = None
+        self.channel = None
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, name="alert-events-bus", daemon=True).start()
+
+    def _run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._connect())
+        self.loop.run_forever()
+
+    async def _connect(self) -> None:
+        from realtime import AsyncRealtimeClient
+        while True:
+            try:
+                self.client = AsyncRealtimeClient(self.url, self.key, auto_reconnect=True)
+                channel = self.client.channel(BUS_TOPIC, {"config": {"broadcast": {"self": True, "ack": False}, "private": False}})
+                channel.on_broadcast(BUS_EVENT, self._on_message)
+                await channel.subscribe(self._on_state)
+                self.channel = channel
+                return
+            except Exception as e:
+                print(f"No se pudo conectar el canal de /alerts/stream a Realtime: {e}; reintento en 30 s")
+                await asyncio.sleep(30)
+
+    @staticmethod
+    def _on_state(state, error) -> None:
+        if error is not None or str(getattr(state, "value", state)) != "SUBSCRIBED":
+            print(f"Canal de /alerts/stream: {getattr(state, 'value', state)} {error or ''}")
+
+    @staticmethod
+    def _on_message(msg: Dict[str, Any]) -> None:
+        mensaje = msg.get("payload") or {}
+        if not isinstance(mensaje.get("u"), str) or not isinstance(mensaje.get("e"), str): return
+        with _lock: _stats["bus_received"] += 1
+        _deliver(mensaje)
+
+    def connected(self) -> bool:
+        return (self.client is not None and self.client.is_connected
+                and self.channel is not None and self.channel.is_joined)
+
+    def send(self, mensaje: Dict[str, Any]) -> bool:
+        if not self.connected(): return False
+        # que el dato sea JSON plano (fechas como texto) antes de cruzar de hilo
+        mensaje = json.loads(json.dumps(mensaje, default=str))
+        fut = asyncio.run_coroutine_threadsafe(self.channel.send_broadcast(BUS_EVENT, mensaje), self.loop)
+        try:
+            fut.result(timeout=BUS_SEND_TIMEOUT)
+        except Exception as e:
+            print(f"No se pudo publicar en el canal de /alerts/stream: {e}")
+            return False
+        with _lock: _stats["bus_sent"] += 1
+        return True
+
+_bus: Optional[_RealtimeBus] = None
+
+def start_bus(url: Optional[str], key: Optional[str]) -> None:
+    """Conecta el canal de este proceso (una vez; llamar tras el fork, no al importar)."""
+    global _bus
+    if _bus is not None or BUS != "realtime" or not url or not key: return
+    _bus = _RealtimeBus(url, key)
+    _bus.start()
+
+# ---------- Formato SSE ----------
+def format_sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str, separators=(',', ':'))}\n\n"
+
+def stream(id_usuario: str, sync: Optional[Callable[[], Any]] = None) -> Iterator[str]:
+    """
+    Generador de la respuesta: eventos, heartbeats y cierre al vencer MAX_SECONDS.
+    Se suscribe al empezar a iterar (si la respuesta se descarta antes no queda
+    nada colgado) y solo entonces llama a sync() para el evento "sync": lo que
+    llegue entre ambos no se pierde.
+    """
+    deadline = time.monotonic() + MAX_SECONDS
+    try:
+        sub = subscribe(id_usuario)
+    except TooManySubscribers:
+        # se llenó entre la comprobación de la ruta y el primer next()
+        yield f"retry: {RETRY_MS * 6}\n\n" + format_sse("resync", {"reason": "too_many_clients"})
+        return
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        if sync is not None:
+            try: pendiente = sync()
+            except Exception as e:
+                print(f"Error al leer el delta de /alerts/stream: {e}")
+                yield format_sse("resync", {"reason": "sync_failed"})
+                return
+            yield format_sse("sync", pendiente)
+        while True:
+            if sub.overflowed:
+                yield format_sse("resync", {"reason": "queue_full"})
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: return
+            try:
+                item = sub.queue.get(timeout=min(HEARTBEAT_SECONDS, remaining))
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            yield format_sse(item["event"], item["data"])
+    finally:
+        unsubscribe(sub)
@@ -1,4 +1,12 @@
 from flask import jsonify
+from datetime import datetime, timedelta
+from uuid import UUID
+import os
+import threading
+import time
+import fanout
+import alert_events
+import cursors
 
 def reports_json():
     alerts = [
@@ -32,3 +40,352 @@ def reports_json():
         }
     ]
     return alerts
+
+
+# --- Alertas de usuario ---
+def filas_usuarioalerta(id_usuario, alertas_configuradas, fecha_deteccion: datetime):
+    """Construye las filas de usuarioalerta para un diagnóstico (una por alerta: la PK es idusuario+idalerta)."""
+    filas = {}
+    for alerta in alertas_configuradas:
+        dias_para_alerta = alerta.get("diasParaAlerta", 0)
+        fecha_alerta = fecha_deteccion + timedelta(days=dias_para_alerta)
+        filas[alerta["idalerta"]] = {
+            "idusuario": id_usuario,
+            "idalerta": alerta["idalerta"],
+            "fecha": fecha_alerta.strftime("%Y-%m-%d"),
+            "completado": False
+        }
+    return list(filas.values())
+
+def insertar_usuarioalerta(supabase, filas):
+    """
+    Inserta todas las filas en una sola llamada. Las que chocan con la PK
+    (idusuario, idalerta) se ignoran y conservan su estado actual.
+    Devuelve las filas realmente insertadas.
+    """
+    if not filas: return []
+    resp = supabase.table("usuarioalerta") \
+        .upsert(filas, on_conflict="idusuario,idalerta", ignore_duplicates=True) \
+        .execute()
+    return resp.data or []
+
+def generar_alertas_usuario(supabase, id_usuario, alertas_configuradas, fecha_deteccion: datetime):
+    """Devuelve tupla: (alertas insertadas, alertas que el usuario ya tenía)"""
+    return generar_alertas_lote(supabase, [(id_usuario, alertas_configuradas, fecha_deteccion)])[0]
+
+def generar_alertas_lote(supabase, diagnosticos):
+    """
+    Igual que generar_alertas_usuario para varios diagnósticos (id_usuario,
+    alertas_configuradas, fecha_deteccion) con una sola escritura.
+    Si dos diagnósticos generan la misma alerta para el mismo usuario, cuenta
+    para el primero. Devuelve una tupla (insertadas, existentes) por diagnóstico.
+    """
+    filas, origen = [], {}
+    for i, (id_usuario, alertas_configuradas, fecha_deteccion) in enumerate(diagnosticos):
+        for fila in filas_usuarioalerta(id_usuario, alertas_configuradas, fecha_deteccion):
+            clave = (str(fila["idusuario"]), str(fila["idalerta"]))
+            if clave in origen: continue
+            origen[clave] = i
+            filas.append(fila)
+
+    insertadas = insertar_usuarioalerta(supabase, filas)
+    conteo = [[0, 0] for _ in diagnosticos]
+    for clave, i in origen.items(): conteo[i][1] += 1
+    for fila in insertadas:
+        i = origen.get((str(fila["idusuario"]), str(fila["idalerta"])))
+        if i is not None: conteo[i][0] += 1; conteo[i][1] -= 1
+
+    plantillas = {a["idalerta"]: a for _, configuradas, _ in diagnosticos for a in configuradas}
+    alert_events.publish_rows("created", insertadas, lambda f: alerta_json(f, plantillas.get(f["idalerta"])))
+    return [tuple(c) for c in conteo]
+
+
+# --- Cache de plantillas de alertas ---
+# La tabla alertas es configuración: se carga completa una vez por worker,
+# agrupada por enfermedad, y se refresca cada TEMPLATES_TTL_SECONDS.
+TEMPLATES_TTL_SECONDS = float(os.getenv("ALERT_TEMPLATES_TTL_SECONDS", "600"))
+
+_templates_lock = threading.Lock()
+_templates_cache = {"data": None, "loaded_at": 0.0, "hits": 0, "misses": 0, "generation": 0}
+
+def _cargar_plantillas(supabase):
+    resp = supabase.table("alertas").select("*").execute()
+    por_enfermedad, por_id = {}, {}
+    for alerta in resp.data or []:
+        por_enfermedad.setdefault(alerta.get("enfermedad"), []).append(alerta)
+        por_id[alerta.get("idalerta")] = alerta
+    return {"por_enfermedad": por_enfermedad, "por_id": por_id}
+
+def _plantillas(supabase):
+    with _templates_lock:
+        data = _templates_cache["data"]
+        if data is not None and time.monotonic() - _templates_cache["loaded_at"] < TEMPLATES_TTL_SECONDS:
+            _templates_cache["hits"] += 1
+            return data
+        _templates_cache["misses"] += 1
+        generation = _templates_cache["generation"]
+    data = _cargar_plantillas(supabase)
+    with _templates_lock:
+        # Si se invalidó mientras se cargaba, estos datos pueden ser previos al cambio: no se guardan
+        if _templates_cache["generation"] == generation:
+            _templates_cache["data"] = data
+            _templates_cache["loaded_at"] = time.monotonic()
+    return data
+
+def plantillas_por_enfermedad(supabase):
+    return _plantillas(supabase)["por_enfermedad"]
+
+def plantillas_por_id(supabase, ids):
+    """{idalerta: plantilla} para los ids pedidos; recarga una vez si alguno es más nuevo que la cache."""
+    por_id = _plantillas(supabase)["por_id"]
+    if any(i not in por_id for i in ids):
+        invalidate_templates_cache()
+        por_id = _plantillas(supabase)["por_id"]
+    return {i: por_id[i] for i in ids if i in por_id}
+
+def plantillas_de(supabase, enfermedad):
+    """Plantillas configuradas para una enfermedad (lista vacía si no hay)."""
+    return list(plantillas_por_enfermedad(supabase).get(enfermedad, []))
+
+def invalidate_templates_cache():
+    """Fuerza recargar la tabla alertas en la siguiente consulta."""
+    with _templates_lock:
+        _templates_cache["data"] = None
+        _templates_cache["loaded_at"] = 0.0
+        _templates_cache["generation"] += 1
+
+def templates_cache_stats():
+    with _templates_lock:
+        data = _templates_cache["data"]
+        age = time.monotonic() - _templates_cache["loaded_at"] if data is not None else None
+        return {
+            "hits": _templates_cache["hits"],
+            "misses": _templates_cache["misses"],
+            "diseases": len(data["por_enfermedad"]) if data is not None else 0,
+            "templates": len(data["por_id"]) if data is not None else 0,
+            "age_seconds": age,
+            "ttl_seconds": TEMPLATES_TTL_SECONDS,
+        }
+
+
+# --- Sincronización incremental ---
+# El cliente guarda un cursor opaco (actualizado_en, idalerta) y pide solo
+# lo que cambió después: altas y cambios salen de usuarioalerta y las bajas
+# de usuarioalerta_eliminada (ambas mantenidas por triggers, ver tablas.sql).
+SYNC_DEFAULT_LIMIT = 100
+SYNC_MAX_LIMIT = 500
+# Las marcas son clock_timestamp() (hora de escritura, no de commit): una
+# transacción lenta puede confirmar filas con marca anterior a un cursor que
+# otro cliente ya avanzó. Cada consulta con cursor vuelve a leer los últimos
+# SYNC_OVERLAP_SECONDS antes de él; reaplicar esas filas no cambia nada.
+SYNC_OVERLAP_SECONDS = float(os.getenv("ALERTS_SYNC_OVERLAP_SECONDS", "10"))
+
+def _despues_de(query, col, cursor, ventana=False):
+    if cursor is None: return query
+    if ventana:
+        ts = datetime.fromisoformat(cursor[0])
+        return query.gte(col, (ts - timedelta(seconds=SYNC_OVERLAP_SECONDS)).isoformat()).lte(col, cursor[0])
+    return query.or_(cursors.after(col, "idalerta", cursor))
+
+def _cambios(supabase, id_usuario, cursor, limit, ventana=False):
+    q = supabase.table("usuarioalerta") \
+        .select("idalerta,fecha,completado,actualizado_en") \
+        .eq("idusuario", id_usuario)
+    resp = _despues_de(q, "actualizado_en", cursor, ventana) \
+        .order("actualizado_en").order("idalerta").limit(limit + 1).execute()
+    return [(r["actualizado_en"], r["idalerta"], r) for r in resp.data or []]
+
+def _eliminadas(supabase, id_usuario, cursor, limit, ventana=False):
+    q = supabase.table("usuarioalerta_eliminada") \
+        .select("idalerta,eliminado_en") \
+        .eq("idusuario", id_usuario)
+    resp = _despues_de(q, "eliminado_en", cursor, ventana) \
+        .order("eliminado_en").order("idalerta").limit(limit + 1).execute()
+    return [(r["eliminado_en"], r["idalerta"], None) for r in resp.data or []]
+
+def alerta_json(fila, plantilla):
+    plantilla = plantilla or {}
+    return {
+        "idalert": fila.get("idalerta"),
+        "category": plantilla.get("categoria"),
+        "title": plantilla.get("titulo"),
+        "action": plantilla.get("accion"),
+        "date": fila.get("fecha"),
+        "type": plantilla.get("tipo"),
+        "isCompleted": bool(fila.get("completado", False)),
+        "updatedAt": fila.get("actualizado_en"),
+    }
+
+def alertas_delta(supabase, id_usuario, cursor=None, limit=SYNC_DEFAULT_LIMIT):
+    """
+    Página de cambios posteriores al cursor (None = desde el inicio).
+    Devuelve {"alerts", "deleted", "cursor", "has_more"}; el cliente aplica
+    la página y vuelve a pedir con el cursor nuevo mientras has_more sea True.
+    """
+    desde = cursors.decode(cursor) if cursor else None
+    calls = {
+        "cambios": lambda: _cambios(supabase, id_usuario, desde, limit),
+        "eliminadas": lambda: _eliminadas(supabase, id_usuario, desde, limit),
+    }
+    if desde is not None and SYNC_OVERLAP_SECONDS > 0:
+        calls["cambios_ventana"] = lambda: _cambios(supabase, id_usuario, desde, SYNC_MAX_LIMIT, ventana=True)
+        calls["eliminadas_ventana"] = lambda: _eliminadas(supabase, id_usuario, desde, SYNC_MAX_LIMIT, ventana=True)
+    res = fanout.run_parallel(calls)
+
+    orden = lambda e: (datetime.fromisoformat(e[0]), e[1])
+    # Cada lista viene ordenada y con limit + 1 filas: mezclar y cortar es exacto
+    eventos = sorted(res["cambios"] + res["eliminadas"], key=orden)
+    pagina = eventos[:limit]
+    has_more = len(eventos) > limit
+    # La ventana se entrega junto con la página pero no mueve el cursor
+    ventana = sorted(res.get("cambios_ventana", []) + res.get("eliminadas_ventana", []), key=orden)
+
+    # Por alerta gana el último evento (p. ej. borrada y vuelta a crear, o repetida por la ventana)
+    ultimo = {}
+    for ts, idalerta, fila in ventana + pagina: ultimo[idalerta] = fila
+    vivas = [f for f in ultimo.values() if f is not None]
+    plantillas = plantillas_por_id(supabase, {f["idalerta"] for f in vivas})
+
+    return {
+        "alerts": [alerta_json(f, plantillas.get(f["idalerta"])) for f in vivas],
+        "deleted": [i for i, f in ultimo.items() if f is None],
+        "cursor": cursors.encode(pagina[-1][0], pagina[-1][1]) if pagina else cursor,
+        "has_more": has_more,
+    }
+
+
+def notificar(supabase, evento, filas):
+    """Publica en /alerts/stream las filas de usuarioalerta que cambiaron ("updated" o "deleted")."""
+    if not filas: return
+    try:
+        if evento == "deleted":
+            alert_events.publish_rows(evento, filas, lambda f: {"idalert": f.get("idalerta")})
+            return
+        plantillas = plantillas_por_id(supabase, {f["idalerta"] for f in filas})
+        alert_events.publish_rows(evento, filas, lambda f: alerta_json(f, plantillas.get(f["idalerta"])))
+    except Exception as e:
+        # la escritura ya se hizo: los clientes se pondrán al día con GET /alerts?cursor=...
+        print(f"No se pudo notificar '{evento}' a /alerts/stream: {e}")
+
+
+# --- Operaciones en lote ---
+# Un cliente que vuelve a estar en línea manda todo su backlog de una vez:
+# se agrupan los ids por estado destino y se aplica con in_(), en trozos
+# para no exceder el largo de URL de PostgREST.
+BATCH_MAX_ITEMS = int(os.getenv("ALERTS_BATCH_MAX_ITEMS", "500"))
+BATCH_CHUNK = 100
+
+def _en_trozos(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), BATCH_CHUNK):
+        yield ids[i:i + BATCH_CHUNK]
+
+def _filas_lote(query_factory, ids):
+    """
+    Aplica la consulta trozo por trozo. Devuelve (filas, {idalerta: error}):
+    si un trozo falla los anteriores ya quedaron aplicados, así que se reporta
+    por elemento en vez de abortar todo el lote.
+    """
+    filas, fallidos = [], {}
+    for trozo in _en_trozos(ids):
+        try:
+            filas.extend(query_factory().in_("idalerta", trozo).execute().data or [])
+        except Exception as e:
+            print(f"🚨 Error en trozo de usuarioalerta ({len(trozo)} ids): {e}")
+            for i in trozo: fallidos[i] = str(e)
+    return filas, fallidos
+
+def _uuid(valor):
+    """idalerta normalizado, o None si no es un UUID (PostgREST rechazaría todo el in_())."""
+    try: return str(UUID(str(valor)))
+    except (TypeError, ValueError, AttributeError): return None
+
+def _validar_lote(items, nombre):
+    if not isinstance(items, list) or not items:
+        return ({"success": False, "error": f"'{nombre}' debe ser una lista no vacía"}, 400)
+    if len(items) > BATCH_MAX_ITEMS:
+        return ({"success": False, "error": f"Máximo {BATCH_MAX_ITEMS} elementos por solicitud"}, 413)
+    return None
+
+def _validar_usuario(data):
+    """idusuario es obligatorio: usuarioalerta es N:M y sin él se tocaría la alerta de todos los usuarios."""
+    id_usuario = _uuid(data.get("idusuario"))
+    if id_usuario is None:
+        return None, ({"success": False, "error": "'idusuario' (UUID) es requerido"}, 400)
+    return id_usuario, None
+
+def _resumen(resultados):
+    """(dict, status_code): 207 si algún elemento falló en la base de datos."""
+    conteo = {}
+    for r in resultados: conteo[r["status"]] = conteo.get(r["status"], 0) + 1
+    return ({"success": "failed" not in conteo, "results": resultados, "summary": conteo},
+            207 if "failed" in conteo else 200)
+
+def completar_lote(supabase, data: dict):
+    """
+    Espera {"items": [{"idalerta": ..., "isCompleted": bool}, ...], "idusuario": ...}.
+    Si un id se repite gana el último estado. Devuelve tupla: (dict, status_code)
+    """
+    id_usuario, error = _validar_usuario(data)
+    if error: return error
+    error = _validar_lote(data.get("items"), "items")
+    if error: return error
+
+    resultados, destino = [], {}
+    for item in data["items"]:
+        crudo = item.get("idalerta") if isinstance(item, dict) else None
+        id_alerta = _uuid(crudo)
+        estado = item.get("isCompleted") if isinstance(item, dict) else None
+        if id_alerta is None or not isinstance(estado, bool):
+            resultados.append({"idalerta": crudo, "status": "invalid",
+                               "error": "'idalerta' (UUID) e 'isCompleted' (bool) son requeridos"})
+            continue
+        destino[id_alerta] = estado
+        resultados.append({"idalerta": id_alerta, "status": None})
+
+    # Una actualización por estado destino (a lo más dos, salvo trozos)
+    actualizadas, fallidos = [], {}
+    for estado in (True, False):
+        ids = [i for i, e in destino.items() if e is estado]
+        if not ids: continue
+        def query(estado=estado):
+            return supabase.table("usuarioalerta").update({"completado": estado}).eq("idusuario", id_usuario)
+        filas, errores = _filas_lote(query, ids)
+        actualizadas.extend(filas); fallidos.update(errores)
+
+    encontradas = {str(f["idalerta"]) for f in actualizadas}
+    for r in resultados:
+        if r["status"] is not None: continue
+        r["isCompleted"] = destino[r["idalerta"]]
+        if r["idalerta"] in fallidos: r["status"], r["error"] = "failed", fallidos[r["idalerta"]]
+        else: r["status"] = "updated" if r["idalerta"] in encontradas else "not_found"
+    notificar(supabase, "updated", actualizadas)
+    return _resumen(resultados)
+
+def eliminar_lote(supabase, data: dict):
+    """
+    Espera {"ids": [idalerta, ...], "idusuario": ...}.
+    Devuelve tupla: (dict, status_code)
+    """
+    id_usuario, error = _validar_usuario(data)
+    if error: return error
+    error = _validar_lote(data.get("ids"), "ids")
+    if error: return error
+
+    ids = [_uuid(i) for i in data["ids"]]
+    def query():
+        return supabase.table("usuarioalerta").delete().eq("idusuario", id_usuario)
+    validos = [i for i in dict.fromkeys(ids) if i is not None]
+    eliminadas, fallidos = _filas_lote(query, validos) if validos else ([], {})
+
+    encontradas = {str(f["idalerta"]) for f in eliminadas}
+    resultados = []
+    for crudo, i in zip(data["ids"], ids):
+        if i is None:
+            resultados.append({"idalerta": crudo, "status": "invalid", "error": "'idalerta' debe ser un UUID"})
+        elif i in fallidos:
+            resultados.append({"idalerta": i, "status": "failed", "error": fallidos[i]})
+        else:
+            resultados.append({"idalerta": i, "status": "deleted" if i in encontradas else "not_found"})
+    notificar(supabase, "deleted", eliminadas)
+    return _resumen(resultados)
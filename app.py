@@ -1,37 +1,90 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from supabase import create_client, Client
 from dotenv import load_dotenv
-from uuid import uuid4
 import os
-from datetime import datetime, timedelta
+import hmac
+from datetime import datetime
 import traceback 
 import reports
 import alerts
+import alert_events
+import cursors
 import caficultores
 import risk
+import risk_batch
+import risk_snapshots
 import auth
 import parcelas
+import parcelas_bulk
+import parcelas_geo
+import parcelas_region
+import fanout
+import metrics
+import uploads
+import images
+import diagnostic_jobs
+import diagnoses
+import diagnostic_batch
+import json_provider
+import compression
+from werkzeug.datastructures import FileStorage
 
 load_dotenv()
 app = Flask(__name__)
+# Archivos del multipart a disco arriba de UPLOAD_SPOOL_BYTES; cuerpo acotado (ver uploads.py)
+app.request_class = uploads.UploadRequest
+app.config["MAX_CONTENT_LENGTH"] = uploads.max_content_length()
+# jsonify con orjson y respuestas comprimidas según Accept-Encoding
+json_provider.init_app(app)
+compression.init_app(app)
 
 # Configuración de Supabase
 NEXT_PUBLIC_SUPABASE_URL = os.getenv("NEXT_PUBLIC_SUPABASE_URL")
 NEXT_PUBLIC_SUPABASE_ANON_KEY = os.getenv("NEXT_PUBLIC_SUPABASE_ANON_KEY")
 
-# Validación simple de variables de entorno al inicio
-if not NEXT_PUBLIC_SUPABASE_URL or not NEXT_PUBLIC_SUPABASE_ANON_KEY:
-    print(" ERROR: Las variables de entorno de Supabase (URL/KEY) no están configuradas.")
-    supabase = None 
-else:
-    try:
-        supabase: Client = create_client(NEXT_PUBLIC_SUPABASE_URL, NEXT_PUBLIC_SUPABASE_ANON_KEY)
-    except Exception as e:
-        print(f" ERROR al inicializar el cliente de Supabase: {e}")
-        supabase = None
+supabase: Client = None
+
+def init_supabase():
+    """Crea el cliente de Supabase de este worker (gunicorn lo vuelve a llamar tras el fork si hay preload)."""
+    global supabase
+    # Validación simple de variables de entorno al inicio
+    if os.getenv("SUPABASE_FAKE") == "1":
+        # Cliente en memoria con datos de ejemplo, solo para pruebas de carga locales (ver loadtest.py)
+        import fake_supabase
+        _fake = fake_supabase.FakeSupabase(latency_ms=float(os.getenv("SUPABASE_FAKE_LATENCY_MS", "0")),
+                                           jitter_ms=float(os.getenv("SUPABASE_FAKE_JITTER_MS", "0")))
+        fake_supabase.seed_data(_fake)
+        supabase = metrics.instrument(_fake)
+    elif not NEXT_PUBLIC_SUPABASE_URL or not NEXT_PUBLIC_SUPABASE_ANON_KEY:
+        print(" ERROR: Las variables de entorno de Supabase (URL/KEY) no están configuradas.")
+        supabase = None 
+    else:
+        try:
+            # Envuelto para medir cada consulta (ver metrics.py)
+            supabase = metrics.instrument(create_client(NEXT_PUBLIC_SUPABASE_URL, NEXT_PUBLIC_SUPABASE_ANON_KEY))
+        except Exception as e:
+            print(f" ERROR al inicializar el cliente de Supabase: {e}")
+            supabase = None
+    return supabase
+
+init_supabase()
 
 BUCKET_NAME = os.getenv("SUPABASE_BUCKET", "CoffeeDiagnosisPhotos")
 
+# --- Métricas ---
+@app.before_request
+def _metrics_start():
+    metrics.start_request(request.url_rule.rule if request.url_rule else None)
+
+@app.after_request
+def _metrics_finish(response):
+    return metrics.finish_request(response, request.method)
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 # --- Ruta Base ---
 @app.route("/", methods=["GET"])
 def index():
@@ -78,6 +131,23 @@ def get_alerts():
     user_id = request.args.get("idusuario") # Asume columna 'idusuario'
     if not user_id: return jsonify({"error": "Parámetro 'idusuario' requerido"}), 400
 
+    # Modo incremental: ?cursor=<cursor anterior> y/o ?limit=N
+    if "cursor" in request.args or "limit" in request.args:
+        try:
+            limit = int(request.args.get("limit", alerts.SYNC_DEFAULT_LIMIT))
+        except ValueError:
+            return jsonify({"error": "'limit' debe ser un entero"}), 400
+        if not 1 <= limit <= alerts.SYNC_MAX_LIMIT:
+            return jsonify({"error": f"'limit' debe estar entre 1 y {alerts.SYNC_MAX_LIMIT}"}), 400
+        try:
+            return jsonify(alerts.alertas_delta(supabase, user_id, request.args.get("cursor") or None, limit))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            print(f" Error en GET /alerts (delta): {e}")
+            print(traceback.format_exc())
+            return jsonify({"error": "Error al obtener alertas"}), 500
+
     try:
         response = supabase.rpc("get_alerts", {"userid": user_id}).execute()
         out = []
@@ -115,6 +185,7 @@ def complete_alert():
         if hasattr(response, 'error') and response.error:
              print(f"Error Supabase en POST /alerts/complete: {response.error}")
              return jsonify({"success": False, "message": f"Error al actualizar alerta: {response.error.message}"}), 500
+        alerts.notificar(supabase, "updated", response.data)
         return jsonify({"success": True, "message": "Alerta actualizada (o ya estaba en ese estado)"}), 200
 
     except Exception as e:
@@ -133,6 +204,7 @@ def delete_alert(idalerta):
              return jsonify({"success": False, "message": f"Error al eliminar alerta: {response.error.message}"}), 500
         # Verificar si algo fue eliminado
         if response.data:
+            alerts.notificar(supabase, "deleted", response.data)
             return jsonify({"success": True, "message": "Alerta eliminada"}), 200
         else:
             return jsonify({"success": False, "message": "No se encontró la alerta para eliminar"}), 404
@@ -142,6 +214,69 @@ def delete_alert(idalerta):
         return jsonify({"success": False, "message": "Error interno al eliminar alerta"}), 500
 
 
+@app.route("/alerts/complete/batch", methods=["POST"])
+def complete_alerts_batch():
+    if supabase is None: return jsonify({"success": False, "message": "Error interno (Supabase)"}), 500
+    data = request.get_json(silent=True)
+    if not data: return jsonify({"success": False, "error": "Datos JSON requeridos"}), 400
+    try:
+        response, status_code = alerts.completar_lote(supabase, data)
+        return jsonify(response), status_code
+    except Exception as e:
+        print(f"🚨 Error en POST /alerts/complete/batch: {e}")
+        print(traceback.format_exc())
+        return jsonify({"success": False, "message": "Error interno al completar alertas"}), 500
+
+
+@app.route("/alerts/delete/batch", methods=["POST"])
+def delete_alerts_batch():
+    if supabase is None: return jsonify({"success": False, "message": "Error interno (Supabase)"}), 500
+    data = request.get_json(silent=True)
+    if not data: return jsonify({"success": False, "error": "Datos JSON requeridos"}), 400
+    try:
+        response, status_code = alerts.eliminar_lote(supabase, data)
+        return jsonify(response), status_code
+    except Exception as e:
+        print(f"🚨 Error en POST /alerts/delete/batch: {e}")
+        print(traceback.format_exc())
+        return jsonify({"success": False, "message": "Error interno al eliminar alertas"}), 500
+
+
+@app.route("/alerts/stream", methods=["GET"])
+def stream_alerts():
+    """
+    SSE con eventos created/updated/deleted del usuario. Con ?cursor= envía
+    primero un evento "sync" con los cambios pendientes (igual que GET /alerts).
+    """
+    user_id = request.args.get("idusuario")
+    if not user_id: return jsonify({"error": "Parámetro 'idusuario' requerido"}), 400
+    cursor = request.args.get("cursor") or None
+    if cursor is not None:
+        try: cursors.decode(cursor)
+        except ValueError as e: return jsonify({"error": str(e)}), 400
+    if not alert_events.has_capacity():
+        return jsonify({"error": "Demasiadas conexiones abiertas, usa GET /alerts"}), 503
+
+    # La suscripción y el delta se hacen dentro del generador (ver alert_events.stream)
+    sync = (lambda: alerts.alertas_delta(supabase, user_id, cursor, alerts.SYNC_MAX_LIMIT)) if cursor is not None else None
+    return Response(stream_with_context(alert_events.stream(user_id, sync)), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/alerts/stream/stats", methods=["GET"])
+def alert_stream_stats():
+    return jsonify({"stream": alert_events.stats()})
+
+@app.route("/alerts/templates/cache", methods=["GET"])
+def alert_templates_cache_stats():
+    return jsonify({"alertas": alerts.templates_cache_stats()})
+
+@app.route("/alerts/templates/cache/invalidate", methods=["POST"])
+def alert_templates_cache_invalidate():
+    if not _job_authorized(): return jsonify({"success": False, "error": "No autorizado"}), 403
+    alerts.invalidate_templates_cache()
+    return jsonify({"success": True, "message": "Cache de plantillas de alertas invalidada"})
+
+
 # --- Caficultores ---
 @app.route("/caficultores", methods=["GET"])
 def caficultores_get():
@@ -175,15 +310,78 @@ def caficultores_delete(id):
 @app.route("/parcelas", methods=["GET"])
 def get_parcelas():
     if supabase is None: return jsonify({"success": False, "error": "Error interno (Supabase)"}), 500
+    # Sin parámetros: todas las parcelas con su ubicación, como siempre.
+    # ?limit= / ?cursor= paginan por idparcela; ?fields= elige las columnas.
+    try:
+        columns = parcelas.select_de_campos(request.args["fields"]) if "fields" in request.args else parcelas.FULL_SELECT
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     # Llama a la función de parcelas.py
     try:
-        response, status_code = parcelas.obtener_parcelas(supabase)
+        if "limit" in request.args or "cursor" in request.args:
+            try: limit = int(request.args.get("limit", parcelas.PAGE_DEFAULT))
+            except ValueError: return jsonify({"success": False, "error": "'limit' debe ser un entero"}), 400
+            if not 1 <= limit <= parcelas.PAGE_MAX:
+                return jsonify({"success": False, "error": f"'limit' debe estar entre 1 y {parcelas.PAGE_MAX}"}), 400
+            try: response, status_code = parcelas.listar_parcelas(supabase, request.args.get("cursor") or None, limit, columns)
+            except ValueError as e: return jsonify({"success": False, "error": str(e)}), 400
+        else:
+            response, status_code = parcelas.obtener_parcelas(supabase, columns)
         return jsonify(response), status_code
     except Exception as e:
         print(f"🚨 Error en GET /parcelas: {e}")
         print(traceback.format_exc())
         return jsonify({"success": False, "error": "Error interno al obtener parcelas."}), 500
 
+def _float_args(*names):
+    """Lee parámetros numéricos de la query; lanza ValueError si falta o no es número."""
+    out = []
+    for name in names:
+        value = request.args.get(name)
+        if value is None: raise ValueError(f"Parámetro '{name}' requerido")
+        try: out.append(float(value))
+        except ValueError: raise ValueError(f"'{name}' debe ser numérico")
+    return out
+
+@app.route("/parcelas/near", methods=["GET"])
+def get_parcelas_near():
+    """Las k parcelas más cercanas a (lat, lon), con distance_km; opcional max_km."""
+    if supabase is None: return jsonify({"success": False, "error": "Error interno (Supabase)"}), 500
+    try: lat, lon = _float_args("lat", "lon")
+    except ValueError as e: return jsonify({"success": False, "error": str(e)}), 400
+    try:
+        k = int(request.args.get("k", 10))
+        max_km = float(request.args["max_km"]) if "max_km" in request.args else None
+    except ValueError:
+        return jsonify({"success": False, "error": "'k' debe ser entero y 'max_km' numérico"}), 400
+    try:
+        response, status_code = parcelas_geo.cercanas(supabase, lat, lon, k, max_km)
+        return jsonify(response), status_code
+    except Exception as e:
+        print(f"🚨 Error en GET /parcelas/near: {e}")
+        print(traceback.format_exc())
+        return jsonify({"success": False, "error": "Error interno al buscar parcelas."}), 500
+
+@app.route("/parcelas/bbox", methods=["GET"])
+def get_parcelas_bbox():
+    """Parcelas dentro de min_lat/min_lon/max_lat/max_lon (máximo 'limit', por defecto 1000)."""
+    if supabase is None: return jsonify({"success": False, "error": "Error interno (Supabase)"}), 500
+    try: south, west, north, east = _float_args("min_lat", "min_lon", "max_lat", "max_lon")
+    except ValueError as e: return jsonify({"success": False, "error": str(e)}), 400
+    try: limit = int(request.args.get("limit", 1000))
+    except ValueError: return jsonify({"success": False, "error": "'limit' debe ser un entero"}), 400
+    try:
+        response, status_code = parcelas_geo.en_caja(supabase, south, west, north, east, limit)
+        return jsonify(response), status_code
+    except Exception as e:
+        print(f"🚨 Error en GET /parcelas/bbox: {e}")
+        print(traceback.format_exc())
+        return jsonify({"success": False, "error": "Error interno al buscar parcelas."}), 500
+
+@app.route("/parcelas/index", methods=["GET"])
+def parcelas_index_stats():
+    return jsonify(parcelas_geo.stats()), 200
+
 @app.route("/parcelas/<idParcela>", methods=["GET"])
 def get_parcela(idParcela):
     if supabase is None: return jsonify({"success": False, "error": "Error interno (Supabase)"}), 500
@@ -208,6 +406,30 @@ def post_parcela():
         print(traceback.format_exc())
         return jsonify({"success": False, "error": "Error interno al crear parcela."}), 500
 
+@app.route("/parcelas/bulk", methods=["POST"])
+def post_parcelas_bulk():
+    """
+    Importa parcelas desde CSV (text/csv) o NDJSON (application/x-ndjson).
+    Responde NDJSON: una línea por fila conforme se crea su lote y al final
+    {"summary": ...}. El archivo se lee completo antes de empezar a responder.
+    """
+    if supabase is None: return jsonify({"success": False, "error": "Error interno (Supabase)"}), 500
+    try:
+        if request.mimetype == "text/csv":
+            filas = parcelas_bulk.parse_csv(request.stream)
+        elif request.mimetype in ("application/x-ndjson", "application/jsonl"):
+            filas = parcelas_bulk.parse_ndjson(request.stream)
+        else:
+            return jsonify({"success": False, "error": "Content-Type debe ser text/csv o application/x-ndjson"}), 415
+    except parcelas_bulk.BulkError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    if not filas: return jsonify({"success": False, "error": "No se recibieron parcelas"}), 400
+
+    def lineas():
+        for resultado in parcelas_bulk.importar(supabase, filas):
+            yield app.json.dumps(resultado) + "\n"
+    return Response(stream_with_context(lineas()), mimetype="application/x-ndjson")
+
 @app.route("/parcelas/<idParcela>", methods=["PUT"])
 def put_parcela(idParcela):
     if supabase is None: return jsonify({"success": False, "error": "Error interno (Supabase)"}), 500
@@ -236,32 +458,144 @@ def delete_parcela(idParcela):
 @app.route("/risk/<region_id>/<int:year>/<int:month>", methods=["GET"])
 def risk_one(region_id, year, month):
      if supabase is None: return jsonify({"error":"Error interno"}), 500
-     try: return jsonify(risk.risk_json(supabase, region_id, year, month))
+     try: return jsonify(risk_snapshots.serve_risk_json(supabase, region_id, year, month))
      except Exception as e: print(f"🚨 Error: {e}"); return jsonify({"error":"Error"}),500
 
 @app.route("/risk_series/<region_id>/<int:year>", methods=["GET"])
 def risk_series(region_id, year):
      if supabase is None: return jsonify({"error":"Error interno"}), 500
-     try: return jsonify(risk.risk_series_json(supabase, region_id, year))
+     try: return jsonify(risk_snapshots.serve_risk_series_json(supabase, region_id, year))
      except Exception as e: print(f"🚨 Error: {e}"); return jsonify({"error":"Error"}),500
 
+@app.route("/parcelas/<idParcela>/risk/<int:year>/<int:month>", methods=["GET"])
+def parcela_risk(idParcela, year, month):
+     if supabase is None: return jsonify({"error":"Error interno"}), 500
+     if not 1 <= month <= 12: return jsonify({"error": "Mes fuera de rango"}), 400
+     try:
+         response, status_code = parcelas_region.riesgo(supabase, idParcela, year, month)
+         return jsonify(response), status_code
+     except Exception as e: print(f"🚨 Error: {e}"); return jsonify({"error":"Error"}),500
+
+@app.route("/parcelas/<idParcela>/risk_series/<int:year>", methods=["GET"])
+def parcela_risk_series(idParcela, year):
+     if supabase is None: return jsonify({"error":"Error interno"}), 500
+     try:
+         response, status_code = parcelas_region.serie(supabase, idParcela, year)
+         return jsonify(response), status_code
+     except Exception as e: print(f"🚨 Error: {e}"); return jsonify({"error":"Error"}),500
+
+@app.route("/risk/regions/<int:year>/<int:month>", methods=["GET"])
+def risk_regions(year, month):
+     if supabase is None: return jsonify({"error":"Error interno"}), 500
+     if not 1 <= month <= 12: return jsonify({"error": "Mes fuera de rango"}), 400
+     drivers = request.args.get("drivers", "0").lower() in ("1", "true")
+     try: return jsonify(risk_batch.regions_month_json(supabase, year, month, drivers=drivers))
+     except Exception as e: print(f"🚨 Error: {e}"); return jsonify({"error":"Error"}),500
+
+@app.route("/risk/batch", methods=["POST"])
+def risk_batch_post():
+     if supabase is None: return jsonify({"success": False, "error": "Error interno (Supabase)"}), 500
+     data = request.get_json(silent=True)
+     if not data: return jsonify({"success": False, "error": "Datos JSON requeridos"}), 400
+     try:
+         response, status_code = risk_batch.risk_batch_json(supabase, data)
+         return jsonify(response), status_code
+     except Exception as e:
+         print(f"🚨 Error en POST /risk/batch: {e}")
+         print(traceback.format_exc())
+         return jsonify({"success": False, "error": "Error interno al calcular riesgo."}), 500
+
+def _job_authorized() -> bool:
+     """Operaciones de mantenimiento (cron/admin): header X-Job-Token igual a RISK_SNAPSHOT_TOKEN."""
+     token = os.getenv("RISK_SNAPSHOT_TOKEN")
+     return bool(token) and hmac.compare_digest(request.headers.get("X-Job-Token", ""), token)
+
+@app.route("/risk/snapshots/refresh", methods=["POST"])
+def risk_snapshots_refresh():
+     if supabase is None: return jsonify({"success": False, "error": "Error interno (Supabase)"}), 500
+     # Pensado para un cron: requiere RISK_SNAPSHOT_TOKEN en el header X-Job-Token
+     if not _job_authorized(): return jsonify({"success": False, "error": "No autorizado"}), 403
+     data = request.get_json(silent=True) or {}
+     try:
+         stats = risk_snapshots.refresh_snapshots(supabase, years=data.get("years"), full=bool(data.get("full")))
+         return jsonify({"success": True, "data": stats}), 200
+     except Exception as e:
+         print(f"🚨 Error en POST /risk/snapshots/refresh: {e}")
+         print(traceback.format_exc())
+         return jsonify({"success": False, "error": "Error interno al recalcular snapshots."}), 500
+
+@app.route("/risk/cache", methods=["GET"])
+def risk_cache_stats():
+     return jsonify({"disease_prior": risk.prior_cache_stats(), "parcel_regions": parcelas_region.stats()})
+
+@app.route("/risk/cache/invalidate", methods=["POST"])
+def risk_cache_invalidate():
+     if not _job_authorized(): return jsonify({"success": False, "error": "No autorizado"}), 403
+     risk.invalidate_prior_cache()
+     parcelas_region.invalidate()
+     return jsonify({"success": True, "message": "Cache de disease_prior y regiones de parcelas invalidada"})
+
 # --- Subir Imágenes y Diagnósticos  ---
-def _upload_bytes_to_storage(file_bytes: bytes, dest_path: str, content_type: str):
-    """Sube bytes al bucket y devuelve URL pública. Lanza excepción en error."""
+def _upload_to_storage(data, dest_path: str, content_type: str, exists_ok: bool = False):
+    """
+    Sube bytes o un archivo abierto (se envía por trozos) al bucket y devuelve URL pública. Lanza excepción en error.
+    Con exists_ok=True, si el objeto ya existe (mismo contenido) se devuelve su URL.
+    """
     if supabase is None: raise Exception("Supabase client not initialized")
     try:
         supabase.storage.from_(BUCKET_NAME).upload(
-            file=file_bytes, path=dest_path,
+            file=data, path=dest_path,
             file_options={"contentType": content_type, "cacheControl": "3600", "upsert": False}
         )
-        public_url_data = supabase.storage.from_(BUCKET_NAME).get_public_url(dest_path)
-        # Maneja respuesta de get_public_url
-        if isinstance(public_url_data, dict):
-            return public_url_data.get('publicUrl', str(public_url_data))
-        return public_url_data
     except Exception as e:
-        print(f"Error Supabase Storage Upload: {e}")
-        raise e # Re-lanza para que la ruta lo capture
+        if not (exists_ok and uploads.is_duplicate(e)):
+            print(f"Error Supabase Storage Upload: {e}")
+            raise e # Re-lanza para que la ruta lo capture
+    public_url_data = supabase.storage.from_(BUCKET_NAME).get_public_url(dest_path)
+    # Maneja respuesta de get_public_url
+    if isinstance(public_url_data, dict):
+        return public_url_data.get('publicUrl', str(public_url_data))
+    return public_url_data
+
+def _upload_file_storage(f, owner: str, ext: str, content_type: str):
+    """
+    Sube un archivo del multipart sin leerlo completo a memoria: reducido a
+    IMAGE_MAX_SIDE más una miniatura si es imagen, o tal cual si no.
+    La ruta es <owner>/<sha256 del contenido>: si el mismo usuario ya subió
+    ese archivo no se vuelve a procesar ni a subir.
+    Devuelve dict con image_url, path, thumbnail_url, thumbnail_path y deduplicated.
+    Lanza UploadTooLarge si excede el límite.
+    """
+    with uploads.open_upload(f) as (data, _size):
+        digest = uploads.content_hash(data)
+        previo = uploads.dedup_lookup(owner, digest)
+        if previo is not None: return {**previo, "deduplicated": True}
+
+        base = f"{owner}/{digest}"
+        processed = images.process_upload(data, content_type)
+        if processed is None:
+            dest_path = f"{base}.{ext}"
+            url = _upload_to_storage(data, dest_path, content_type, exists_ok=True)
+            result = {"image_url": url, "path": dest_path, "thumbnail_url": None, "thumbnail_path": None}
+            uploads.dedup_remember(owner, digest, result)
+            return {**result, "deduplicated": False}
+
+    with processed:
+        main_path, thumb_path = f"{base}.jpg", f"{base}_thumb.jpg"
+        def subir(local_path, dest):
+            with open(local_path, "rb") as fh:
+                return _upload_to_storage(fh, dest, "image/jpeg", exists_ok=True)
+        urls = fanout.run_parallel({
+            "main": lambda: subir(processed.main_path, main_path),
+            "thumb": lambda: subir(processed.thumb_path, thumb_path),
+        })
+    result = {"image_url": urls["main"], "path": main_path, "thumbnail_url": urls["thumb"], "thumbnail_path": thumb_path}
+    uploads.dedup_remember(owner, digest, result)
+    return {**result, "deduplicated": False}
+
+@app.errorhandler(413)
+def _upload_too_large(e):
+    return jsonify({"error": f"La petición excede el máximo de {uploads.MAX_UPLOAD_BYTES} bytes por archivo"}), 413
 
 # ===== 1) POST /upload_image =====
 @app.route("/upload_image", methods=["POST"])
@@ -275,17 +609,23 @@ def upload_image():
         return jsonify({"error": "empty filename"}), 400
 
     user_id = request.form.get("user_id", "anonymous")
-    ext = (f.filename.rsplit(".", 1)[-1].lower() if "." in f.filename else "jpg")
-    dest_path = f"{user_id}/{uuid4()}.{ext}"
+    ext = uploads.safe_ext(f.filename, f.mimetype)
+    if ext is None: return jsonify({"error": uploads.EXTENSION_ERROR}), 400
     content_type = f.mimetype or "image/jpeg"
 
     try:
-        url = _upload_bytes_to_storage(f.read(), dest_path, content_type)
-        return jsonify({"image_url": url, "path": dest_path}), 201
+        return jsonify(_upload_file_storage(f, user_id, ext, content_type)), 201
+    except uploads.UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/upload_image/cache", methods=["GET"])
+def upload_dedup_stats():
+    return jsonify({"dedup": uploads.dedup_stats()})
+
+
 # ===== 2) POST /diagnostic =====
 @app.route("/diagnostic", methods=["POST"])
 def create_diagnostic():
@@ -293,92 +633,217 @@ def create_diagnostic():
     Crea un registro en diagnostico_foto y genera las alertas.
     Puede recibir JSON o multipart/form-data.
     """
-    id_usuario = request.form.get("idUsuario") or (request.json or {}).get("idUsuario")
-    diagnostico = request.form.get("diagnostico") or (request.json or {}).get("diagnostico")
-    imagen_url = request.form.get("imagen_url") or (request.json or {}).get("imagen_url")
+    # silent=True: en multipart/form-data request.json lanza 415 en Flask >= 2.3
+    body = request.get_json(silent=True) or {}
+    id_usuario = request.form.get("idUsuario") or body.get("idUsuario")
+    diagnostico = request.form.get("diagnostico") or body.get("diagnostico")
+    imagen_url = request.form.get("imagen_url") or body.get("imagen_url")
+    # miniatura de un /upload_image previo, si el cliente la manda
+    thumbnail_url = request.form.get("thumbnail_url") or body.get("thumbnail_url")
 
     if not id_usuario or not diagnostico:
         return jsonify({"error": "idUsuario y diagnostico son requeridos"}), 400
 
+    if _quiere_async():
+        return _encolar_diagnostico(id_usuario, diagnostico, imagen_url, thumbnail_url)
+
     if 'file' in request.files and request.files['file'].filename:
         f = request.files['file']
-        ext = (f.filename.rsplit('.', 1)[-1].lower() if '.' in f.filename else 'jpg')
-        dest_path = f"{id_usuario}/{uuid4()}.{ext}"
+        ext = uploads.safe_ext(f.filename, f.mimetype)
+        if ext is None: return jsonify({"error": uploads.EXTENSION_ERROR}), 400
         content_type = f.mimetype or "image/jpeg"
 
         try:
-            imagen_url = _upload_bytes_to_storage(f.read(), dest_path, content_type)
+            subida = _upload_file_storage(f, id_usuario, ext, content_type)
+            imagen_url, thumbnail_url = subida["image_url"], subida["thumbnail_url"]
+        except uploads.UploadTooLarge as e:
+            return jsonify({"error": str(e)}), 413
         except Exception as e:
             return jsonify({"error": f"Fallo al subir la imagen: {e}"}), 500
 
     if not imagen_url:
         return jsonify({"error": "Se requiere imagen_url si no se proporciona un archivo"}), 400
 
-    # Guardar el diagnóstico
+    # Guardar el diagnóstico. La escritura va en este hilo (no en el pool con
+    # timeout): si la ruta responde 500 es que el insert de verdad no se hizo.
+    fila_diagnostico = {
+        "imagen_url": imagen_url,
+        "idusuario": id_usuario,   
+        "diagnostico": diagnostico
+    }
+    if thumbnail_url and diagnoses.THUMBNAIL_COLUMN: fila_diagnostico["thumbnail_url"] = thumbnail_url
     try:
-        insert_resp = supabase.table("diagnostico_foto").insert({
-            "imagen_url": imagen_url,
-            "idusuario": id_usuario,   
-            "diagnostico": diagnostico
-        }).execute()
-        
-        datos_diagnostico = getattr(insert_resp, "data", [{}])[0]
+        insert_response = supabase.table("diagnostico_foto").insert(fila_diagnostico).execute()
+        datos_diagnostico = getattr(insert_response, "data", [{}])[0]
 
     except Exception as e:
         return jsonify({"error": f"Error al guardar el diagnóstico: {str(e)}"}), 500
 
     # Generar alertas asociadas
     try:
-        alerta_resp = supabase.table("alertas").select("*").eq("enfermedad", diagnostico).execute()
-        alertas_configuradas = alerta_resp.data or []
+        # plantillas desde la cache del worker: sin lectura en estado estable
+        alertas_configuradas = alerts.plantillas_de(supabase, diagnostico)
 
         if not alertas_configuradas:
             return jsonify({
                 "message": "Diagnóstico creado",
-                "diagnosis_details": datos_diagnostico
+                "diagnosis_details": datos_diagnostico,
+                "image_url": imagen_url,
+                "thumbnail_url": thumbnail_url
             }), 201
 
-        fecha_deteccion = datetime.now()
-        alertas_generadas_count = 0
-
-        for alerta in alertas_configuradas:
-            dias_para_alerta = alerta.get("diasParaAlerta", 0)
-            fecha_alerta = fecha_deteccion + timedelta(days=dias_para_alerta)
-            fecha_alerta_str = fecha_alerta.strftime("%Y-%m-%d")
-
-            supabase.table("usuarioalerta").insert({
-                "idusuario": id_usuario,
-                "idalerta": alerta["idalerta"],
-                "fecha": fecha_alerta_str,
-                "completado": False
-            }).execute()
-
-            alertas_generadas_count += 1
+        # Una sola escritura para todas las alertas; las que el usuario ya tiene se conservan
+        alertas_generadas_count, alertas_existentes_count = alerts.generar_alertas_usuario(
+            supabase, id_usuario, alertas_configuradas, datetime.now())
 
     except Exception as e:
         return jsonify({
             "message": "Diagnóstico creado, sin alertas nuevas para generar.",
             "error_alertas": str(e),
-            "diagnosis_details": datos_diagnostico
+            "diagnosis_details": datos_diagnostico,
+            "image_url": imagen_url,
+            "thumbnail_url": thumbnail_url
         }), 207  # 207 Multi-Status
 
     return jsonify({
-        "message": "Diagnóstico creado. Se han generado nuevas alertas.",
+        "message": "Diagnóstico creado. Se han generado nuevas alertas." if alertas_generadas_count
+                   else "Diagnóstico creado. El usuario ya tenía estas alertas.",
         "diagnosis_details": datos_diagnostico,
-        "alerts_generated": alertas_generadas_count
+        "image_url": imagen_url,
+        "thumbnail_url": thumbnail_url,
+        "alerts_generated": alertas_generadas_count,
+        "alerts_existing": alertas_existentes_count
     }), 201
 
+# ===== 2b) POST /diagnostic asíncrono =====
+# Con ?async=1 o "Prefer: respond-async" la foto se guarda en disco, se
+# responde 202 con el id del trabajo y lo demás corre en segundo plano.
+def _quiere_async():
+    return request.args.get("async") in ("1", "true") or "respond-async" in request.headers.get("Prefer", "")
+
+def _encolar_diagnostico(id_usuario, diagnostico, imagen_url, thumbnail_url):
+    payload = {"idUsuario": id_usuario, "diagnostico": diagnostico,
+               "imagen_url": imagen_url, "thumbnail_url": thumbnail_url}
+    f = request.files.get('file')
+    try:
+        if f is not None and f.filename:
+            ext = uploads.safe_ext(f.filename, f.mimetype)
+            if ext is None: return jsonify({"error": uploads.EXTENSION_ERROR}), 400
+            payload["content_type"] = f.mimetype or "image/jpeg"
+            with uploads.open_upload(f) as (data, _size):
+                job = diagnostic_queue.submit(payload, image=data, ext=ext)
+        elif imagen_url:
+            job = diagnostic_queue.submit(payload)
+        else:
+            return jsonify({"error": "Se requiere imagen_url si no se proporciona un archivo"}), 400
+    except uploads.UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+
+    status_url = f"/diagnostic/jobs/{job['id']}"
+    return jsonify({"job_id": job["id"], "status": job["status"], "status_url": status_url}), 202, {"Location": status_url}
+
+def _procesar_diagnostico(job, checkpoint):
+    """Pasos del trabajo; cada uno guarda su resultado para que un reintento no lo repita."""
+    datos = job["payload"]
+    if job.get("image_file") and not datos.get("imagen_url"):
+        with open(job["image_file"], "rb") as fh:
+            subida = _upload_file_storage(FileStorage(stream=fh), datos["idUsuario"], job["image_ext"],
+                                          datos.get("content_type") or "image/jpeg")
+        datos["imagen_url"], datos["thumbnail_url"] = subida["image_url"], subida["thumbnail_url"]
+        checkpoint("uploaded", payload=datos)
+
+    if not job.get("diagnosis"):
+        fila = {"imagen_url": datos["imagen_url"], "idusuario": datos["idUsuario"], "diagnostico": datos["diagnostico"]}
+        if datos.get("thumbnail_url") and diagnoses.THUMBNAIL_COLUMN: fila["thumbnail_url"] = datos["thumbnail_url"]
+        resp = supabase.table("diagnostico_foto").insert(fila).execute()
+        checkpoint("inserted", diagnosis=(resp.data or [{}])[0])
+
+    # upsert con ignore_duplicates: repetir este paso no duplica alertas
+    alertas_configuradas = alerts.plantillas_de(supabase, datos["diagnostico"])
+    generadas, existentes = alerts.generar_alertas_usuario(
+        supabase, datos["idUsuario"], alertas_configuradas, datetime.now()) if alertas_configuradas else (0, 0)
+    return {
+        "diagnosis_details": job["diagnosis"],
+        "image_url": datos["imagen_url"],
+        "thumbnail_url": datos.get("thumbnail_url"),
+        "alerts_generated": generadas,
+        "alerts_existing": existentes
+    }
+
+diagnostic_queue = diagnostic_jobs.JobQueue(_procesar_diagnostico)
+
+def init_worker():
+    """
+    Arranca los hilos de fondo del proceso que atiende peticiones (gunicorn lo
+    llama en post_worker_init, ya con gevent parcheado; el servidor de desarrollo, en __main__). Importar app
+    no arranca nada: así el master con preload, el CLI y loadtest no lanzan
+    workers de diagnóstico.
+    """
+    diagnostic_queue.start()  # retoma trabajos que otro proceso dejó a medias
+    if os.getenv("SUPABASE_FAKE") != "1":
+        alert_events.start_bus(NEXT_PUBLIC_SUPABASE_URL, NEXT_PUBLIC_SUPABASE_ANON_KEY)
+
+@app.route("/diagnostic/jobs/<job_id>", methods=["GET"])
+def diagnostic_job_status(job_id):
+    job = diagnostic_queue.get(job_id)
+    if job is None: return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify({k: job.get(k) for k in ("id", "status", "step", "attempts", "error", "result",
+                                            "retry_in_seconds", "created_at", "updated_at")}), 200
+
+# ===== 2c) POST /diagnostic/batch =====
+@app.route("/diagnostic/batch", methods=["POST"])
+def create_diagnostic_batch():
+    """
+    Varios diagnósticos en una petición: multipart (campo "items" + una parte
+    por foto) o NDJSON (Content-Type: application/x-ndjson, foto en base64).
+    """
+    if supabase is None: return jsonify({"success": False, "error": "Error interno (Supabase)"}), 500
+    try:
+        if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+            items = diagnostic_batch.parse_ndjson(request.stream)
+        else:
+            items = diagnostic_batch.parse_multipart(request.form, request.files)
+        response, status_code = diagnostic_batch.ingest(supabase, items, _upload_file_storage)
+        return jsonify(response), status_code
+    except diagnostic_batch.BatchError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        print(f"🚨 Error en POST /diagnostic/batch: {e}")
+        print(traceback.format_exc())
+        return jsonify({"success": False, "error": "Error interno al registrar diagnósticos"}), 500
+
+
 @app.route("/diagnoses", methods=["GET"])
 def list_diagnoses():
     if supabase is None: return jsonify({"error": "Error interno (Supabase)"}), 500
     # Usa consistentemente 'idusuario'
     id_usuario_key = "idusuario"
     id_usuario = request.args.get(id_usuario_key)
+
+    # Paginación por llave: ?cursor= (vacío en la primera página) y ?limit=N
+    if "cursor" in request.args:
+        try:
+            limit = int(request.args.get("limit", diagnoses.PAGE_DEFAULT))
+        except ValueError:
+            return jsonify({"error": "'limit' debe ser un entero"}), 400
+        if not 1 <= limit <= diagnoses.PAGE_MAX:
+            return jsonify({"error": f"'limit' debe estar entre 1 y {diagnoses.PAGE_MAX}"}), 400
+        include_diseases = request.args.get("include_diseases", "1") != "0"
+        try:
+            return jsonify(diagnoses.pagina(supabase, id_usuario, request.args.get("cursor") or None,
+                                            limit, include_diseases)), 200
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            print(f"🚨 Error en GET /diagnoses (cursor): {e}")
+            print(traceback.format_exc())
+            return jsonify({"error": f"Error interno al listar diagnósticos: {str(e)}"}), 500
+
     limit = int(request.args.get("limit", "50"))
     offset = int(request.args.get("offset", "0"))
     try:
         select_query = (
-            "iddiagnostico, imagen_url, fecha, idusuario, diagnostico, " # Columnas de diagnostico_foto
+            diagnoses.COLUMNS + ", " # Columnas de diagnostico_foto
             "diagnostico!inner(descripcion, causas, prevencion, tratamiento)" # JOIN a tabla diagnostico
         )
         q = supabase.table("diagnostico_foto").select(select_query).order("fecha", desc=True)
@@ -400,7 +865,31 @@ def list_diagnoses():
         print(traceback.format_exc())
         return jsonify({"error": f"Error interno al listar diagnósticos: {str(e)}"}), 500
 
+@app.route("/diagnoses/diseases", methods=["GET"])
+def list_disease_descriptions():
+    """Textos de todas las enfermedades (estáticos): el cliente los guarda y pide /diagnoses con include_diseases=0."""
+    if supabase is None: return jsonify({"error": "Error interno (Supabase)"}), 500
+    try:
+        resp = jsonify(diagnoses.descripciones(supabase))
+        resp.headers["Cache-Control"] = f"public, max-age={int(diagnoses.DESCRIPTIONS_TTL_SECONDS)}"
+        return resp, 200
+    except Exception as e:
+        print(f"🚨 Error en GET /diagnoses/diseases: {e}")
+        return jsonify({"error": "Error al obtener descripciones"}), 500
+
+@app.route("/diagnoses/diseases/cache", methods=["GET"])
+def disease_descriptions_cache_stats():
+    return jsonify({"descripciones": diagnoses.descriptions_cache_stats()})
+
+@app.route("/diagnoses/diseases/cache/invalidate", methods=["POST"])
+def disease_descriptions_cache_invalidate():
+    if not _job_authorized(): return jsonify({"success": False, "error": "No autorizado"}), 403
+    diagnoses.invalidate_descriptions_cache()
+    return jsonify({"success": True, "message": "Cache de descripciones de enfermedades invalidada"})
+
 # --- Inicio de la Aplicación  ---
 if __name__ == "__main__":
     print("Iniciando servidor Flask para desarrollo local...")
+    # con debug el reloader relanza el script: solo el proceso hijo atiende peticiones
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true": init_worker()
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5050)), debug=True)
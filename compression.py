@@ -0,0 +1,48 @@
+# compression.py
+# Compresión gzip/brotli negociada con Accept-Encoding para respuestas
+# JSON/texto a partir de COMPRESS_MIN_BYTES. No toca respuestas en streaming
+# (p. ej. /alerts/stream) ni las que ya traen Content-Encoding.
+from __future__ import annotations
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:  # dependencia opcional: sin ella solo gzip
+    brotli = None
+
+ENABLED = os.getenv("COMPRESS_ENABLED", "1") == "1"
+MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+MIMETYPES = {"application/json", "application/x-ndjson", "text/plain", "text/html", "text/csv"}
+
+def encodings():
+    return (["br"] if brotli is not None else []) + ["gzip"]
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br": return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+def _compressible(response) -> bool:
+    return (response.mimetype in MIMETYPES
+            and not response.direct_passthrough and not response.is_streamed
+            and "Content-Encoding" not in response.headers
+            and "no-transform" not in response.headers.get("Cache-Control", "")
+            and response.status_code not in (204, 304))
+
+def init_app(app) -> None:
+    if not ENABLED: return
+    from flask import request
+
+    @app.after_request
+    def _compress(response):
+        if not _compressible(response): return response
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(encodings())
+        if encoding is None or request.method == "HEAD": return response
+        data = response.get_data()
+        if len(data) < MIN_BYTES: return response
+        response.set_data(compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,45 @@
+# cursors.py
+# Cursores opacos para paginación por llave (keyset): (marca de tiempo, id)
+# codificados en base64 y el filtro or_() de PostgREST que continúa después.
+from __future__ import annotations
+from typing import Tuple
+from datetime import datetime
+from uuid import UUID
+import base64
+import json
+
+def encode(ts: str, row_id) -> str:
+    raw = json.dumps({"t": ts, "id": str(row_id)}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode(cursor: str) -> Tuple[str, str]:
+    """
+    Devuelve (ts, id); lanza ValueError si el cursor no es válido. Ambos se
+    normalizan (fecha ISO y UUID) porque after() los pone tal cual en el
+    filtro: un cursor alterado no puede cambiar la consulta.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["t"]).isoformat(), str(UUID(data["id"]))
+    except Exception:
+        raise ValueError("cursor inválido")
+
+def encode_id(row_id) -> str:
+    """Cursor solo con el id, para tablas que se recorren por su llave primaria."""
+    raw = json.dumps({"id": str(row_id)}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_id(cursor: str) -> str:
+    """Devuelve el id normalizado como UUID; lanza ValueError si el cursor no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return str(UUID(json.loads(raw)["id"]))
+    except Exception:
+        raise ValueError("cursor inválido")
+
+def after(ts_col: str, id_col: str, position: Tuple[str, str], desc: bool = False) -> str:
+    """Filtro para or_(): filas estrictamente después de position en el orden (ts_col, id_col)."""
+    ts, row_id = position
+    op = "lt" if desc else "gt"
+    return f'{ts_col}.{op}."{ts}",and({ts_col}.eq."{ts}",{id_col}.{op}.{row_id})'
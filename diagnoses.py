@@ -0,0 +1,96 @@
+# diagnoses.py
+# Historial de diagnósticos paginado por llave (fecha, iddiagnostico).
+# Los textos de cada enfermedad (tabla diagnostico) son estáticos: se cargan
+# una vez por worker y se mandan una sola vez por página, no en cada fila.
+from __future__ import annotations
+from typing import Any, Dict, Optional
+import os
+import threading
+import time
+import cursors
+
+PAGE_DEFAULT = 50
+PAGE_MAX = 200
+# diagnostico_foto.thumbnail_url sale de tablas.sql; se lee y escribe solo con
+# 1, una vez aplicada la migración (sin ella las miniaturas se siguen subiendo
+# y devolviendo, pero no quedan guardadas en la fila)
+THUMBNAIL_COLUMN = os.getenv("DIAGNOSES_THUMBNAIL_COLUMN", "0") == "1"
+COLUMNS = "iddiagnostico, imagen_url, " + ("thumbnail_url, " if THUMBNAIL_COLUMN else "") + "fecha, idusuario, diagnostico"
+_JOIN_ENFERMEDAD = "enfermedad:diagnostico!inner(diagnostico)"
+DESCRIPTION_COLUMNS = "diagnostico, descripcion, causas, prevencion, tratamiento"
+DESCRIPTIONS_TTL_SECONDS = float(os.getenv("DIAGNOSES_DESCRIPTIONS_TTL_SECONDS", "3600"))
+
+# ---------- Cache de descripciones ----------
+_desc_lock = threading.Lock()
+_desc_cache = {"data": None, "loaded_at": 0.0, "hits": 0, "misses": 0, "generation": 0}
+
+def _cargar_descripciones(supabase) -> Dict[str, Dict[str, Any]]:
+    resp = supabase.table("diagnostico").select(DESCRIPTION_COLUMNS).execute()
+    out = {}
+    for fila in resp.data or []:
+        fila = dict(fila)
+        out[fila.pop("diagnostico")] = fila
+    return out
+
+def descripciones(supabase) -> Dict[str, Dict[str, Any]]:
+    """{diagnostico: {descripcion, causas, prevencion, tratamiento}} desde la cache del worker."""
+    with _desc_lock:
+        data = _desc_cache["data"]
+        if data is not None and time.monotonic() - _desc_cache["loaded_at"] < DESCRIPTIONS_TTL_SECONDS:
+            _desc_cache["hits"] += 1
+            return data
+        _desc_cache["misses"] += 1
+        generation = _desc_cache["generation"]
+    data = _cargar_descripciones(supabase)
+    with _desc_lock:
+        # Si se invalidó mientras se cargaba, estos datos pueden ser previos al cambio: no se guardan
+        if _desc_cache["generation"] == generation:
+            _desc_cache["data"] = data
+            _desc_cache["loaded_at"] = time.monotonic()
+    return data
+
+def invalidate_descriptions_cache() -> None:
+    with _desc_lock:
+        _desc_cache["data"] = None
+        _desc_cache["loaded_at"] = 0.0
+        _desc_cache["generation"] += 1
+
+def descriptions_cache_stats() -> Dict[str, Any]:
+    with _desc_lock:
+        data = _desc_cache["data"]
+        return {
+            "hits": _desc_cache["hits"],
+            "misses": _desc_cache["misses"],
+            "diseases": len(data) if data is not None else 0,
+            "age_seconds": time.monotonic() - _desc_cache["loaded_at"] if data is not None else None,
+            "ttl_seconds": DESCRIPTIONS_TTL_SECONDS,
+        }
+
+# ---------- Página por llave ----------
+def pagina(supabase, id_usuario: Optional[str] = None, cursor: Optional[str] = None,
+           limit: int = PAGE_DEFAULT, include_diseases: bool = True) -> Dict[str, Any]:
+    """
+    Diagnósticos del más reciente al más antiguo, después del cursor (None = primera página).
+    Devuelve {"items", "diseases", "next_cursor", "has_more"}; "diseases" trae
+    solo las enfermedades que aparecen en la página.
+    Lanza ValueError si el cursor no es válido.
+    """
+    # Mismo filtro que el listado por offset: solo diagnósticos cuya enfermedad
+    # existe en la tabla diagnostico (el embed !inner hace de join y se descarta)
+    q = supabase.table("diagnostico_foto").select(COLUMNS + ", " + _JOIN_ENFERMEDAD)
+    if id_usuario: q = q.eq("idusuario", id_usuario)
+    if cursor: q = q.or_(cursors.after("fecha", "iddiagnostico", cursors.decode(cursor), desc=True))
+    filas = q.order("fecha", desc=True).order("iddiagnostico", desc=True).limit(limit + 1).execute().data or []
+
+    has_more = len(filas) > limit
+    filas = filas[:limit]
+    for f in filas: f.pop("enfermedad", None)
+    out: Dict[str, Any] = {
+        "items": filas,
+        "next_cursor": cursors.encode(filas[-1]["fecha"], filas[-1]["iddiagnostico"]) if has_more else None,
+        "has_more": has_more,
+    }
+    if include_diseases:
+        textos = descripciones(supabase)
+        out["diseases"] = {d: textos.get(d) for d in sorted({f["diagnostico"] for f in filas if f.get("diagnostico")})}
+    return out
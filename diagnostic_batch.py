@@ -0,0 +1,202 @@
+# diagnostic_batch.py
+# POST /diagnostic/batch: muchos diagnósticos capturados sin conexión en una
+# sola petición (multipart o NDJSON). Las fotos se suben en un pool propio
+# del worker (no el de fanout: una subida puede tardar minutos y dejaría sin
+# hilos a las lecturas de /risk) y diagnostico_foto / usuarioalerta se
+# escriben en bloque.
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+import base64
+import binascii
+import contextvars
+import json
+import os
+import tempfile
+import threading
+from werkzeug.datastructures import FileStorage
+import alerts
+import diagnoses
+import uploads
+
+MAX_ITEMS = int(os.getenv("DIAGNOSTIC_BATCH_MAX_ITEMS", "100"))
+# Subidas simultáneas por worker, sumando todos los lotes en curso
+UPLOAD_CONCURRENCY = int(os.getenv("DIAGNOSTIC_BATCH_UPLOAD_CONCURRENCY", "4"))
+# Por lote, contando la espera en la cola del pool
+UPLOAD_TIMEOUT = float(os.getenv("DIAGNOSTIC_BATCH_UPLOAD_TIMEOUT_SECONDS", "120"))
+
+# upload(f, owner, ext, content_type) -> {"image_url", "thumbnail_url", ...} (ver app._upload_file_storage)
+Uploader = Callable[[FileStorage, str, str, str], Dict[str, Any]]
+
+_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid: Optional[int] = None
+
+def get_pool() -> ThreadPoolExecutor:
+    """Crea el pool de subidas la primera vez (y de nuevo tras un fork del worker)."""
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=max(1, UPLOAD_CONCURRENCY), thread_name_prefix="batch-upload")
+            _pool_pid = os.getpid()
+        return _pool
+
+def shutdown(wait_pending: bool = True) -> None:
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait_pending, cancel_futures=not wait_pending)
+            _pool = None
+
+class BatchError(Exception):
+    """Petición mal formada en conjunto (no un elemento en particular)."""
+
+# ---------- Lectura de la petición ----------
+def parse_multipart(form, files) -> List[Dict[str, Any]]:
+    """
+    Campo "items": arreglo JSON con los metadatos; cada elemento nombra en
+    "file" la parte del multipart con su foto (o trae "imagen_url").
+    """
+    try:
+        items = json.loads(form.get("items") or "")
+    except ValueError:
+        raise BatchError("El campo 'items' debe ser un arreglo JSON")
+    if not isinstance(items, list): raise BatchError("El campo 'items' debe ser un arreglo JSON")
+    out = []
+    for item in items:
+        if not isinstance(item, dict): item = {"_error": "Elemento inválido"}
+        parte = item.get("file")
+        if parte:
+            f = files.get(parte)
+            if f is None or not f.filename: item = {**item, "_error": f"No se encontró la parte '{parte}'"}
+            else: item = {**item, "_file": f}
+        out.append(item)
+    return out
+
+def _decode_image(b64: str, ext: str) -> FileStorage:
+    size = len(b64) * 3 // 4
+    if size > uploads.MAX_UPLOAD_BYTES + 3: raise uploads.UploadTooLarge(size)
+    spool = tempfile.SpooledTemporaryFile(max_size=uploads.SPOOL_BYTES, dir=uploads.SPOOL_DIR)
+    spool.write(base64.b64decode(b64, validate=True))
+    spool.seek(0)
+    return FileStorage(stream=spool, filename=f"foto.{ext}")
+
+def parse_ndjson(stream) -> List[Dict[str, Any]]:
+    """Un objeto JSON por línea; la foto va en "image_base64" (o "imagen_url")."""
+    out = []
+    for n, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line: continue
+        if len(out) >= MAX_ITEMS: raise BatchError(f"Máximo {MAX_ITEMS} diagnósticos por solicitud")
+        try:
+            item = json.loads(line)
+            if not isinstance(item, dict): raise ValueError()
+        except ValueError:
+            out.append({"_error": f"Línea {n}: JSON inválido"}); continue
+        b64 = item.pop("image_base64", None)
+        if b64:
+            try: item["_file"] = _decode_image(b64, item.get("ext") or "jpg")
+            except (binascii.Error, ValueError): item["_error"] = "image_base64 inválido"
+            except uploads.UploadTooLarge as e: item["_error"] = str(e)
+        out.append(item)
+    return out
+
+# ---------- Ingesta ----------
+def _validar(item: Dict[str, Any]) -> Optional[str]:
+    if item.get("_error"): return item["_error"]
+    if not item.get("idUsuario") or not item.get("diagnostico"): return "idUsuario y diagnostico son requeridos"
+    if not item.get("_file") and not item.get("imagen_url"): return "Se requiere una foto o imagen_url"
+    if item.get("_file"):
+        # "ext" del elemento (o el nombre del archivo) pasa a la ruta en Storage: solo extensiones permitidas
+        f = item["_file"]
+        ext = uploads.safe_ext(f"foto.{item['ext']}") if item.get("ext") else uploads.safe_ext(f.filename, f.mimetype)
+        if ext is None: return uploads.EXTENSION_ERROR
+        item["ext"] = ext
+    if item.get("fecha"):
+        try: datetime.fromisoformat(str(item["fecha"]))
+        except ValueError: return "fecha debe ser ISO 8601"
+    return None
+
+def _subir(upload: Uploader, item: Dict[str, Any]) -> Dict[str, Any]:
+    f = item["_file"]
+    return upload(f, str(item["idUsuario"]), item["ext"], f.mimetype or "image/jpeg")
+
+def _insertar(supabase, filas: List[Dict[str, Any]]) -> List[Any]:
+    """
+    Inserta en bloque; agrupa por columnas para que PostgREST no ponga NULL en
+    las que faltan. Devuelve por fila la insertada o la excepción de su grupo:
+    si un grupo falla, los anteriores ya quedaron guardados y no se reportan
+    como fallidos (el cliente los duplicaría al reintentar).
+    """
+    grupos: Dict[Tuple[str, ...], List[int]] = {}
+    for i, fila in enumerate(filas): grupos.setdefault(tuple(sorted(fila)), []).append(i)
+    insertadas: List[Any] = [{} for _ in filas]
+    for indices in grupos.values():
+        try:
+            resp = supabase.table("diagnostico_foto").insert([filas[i] for i in indices]).execute()
+        except Exception as e:
+            print(f"🚨 Error al insertar {len(indices)} diagnósticos del lote: {e}")
+            for i in indices: insertadas[i] = e
+            continue
+        for i, fila in zip(indices, resp.data or []): insertadas[i] = fila
+    return insertadas
+
+def ingest(supabase, items: List[Dict[str, Any]], upload: Uploader) -> Tuple[Dict[str, Any], int]:
+    """Devuelve tupla: (dict con un resultado por elemento, status_code)"""
+    if not items: return ({"success": False, "error": "No se recibieron diagnósticos"}, 400)
+    if len(items) > MAX_ITEMS: return ({"success": False, "error": f"Máximo {MAX_ITEMS} diagnósticos por solicitud"}, 413)
+
+    resultados: List[Dict[str, Any]] = []
+    for i, item in enumerate(items):
+        error = _validar(item)
+        resultados.append({"index": i, "client_id": item.get("client_id"),
+                           "status": "invalid" if error else "pending", "error": error})
+
+    # 1) Fotos en el pool de subidas (acotado por worker entre todos los lotes)
+    por_subir = [i for i, r in enumerate(resultados) if r["status"] == "pending" and items[i].get("_file")]
+    pool = get_pool()
+    futures = {pool.submit(contextvars.copy_context().run, _subir, upload, items[i]): i for i in por_subir}
+    _, pending = wait(futures, timeout=UPLOAD_TIMEOUT)
+    for f, i in futures.items():
+        if f in pending:
+            f.cancel()
+            resultados[i].update(status="upload_failed", error=f"La subida no terminó en {UPLOAD_TIMEOUT:g}s")
+        elif f.exception() is not None:
+            resultados[i].update(status="upload_failed", error=str(f.exception()))
+        else:
+            subida = f.result()
+            items[i]["imagen_url"], items[i]["thumbnail_url"] = subida["image_url"], subida["thumbnail_url"]
+
+    # 2) Un insert para todos los diagnósticos
+    listos = [i for i, r in enumerate(resultados) if r["status"] == "pending"]
+    filas = []
+    for i in listos:
+        it = items[i]
+        fila = {"imagen_url": it["imagen_url"], "idusuario": it["idUsuario"], "diagnostico": it["diagnostico"]}
+        if it.get("thumbnail_url") and diagnoses.THUMBNAIL_COLUMN: fila["thumbnail_url"] = it["thumbnail_url"]
+        if it.get("fecha"): fila["fecha"] = it["fecha"]
+        filas.append(fila)
+    insertadas = _insertar(supabase, filas) if filas else []
+    for i, fila in zip(listos, insertadas):
+        if isinstance(fila, Exception):
+            resultados[i].update(status="insert_failed", error=str(fila))
+        else:
+            resultados[i].update(status="created", diagnosis_details=fila,
+                                 image_url=items[i]["imagen_url"], thumbnail_url=items[i].get("thumbnail_url"))
+    listos = [i for i in listos if resultados[i]["status"] == "created"]
+
+    # 3) Un upsert para las alertas de todos (fecha de captura si vino, si no ahora)
+    try:
+        pares = [(items[i]["idUsuario"], alerts.plantillas_de(supabase, items[i]["diagnostico"]),
+                  datetime.fromisoformat(str(items[i]["fecha"])) if items[i].get("fecha") else datetime.now())
+                 for i in listos]
+        for i, (generadas, existentes) in zip(listos, alerts.generar_alertas_lote(supabase, pares) if pares else []):
+            resultados[i].update(alerts_generated=generadas, alerts_existing=existentes)
+    except Exception as e:
+        for i in listos: resultados[i]["error_alertas"] = str(e)
+
+    resumen: Dict[str, int] = {}
+    for r in resultados: resumen[r["status"]] = resumen.get(r["status"], 0) + 1
+    status = 201 if resumen.get("created") == len(resultados) else 207
+    return ({"success": bool(resumen.get("created")), "results": resultados, "summary": resumen}, status)
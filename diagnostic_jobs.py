@@ -0,0 +1,189 @@
+# diagnostic_jobs.py
+# Cola de trabajos en segundo plano para POST /diagnostic en modo asíncrono.
+# La petición solo guarda la foto en disco y responde 202; hilos del worker
+# hacen la subida, el insert y las alertas con reintentos. El estado de cada
+# trabajo es un JSON en JOBS_DIR, así cualquier worker del contenedor puede
+# responder GET /diagnostic/jobs/<id> y un trabajo interrumpido se retoma.
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+from uuid import uuid4
+import fcntl
+import heapq
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uploads
+
+JOBS_DIR = os.getenv("DIAGNOSTIC_JOBS_DIR") or os.path.join(tempfile.gettempdir(), "pearco-diagnostic-jobs")
+WORKERS = int(os.getenv("DIAGNOSTIC_JOB_WORKERS", "2"))
+MAX_ATTEMPTS = int(os.getenv("DIAGNOSTIC_JOB_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = float(os.getenv("DIAGNOSTIC_JOB_RETRY_SECONDS", "2"))
+KEEP_SECONDS = float(os.getenv("DIAGNOSTIC_JOB_KEEP_SECONDS", str(24 * 3600)))
+
+PENDING = ("queued", "running", "retrying")
+
+class PermanentError(Exception):
+    """Error que no se arregla reintentando (el trabajo pasa directo a failed)."""
+
+# handler(job, checkpoint) -> resultado; checkpoint(step, **campos) guarda el avance
+Handler = Callable[[Dict[str, Any], Callable[..., None]], Dict[str, Any]]
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+class JobQueue:
+    def __init__(self, handler: Handler, jobs_dir: str = JOBS_DIR, workers: int = WORKERS):
+        self._handler = handler
+        self._dir = jobs_dir
+        self._workers = workers
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[float, int, str]] = []
+        self._scheduled: set = set()  # ids en el heap: recover() no los encola dos veces
+        self._seq = 0
+        self._pid: Optional[int] = None
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+
+    # ---------- Archivos ----------
+    def _path(self, job_id: str, suffix: str = ".json") -> str:
+        return os.path.join(self._dir, f"{job_id}{suffix}")
+
+    def _save(self, job: Dict[str, Any]) -> None:
+        job["updated_at"] = _now()
+        tmp = self._path(job["id"], f".json.{os.getpid()}.{threading.get_ident()}")
+        with open(tmp, "w") as fh: json.dump(job, fh, default=str)
+        os.replace(tmp, self._path(job["id"]))  # atómico: los lectores nunca ven un JSON a medias
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if not job_id or "/" in job_id or job_id.startswith("."): return None
+        try:
+            with open(self._path(job_id)) as fh: return json.load(fh)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    # ---------- Alta ----------
+    def submit(self, payload: Dict[str, Any], image=None, ext: str = "jpg") -> Dict[str, Any]:
+        """
+        Registra un trabajo. image puede ser bytes o un archivo abierto; se copia
+        a JOBS_DIR por trozos antes de responder. Devuelve el trabajo.
+        """
+        # ext termina en un nombre de archivo: solo las de uploads.safe_ext
+        if ext not in uploads.ALLOWED_EXTENSIONS: raise ValueError(uploads.EXTENSION_ERROR)
+        self.start()
+        job_id = uuid4().hex
+        job = {"id": job_id, "status": "queued", "step": "accepted", "attempts": 0,
+               "payload": payload, "image_file": None, "image_ext": ext, "result": None,
+               "error": None, "created_at": _now()}
+        if image is not None:
+            job["image_file"] = self._path(job_id, f".{ext}")
+            with open(job["image_file"], "wb") as out:
+                if isinstance(image, (bytes, bytearray)): out.write(image)
+                else: shutil.copyfileobj(image, out, 64 * 1024)
+        self._save(job)
+        self._schedule(job_id, 0.0)
+        return job
+
+    # ---------- Ejecución ----------
+    def start(self) -> None:
+        """Arranca los hilos (de nuevo tras un fork) y retoma trabajos huérfanos."""
+        with self._cond:
+            if self._pid == os.getpid(): return
+            os.makedirs(self._dir, exist_ok=True)
+            self._pid = os.getpid(); self._heap = []; self._scheduled = set(); self._stopping = False
+            self._threads = [threading.Thread(target=self._loop, name=f"diagnostic-job-{i}", daemon=True)
+                             for i in range(self._workers)]
+            for t in self._threads: t.start()
+        self.recover()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for t in self._threads: t.join(timeout)
+
+    def _schedule(self, job_id: str, delay: float) -> None:
+        with self._cond:
+            if job_id in self._scheduled: return
+            self._scheduled.add(job_id)
+            self._seq += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._seq, job_id))
+            self._cond.notify()
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopping and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    self._cond.wait(None if not self._heap else self._heap[0][0] - time.monotonic())
+                if self._stopping: return
+                _, _, job_id = heapq.heappop(self._heap)
+                self._scheduled.discard(job_id)
+            try: self._run(job_id)
+            except Exception as e: print(f"🚨 Error en trabajo de diagnóstico {job_id}: {e}")
+
+    def _run(self, job_id: str) -> None:
+        # flock: un solo proceso procesa cada trabajo; se libera solo si el proceso muere
+        with open(self._path(job_id, ".lock"), "w") as lock:
+            try: fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError: return
+            job = self.get(job_id)
+            if job is None or job["status"] not in PENDING: return
+            # otro proceso también lo encoló y ya hizo un intento: se respeta su espera
+            wait = job.get("next_attempt_at", 0) - time.time()
+            if job["status"] == "retrying" and wait > 0:
+                self._schedule(job_id, wait)
+                return
+
+            def checkpoint(step: str, **fields) -> None:
+                job.update(fields); job["step"] = step
+                self._save(job)
+
+            job["status"] = "running"; job["attempts"] += 1
+            self._save(job)
+            try:
+                result = self._handler(job, checkpoint)
+            except Exception as e:
+                job["error"] = str(e)
+                if isinstance(e, PermanentError) or job["attempts"] >= MAX_ATTEMPTS:
+                    job["status"] = "failed"
+                    self._save(job)
+                    return
+                delay = RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1)
+                job["status"] = "retrying"; job["retry_in_seconds"] = delay
+                job["next_attempt_at"] = time.time() + delay  # hora de pared: sobrevive a reinicios
+                self._save(job)
+                self._schedule(job_id, delay)
+                return
+
+            job.update({"status": "done", "step": "done", "result": result, "error": None})
+            job.pop("retry_in_seconds", None); job.pop("next_attempt_at", None)
+            if job.get("image_file"):
+                try: os.remove(job["image_file"])
+                except FileNotFoundError: pass
+                job["image_file"] = None
+            self._save(job)
+
+    def recover(self) -> int:
+        """Encola los trabajos pendientes sin dueño vivo y borra los terminados viejos. Devuelve cuántos encoló."""
+        requeued = 0
+        cutoff = time.time() - KEEP_SECONDS
+        for name in os.listdir(self._dir):
+            if not name.endswith(".json"): continue
+            job_id = name[:-5]
+            job = self.get(job_id)
+            if job is None: continue
+            if job["status"] in PENDING:
+                # si otro proceso lo tiene tomado, _run lo salta; los "retrying" esperan su backoff
+                self._schedule(job_id, max(0.0, job.get("next_attempt_at", 0) - time.time())); requeued += 1
+            elif os.path.getmtime(self._path(job_id)) < cutoff:
+                for suffix in (".json", ".lock", f".{job.get('image_ext', 'jpg')}"):
+                    try: os.remove(self._path(job_id, suffix))
+                    except FileNotFoundError: pass
+        return requeued
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {"scheduled": len(self._scheduled), "workers": len(self._threads), "pid": self._pid}
@@ -0,0 +1,421 @@
+# fake_supabase.py
+# Sustituto local en memoria del cliente de Supabase para pruebas de carga.
+# Implementa el subconjunto del query builder que usan los módulos
+# (table().select/insert/update/upsert/delete/eq/in_/or_/order/range/limit,
+# rpc("get_alerts", "crear_parcelas"), storage.from_().upload/get_public_url) y agrega
+# latencia configurable por llamada para simular la red.
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+from uuid import UUID, uuid4
+import copy
+import random
+import threading
+import time
+from storage3.exceptions import StorageApiError
+
+# Llave primaria generada al insertar, por tabla
+PRIMARY_KEYS = {
+    "ubicacion": "idubicacion",
+    "parcela": "idparcela",
+    "alertas": "idalerta",
+    "usuarios": "idusuario",
+    "diagnostico_foto": "iddiagnostico",
+}
+# Embeds de PostgREST: (tabla, recurso) -> (columna local, columna remota, tabla remota)
+RELATIONS = {
+    ("parcela", "ubicacion"): ("idubicacion", "idubicacion", "ubicacion"),
+    ("diagnostico_foto", "diagnostico"): ("diagnostico", "diagnostico", "diagnostico"),
+    ("usuarioalerta", "alertas"): ("idalerta", "idalerta", "alertas"),
+}
+# Triggers de tablas.sql: columna que se sella en cada escritura y
+# tabla de bajas (tabla, columnas copiadas, columna de fecha) al borrar
+TOUCH_COLUMNS = {"usuarioalerta": "actualizado_en"}
+TOMBSTONES = {"usuarioalerta": ("usuarioalerta_eliminada", ("idusuario", "idalerta"), "eliminado_en")}
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+class FakeResponse:
+    # Como APIResponse de postgrest: caficultores.py todavía revisa response.error
+    error = None
+
+    def __init__(self, data: List[Dict[str, Any]], count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+# ---------- Utilidades ----------
+def _split_top(s: str) -> List[str]:
+    """Separa por comas que no estén dentro de paréntesis."""
+    parts, depth, cur = [], 0, ""
+    for ch in s:
+        if ch == "(": depth += 1
+        elif ch == ")": depth -= 1
+        if ch == "," and depth == 0:
+            parts.append(cur.strip()); cur = ""
+        else: cur += ch
+    if cur.strip(): parts.append(cur.strip())
+    return parts
+
+def _parse_logic(expr: str) -> List[Tuple[str, Any, Any]]:
+    """Convierte el argumento de or_() ("col.op.valor,and(...)") en condiciones."""
+    conds = []
+    for part in _split_top(expr):
+        if part.startswith(("and(", "or(")):
+            op, inner = part.split("(", 1)
+            conds.append((op, None, _parse_logic(inner[:-1])))
+            continue
+        column, op, value = part.split(".", 2)
+        if op == "in": value = [v.strip().strip('"') for v in value.strip("()").split(",")]
+        else: value = value.strip('"')
+        conds.append((op, column, value))
+    return conds
+
+def _coerce(a, b):
+    """Compara números como números y el resto como texto (como llegan por la URL)."""
+    if isinstance(a, bool) or isinstance(b, bool): return str(a).lower(), str(b).lower()
+    try: return float(a), float(b)
+    except (TypeError, ValueError): return str(a), str(b)
+
+def _cmp(op: str, value, arg) -> bool:
+    if op == "is":
+        return value is None if str(arg).lower() == "null" else str(value).lower() == str(arg).lower()
+    if value is None: return False
+    if op == "in": return any(_cmp("eq", value, a) for a in arg)
+    a, b = _coerce(value, arg)
+    return {"eq": a == b, "neq": a != b, "gt": a > b, "gte": a >= b, "lt": a < b, "lte": a <= b}[op]
+
+# ---------- Query builder ----------
+class FakeQuery:
+    def __init__(self, db: "FakeSupabase", table: str):
+        self._db = db
+        self._table = table
+        self._op = "select"
+        self._columns = "*"
+        self._payload: Any = None
+        self._filters: List[Tuple[str, str, Any]] = []
+        self._order: List[Tuple[str, bool]] = []
+        self._offset = 0
+        self._limit: Optional[int] = None
+        self._on_conflict: List[str] = []
+        self._ignore_duplicates = False
+        self._count: Optional[str] = None
+
+    # --- operaciones ---
+    def select(self, columns: str = "*", count: Optional[str] = None):
+        self._columns = columns; self._count = count
+        return self
+
+    def insert(self, json, **kwargs):
+        self._op = "insert"; self._payload = json
+        return self
+
+    def upsert(self, json, on_conflict: str = "", ignore_duplicates: bool = False, **kwargs):
+        self._op = "upsert"; self._payload = json
+        self._on_conflict = [c.strip() for c in on_conflict.split(",") if c.strip()]
+        self._ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, json, **kwargs):
+        self._op = "update"; self._payload = json
+        return self
+
+    def delete(self, **kwargs):
+        self._op = "delete"
+        return self
+
+    # --- filtros ---
+    def _filter(self, op, column, value):
+        self._filters.append((op, column, value))
+        return self
+
+    def eq(self, column, value): return self._filter("eq", column, value)
+    def neq(self, column, value): return self._filter("neq", column, value)
+    def gt(self, column, value): return self._filter("gt", column, value)
+    def gte(self, column, value): return self._filter("gte", column, value)
+    def lt(self, column, value): return self._filter("lt", column, value)
+    def lte(self, column, value): return self._filter("lte", column, value)
+    def is_(self, column, value): return self._filter("is", column, value)
+    def in_(self, column, values): return self._filter("in", column, list(values))
+    def or_(self, filters: str, **kwargs): return self._filter("or", None, _parse_logic(filters))
+
+    def order(self, column, desc: bool = False, **kwargs):
+        self._order.append((column, desc))
+        return self
+
+    def range(self, start: int, end: int):
+        self._offset = start; self._limit = end - start + 1
+        return self
+
+    def limit(self, size: int):
+        self._limit = size
+        return self
+
+    # --- ejecución ---
+    def _eval(self, cond, row) -> bool:
+        op, col, arg = cond
+        if op == "or": return any(self._eval(c, row) for c in arg)
+        if op == "and": return all(self._eval(c, row) for c in arg)
+        return _cmp(op, row.get(col), arg)
+
+    def _matches(self, row) -> bool:
+        return all(self._eval(f, row) for f in self._filters)
+
+    def _project(self, row: Dict[str, Any], columns: str, table: str) -> Optional[Dict[str, Any]]:
+        out: Dict[str, Any] = {}
+        for part in _split_top(columns):
+            if "(" in part:
+                name, inner = part.split("(", 1)
+                name, _, modifier = name.partition("!")
+                alias, _, name = name.strip().rpartition(":")  # alias:relacion!inner(...)
+                rel = RELATIONS.get((table, name.strip()))
+                if rel is None: continue
+                local, remote, remote_table = rel
+                match = next((r for r in self._db.tables.get(remote_table, []) if r.get(remote) == row.get(local)), None)
+                if match is None and modifier == "inner": return None
+                out[alias or name.strip()] = self._project(match, inner[:-1], remote_table) if match else None
+            elif part == "*":
+                out.update(row)
+            else:
+                out[part] = row.get(part)
+        return out
+
+    def execute(self) -> FakeResponse:
+        self._db._sleep()
+        with self._db._lock:
+            self._db.calls += 1
+            rows = self._db.tables.setdefault(self._table, [])
+            if self._op in ("insert", "upsert"):
+                return FakeResponse(copy.deepcopy(self._write(rows)))
+            matched = [r for r in rows if self._matches(r)]
+            if self._op == "update":
+                for r in matched: r.update(copy.deepcopy(self._payload)); self._touch(r)
+                return FakeResponse(copy.deepcopy(matched))
+            if self._op == "delete":
+                gone = {id(r) for r in matched}
+                self._db.tables[self._table] = [r for r in rows if id(r) not in gone]
+                self._tombstone(matched)
+                return FakeResponse(copy.deepcopy(matched))
+
+            for column, desc in reversed(self._order):
+                matched.sort(key=lambda r: (r.get(column) is None, _coerce(r.get(column), 0)[0]), reverse=desc)
+            # los embeds !inner filtran antes de paginar, como en PostgREST
+            data = [p for p in (self._project(r, self._columns, self._table) for r in matched) if p is not None]
+            total = len(data)
+            data = data[self._offset:]
+            if self._limit is not None: data = data[:self._limit]
+            return FakeResponse(copy.deepcopy(data), total if self._count else None)
+
+    def _write(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        payload = self._payload if isinstance(self._payload, list) else [self._payload]
+        written = []
+        for item in payload:
+            new = dict(item)
+            pk = PRIMARY_KEYS.get(self._table)
+            if pk and new.get(pk) is None: new[pk] = str(uuid4())
+            if self._table == "diagnostico_foto": new.setdefault("fecha", datetime.now(timezone.utc).isoformat())
+            if self._op == "upsert" and self._on_conflict:
+                existing = next((r for r in rows if all(r.get(c) == new.get(c) for c in self._on_conflict)), None)
+                if existing is not None:
+                    if self._ignore_duplicates: continue
+                    existing.update(new); self._touch(existing); written.append(existing); continue
+            self._touch(new); rows.append(new); written.append(new)
+        return written
+
+    def _touch(self, row: Dict[str, Any]) -> None:
+        column = TOUCH_COLUMNS.get(self._table)
+        if column: row[column] = _now_iso()
+
+    def _tombstone(self, deleted: List[Dict[str, Any]]) -> None:
+        if self._table not in TOMBSTONES or not deleted: return
+        table, columns, stamp = TOMBSTONES[self._table]
+        graves = self._db.tables.setdefault(table, [])
+        for row in deleted:
+            key = {c: row.get(c) for c in columns}
+            graves[:] = [g for g in graves if any(g.get(c) != v for c, v in key.items())]
+            graves.append({**key, stamp: _now_iso()})
+
+class FakeRPC:
+    def __init__(self, db: "FakeSupabase", fn: str, params: Dict[str, Any]):
+        self._db = db; self._fn = fn; self._params = params
+
+    def execute(self) -> FakeResponse:
+        self._db._sleep()
+        fn = getattr(self, f"_rpc_{self._fn}", None)
+        if fn is None: raise NotImplementedError(f"RPC no soportada en el fake: {self._fn}")
+        with self._db._lock:
+            self._db.calls += 1
+            return FakeResponse(copy.deepcopy(fn(self._db.tables)))
+
+    def _rpc_get_alerts(self, tables) -> List[Dict[str, Any]]:
+        alertas = {a["idalerta"]: a for a in tables.get("alertas", [])}
+        out = []
+        for ua in tables.get("usuarioalerta", []):
+            if str(ua.get("idusuario")) != str(self._params.get("userid")): continue
+            a = alertas.get(ua.get("idalerta"), {})
+            out.append({
+                "idalerta": ua.get("idalerta"), "categoria": a.get("categoria"), "titulo": a.get("titulo"),
+                "accion": a.get("accion"), "fecha": ua.get("fecha"), "tipo": a.get("tipo"),
+                "completado": ua.get("completado", False),
+            })
+        return out
+
+    def _rpc_crear_parcelas(self, tables) -> List[Dict[str, Any]]:
+        # Misma forma que la función de tablas.sql: un resultado por elemento
+        def num(v): return None if v is None else float(v)
+        out = []
+        for item in self._params.get("items") or []:
+            u = item.get("ubicacion") or {}
+            try:
+                if not item.get("nombre") or not u.get("estado") or not u.get("municipio"):
+                    raise ValueError("null value violates not-null constraint")
+                ubic = {"idubicacion": str(uuid4()), "estado": u["estado"], "municipio": u["municipio"],
+                        "latitud": num(u.get("latitud")), "longitud": num(u.get("longitud"))}
+                parc = {"idparcela": str(uuid4()), "nombre": item["nombre"], "hectareas": num(item.get("hectareas")),
+                        "tipo": item.get("tipo"), "idubicacion": ubic["idubicacion"]}
+            except (TypeError, ValueError) as e:
+                out.append({"ok": False, "error": str(e)}); continue
+            tables.setdefault("ubicacion", []).append(ubic)
+            tables.setdefault("parcela", []).append(parc)
+            out.append({"ok": True, "parcela": {**parc, "ubicacion": dict(ubic)}})
+        return out
+
+# ---------- Storage ----------
+def _drain(fh, chunk_size: int = 64 * 1024) -> int:
+    size = 0
+    while True:
+        chunk = fh.read(chunk_size)
+        if not chunk: return size
+        size += len(chunk)
+
+class FakeBucket:
+    def __init__(self, db: "FakeSupabase", bucket: str):
+        self._db = db; self._bucket = bucket
+
+    def upload(self, path: str, file, file_options: Optional[dict] = None):
+        self._db._sleep()
+        # Se consume por trozos como lo haría httpx, sin juntar el archivo en memoria
+        if isinstance(file, (bytes, bytearray)): size = len(file)
+        elif hasattr(file, "read"): size = _drain(file)
+        else:
+            with open(file, "rb") as fh: size = _drain(fh)
+        with self._db._lock:
+            self._db.calls += 1
+            objects = self._db.objects.setdefault(self._bucket, {})
+            if path in objects and not (file_options or {}).get("upsert"):
+                # mismo error que storage3 con la respuesta real de Storage
+                raise StorageApiError("The resource already exists", "Duplicate", "409")
+            objects[path] = size  # solo el tamaño: no guarda imágenes en RAM
+        return {"path": path}
+
+    def get_public_url(self, path: str) -> str:
+        return f"https://fake.supabase.local/storage/v1/object/public/{self._bucket}/{path}"
+
+class FakeStorage:
+    def __init__(self, db: "FakeSupabase"):
+        self._db = db
+
+    def from_(self, bucket: str) -> FakeBucket:
+        return FakeBucket(self._db, bucket)
+
+# ---------- Cliente ----------
+class FakeSupabase:
+    """Cliente falso. latency_ms/jitter_ms se aplican a cada llamada de red simulada."""
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, seed: Optional[int] = None):
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.objects: Dict[str, Dict[str, int]] = {}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.calls = 0
+        self._lock = threading.RLock()
+        self._rnd = random.Random(seed)
+        self.storage = FakeStorage(self)
+
+    def _sleep(self):
+        if self.latency_ms or self.jitter_ms:
+            time.sleep(max(0.0, self.latency_ms + self._rnd.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0)
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def from_(self, name: str) -> FakeQuery:
+        return self.table(name)
+
+    def rpc(self, fn: str, params: Optional[dict] = None, **kwargs) -> FakeRPC:
+        return FakeRPC(self, fn, params or {})
+
+# ---------- Datos de ejemplo ----------
+DISEASES = ["roya", "broca", "ojogallo", "antracnosis"]
+
+def seed_data(client: FakeSupabase, users: int = 20, parcelas: int = 200, regions: int = 10,
+              years: Tuple[int, ...] = (2024, 2025), diagnoses_per_user: int = 30, seed: int = 0) -> Dict[str, List[str]]:
+    """Llena el fake con datos con la forma de producción. Devuelve los ids generados."""
+    rnd = random.Random(seed)
+    uid = lambda: str(UUID(int=rnd.getrandbits(128), version=4))  # ids reproducibles con la misma semilla
+    t = client.tables
+    region_ids = [f"R{i:03d}" for i in range(regions)]
+
+    t["disease_prior"] = [{"disease": d, "month": m, "prior": round(rnd.uniform(0.1, 0.7), 3)}
+                          for d in DISEASES for m in range(1, 13)]
+    t["weather_monthly"] = []; t["farm_factors"] = []
+    for r in region_ids:
+        for y in years:
+            for m in range(1, 13):
+                t["weather_monthly"].append({
+                    "region_id": r, "year": y, "month": m, "t_mean_c": round(rnd.uniform(14, 31), 1),
+                    "rh_mean": round(rnd.uniform(55, 95), 1), "rain_days": rnd.randint(0, 22),
+                    "leaf_wet_hours": rnd.randint(0, 12), "cloudy_days": rnd.randint(0, 20)})
+                t["farm_factors"].append({
+                    "region_id": r, "year": y, "month": m, "shade_level": rnd.choice(["alta", "media", "baja"]),
+                    "leftover_fruit": rnd.random() < 0.4, "defoliation_prev": rnd.random() < 0.3})
+
+    t["ubicacion"] = []; t["parcela"] = []
+    for i in range(parcelas):
+        idu = uid()
+        t["ubicacion"].append({"idubicacion": idu, "estado": "Chiapas", "municipio": f"Municipio {i % 25}",
+                               "latitud": round(rnd.uniform(14.5, 17.9), 6), "longitud": round(rnd.uniform(-94.1, -90.4), 6)})
+        t["parcela"].append({"idparcela": uid(), "nombre": f"Parcela {i}", "hectareas": round(rnd.uniform(0.5, 20), 2),
+                             "tipo": rnd.choice(["Arábica", "Robusta"]), "idubicacion": idu})
+
+    t["diagnostico"] = [{"diagnostico": d, "descripcion": f"Descripción de {d}. " * 20, "causas": "Causas. " * 20,
+                         "prevencion": "Prevención. " * 20, "tratamiento": "Tratamiento. " * 20} for d in DISEASES]
+    t["alertas"] = []
+    for d in DISEASES:
+        for k in range(3):
+            t["alertas"].append({"idalerta": uid(), "enfermedad": d, "diasParaAlerta": 7 * k,
+                                 "categoria": "Enfermedades", "titulo": f"Revisar {d} ({k + 1})",
+                                 "accion": f"Aplicar tratamiento para {d}", "tipo": "Recordatorio"})
+
+    t["usuarios"] = []; t["usuarioalerta"] = []; t["usuarioalerta_eliminada"] = []; t["diagnostico_foto"] = []; t["caficultores"] = []
+    now = datetime.now(timezone.utc)
+    for i in range(users):
+        idus = uid()
+        t["usuarios"].append({"idusuario": idus, "nombre": f"Usuario{i}", "apellido": "Prueba",
+                              "correo": f"user{i}@pearco.test", "contrasena": "secret",
+                              "idparcela": rnd.choice(t["parcela"])["idparcela"], "idtipousuario": 1})
+        for a in rnd.sample(t["alertas"], 4):
+            t["usuarioalerta"].append({"idusuario": idus, "idalerta": a["idalerta"],
+                                       "fecha": (now + timedelta(days=rnd.randint(0, 30))).strftime("%Y-%m-%d"),
+                                       "completado": rnd.random() < 0.3, "actualizado_en": _now_iso()})
+        for k in range(diagnoses_per_user):
+            t["diagnostico_foto"].append({"iddiagnostico": uid(), "idusuario": idus, "diagnostico": rnd.choice(DISEASES),
+                                          "imagen_url": f"https://fake.supabase.local/{idus}/{k}.jpg",
+                                          "fecha": (now - timedelta(hours=k * 7)).isoformat()})
+    for i in range(users):
+        t["caficultores"].append({"id": i + 1, "name": f"Caficultor{i}", "lastname": "Prueba", "gender": "F",
+                                  "telephone": None, "email": None, "address": "Chiapas", "birthDate": "1980-01-01"})
+
+    # Centroides de región en rejilla sobre Chiapas (sin usar rnd: no cambia los demás ids)
+    cols = 5
+    rows = -(-len(region_ids) // cols)
+    t["region"] = [{"region_id": r, "nombre": f"Región {i}",
+                    "latitud": round(14.5 + (i // cols + 0.5) * 3.4 / rows, 4),
+                    "longitud": round(-94.1 + (i % cols + 0.5) * 3.7 / cols, 4)}
+                   for i, r in enumerate(region_ids)]
+
+    return {
+        "users": [u["idusuario"] for u in t["usuarios"]],
+        "parcelas": [p["idparcela"] for p in t["parcela"]],
+        "regions": region_ids,
+        "diseases": list(DISEASES),
+    }
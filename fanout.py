@@ -0,0 +1,74 @@
+# fanout.py
+# Pool de hilos compartido por worker para lanzar lecturas independientes
+# a Supabase en paralelo dentro de una misma petición.
+from __future__ import annotations
+from typing import Dict, Any, Callable, Optional
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION, ALL_COMPLETED
+import contextvars
+import os
+import threading
+
+MAX_WORKERS = int(os.getenv("FANOUT_MAX_WORKERS", "8"))
+DEFAULT_TIMEOUT = float(os.getenv("FANOUT_TIMEOUT_SECONDS", "15"))
+
+_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_local = threading.local()
+
+def _mark_worker():
+    _local.in_pool = True
+
+def get_pool() -> ThreadPoolExecutor:
+    """Crea el pool la primera vez (y de nuevo tras un fork del worker)."""
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="fanout", initializer=_mark_worker)
+            _pool_pid = os.getpid()
+        return _pool
+
+def shutdown(wait_pending: bool = True) -> None:
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait_pending, cancel_futures=not wait_pending)
+            _pool = None
+
+def run_parallel(calls: Dict[str, Callable[[], Any]], timeout: Optional[float] = None,
+                 return_exceptions: bool = False) -> Dict[str, Any]:
+    """
+    Ejecuta llamadas independientes y devuelve {nombre: resultado}.
+    Si una falla (o se vence el timeout) cancela las que no han empezado y relanza,
+    salvo con return_exceptions=True, donde la excepción queda como resultado.
+    """
+    timeout = DEFAULT_TIMEOUT if timeout is None else timeout
+    # Una sola llamada, o ya estamos dentro del pool: se ejecuta en línea (evita deadlock)
+    if len(calls) <= 1 or getattr(_local, "in_pool", False):
+        out = {}
+        for name, fn in calls.items():
+            try: out[name] = fn()
+            except Exception as e:
+                if not return_exceptions: raise
+                out[name] = e
+        return out
+
+    pool = get_pool()
+    # Cada llamada corre con una copia del contexto (p. ej. las métricas de la petición)
+    futures = {pool.submit(contextvars.copy_context().run, fn): name for name, fn in calls.items()}
+    done, pending = wait(futures, timeout=timeout, return_when=ALL_COMPLETED if return_exceptions else FIRST_EXCEPTION)
+    for f in pending: f.cancel()
+
+    if not return_exceptions:
+        for f in done:
+            if f.exception() is not None: raise f.exception()
+        if pending:
+            names = ", ".join(futures[f] for f in pending)
+            raise TimeoutError(f"Llamadas sin terminar en {timeout}s: {names}")
+        return {name: f.result() for f, name in futures.items()}
+
+    return {
+        name: TimeoutError(f"'{name}' no terminó en {timeout}s") if f in pending
+        else (f.exception() if f.exception() is not None else f.result())
+        for f, name in futures.items()
+    }
@@ -0,0 +1,63 @@
+# gunicorn.conf.py
+# Configuración de gunicorn para producción. Casi todo el tiempo de cada ruta
+# se va esperando a Supabase por HTTP, así que por defecto se usa un worker
+# gthread con varios hilos en vez de un solo worker sync. Un solo proceso
+# porque varias caches e índices (riesgo, plantillas, parcelas, regiones,
+# dedup de subidas) viven en memoria del worker y sus invalidaciones no
+# cruzan procesos: con WEB_CONCURRENCY > 1 cada worker las refresca solo por TTL.
+#
+#   WEB_WORKER_CLASS        sync | gthread | gevent         (default gthread)
+#   WEB_CONCURRENCY         procesos worker                  (default 1)
+#   WEB_THREADS             hilos por worker con gthread     (default 16)
+#   WEB_WORKER_CONNECTIONS  conexiones por worker con gevent (default 200)
+#   WEB_TIMEOUT             segundos antes de reciclar un worker colgado (default 60)
+#   WEB_GRACEFUL_TIMEOUT    segundos para terminar peticiones al apagar   (default 30)
+#   WEB_PRELOAD             1 para importar la app antes del fork          (default 0;
+#                           no usar con gevent: importaría ssl antes del parche)
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5050')}"
+worker_class = os.getenv("WEB_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+threads = int(os.getenv("WEB_THREADS", "16"))
+worker_connections = int(os.getenv("WEB_WORKER_CONNECTIONS", "200"))
+timeout = int(os.getenv("WEB_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+preload_app = os.getenv("WEB_PRELOAD", "0") == "1"
+accesslog = "-"
+
+def on_starting(server):
+    # Las métricas de Prometheus se agregan entre workers a través de este directorio
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            os.remove(os.path.join(path, name))
+
+def post_worker_init(worker):
+    # Corre dentro del worker después de init_process: con gevent ya se hizo el
+    # monkey-patching (post_fork corre antes, y arrancar ahí hilos o importar
+    # ssl/httpx los dejaría sin parchear). Sin preload, app ya se cargó aquí.
+    import app
+    # Con preload el cliente (y su pool de conexiones HTTP) se creó en el master:
+    # cada worker necesita el suyo para no compartir sockets entre procesos.
+    if preload_app: app.init_supabase()
+    # Hilos de fondo del worker; nunca en el master ni al importar app
+    app.init_worker()
+
+def worker_exit(server, worker):
+    # Apagado ordenado: espera a que terminen las lecturas en paralelo pendientes
+    import fanout, images, diagnostic_batch
+    fanout.shutdown(wait_pending=True)
+    diagnostic_batch.shutdown(wait_pending=True)
+    images.shutdown(wait_pending=True)
+    # Los trabajos de diagnóstico pendientes quedan en disco y los retoma otro worker
+    import app
+    app.diagnostic_queue.stop(timeout=graceful_timeout)
+
+def child_exit(server, worker):
+    # Limpia los archivos de métricas del worker muerto (modo multiproceso de Prometheus)
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,111 @@
+# images.py
+# Reducción y miniatura de las fotos de diagnóstico antes de subirlas.
+# Pillow corre en un pool de procesos (fuera del GIL de los hilos de la
+# petición); entre procesos solo viajan rutas de archivos temporales.
+from __future__ import annotations
+from typing import Any, Dict, Optional
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+
+ENABLED = os.getenv("IMAGE_PROCESSING", "1") == "1"
+MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "2048"))
+THUMB_SIDE = int(os.getenv("IMAGE_THUMB_SIDE", "320"))
+QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+THUMB_QUALITY = int(os.getenv("IMAGE_THUMB_QUALITY", "75"))
+PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", "2"))
+TIMEOUT = float(os.getenv("IMAGE_PROCESS_TIMEOUT_SECONDS", "30"))
+WORK_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_pid: Optional[int] = None
+
+def get_pool() -> ProcessPoolExecutor:
+    """Crea el pool la primera vez (y de nuevo tras un fork del worker)."""
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # forkserver: no hereda los hilos ni el cliente de Supabase del worker
+            _pool = ProcessPoolExecutor(max_workers=PROCESS_WORKERS, mp_context=multiprocessing.get_context("forkserver"))
+            _pool_pid = os.getpid()
+        return _pool
+
+def shutdown(wait_pending: bool = True) -> None:
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait_pending, cancel_futures=not wait_pending)
+            _pool = None
+
+# ---------- En el proceso hijo ----------
+def _render(src: str, dst: str, side: int, quality: int, keep_if_smaller: bool) -> Dict[str, Any]:
+    from PIL import Image, ImageOps
+    with Image.open(src) as im:
+        # JPEG: decodifica directamente a escala reducida (mucho menos memoria)
+        im.draft("RGB", (side, side))
+        im = ImageOps.exif_transpose(im)
+        if im.mode != "RGB": im = im.convert("RGB")
+        im.thumbnail((side, side), Image.LANCZOS)
+        im.save(dst, "JPEG", quality=quality, optimize=True, progressive=True)
+        width, height = im.size
+    # Si ya venía dentro del límite y el original pesa menos, se conserva el original
+    if keep_if_smaller and os.path.getsize(src) <= os.path.getsize(dst):
+        with Image.open(src) as orig:
+            if orig.format == "JPEG" and max(orig.size) <= side:
+                shutil.copyfile(src, dst)
+    return {"width": width, "height": height, "bytes": os.path.getsize(dst)}
+
+def _process(src: str, main_dst: str, thumb_dst: str, max_side: int, thumb_side: int,
+             quality: int, thumb_quality: int) -> Dict[str, Any]:
+    main = _render(src, main_dst, max_side, quality, keep_if_smaller=True)
+    thumb = _render(main_dst, thumb_dst, thumb_side, thumb_quality, keep_if_smaller=False)
+    return {"main": main, "thumbnail": thumb}
+
+# ---------- En el worker web ----------
+class Processed:
+    """Archivos temporales resultantes; se borran al cerrar."""
+    def __init__(self, workdir: str, info: Dict[str, Any]):
+        self.workdir = workdir
+        self.main_path = os.path.join(workdir, "main.jpg")
+        self.thumb_path = os.path.join(workdir, "thumb.jpg")
+        self.info = info
+
+    def close(self) -> None:
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): self.close()
+
+def _puede_ser_imagen(content_type: Optional[str]) -> bool:
+    # sin tipo o genérico (común desde móviles) se intenta; otro tipo declarado no
+    if not content_type: return True
+    tipo = content_type.split(";", 1)[0].strip().lower()
+    return tipo.startswith("image/") or tipo == "application/octet-stream"
+
+def process_upload(data, content_type: Optional[str] = None) -> Optional[Processed]:
+    """
+    Recibe bytes o un archivo abierto (lo que entrega uploads.open_upload) y
+    devuelve los JPEG reducido y miniatura. None si está desactivado, si el
+    content_type declarado no es de imagen (no se copia ni se manda al pool)
+    o si el archivo no es una imagen que Pillow pueda leer (se sube tal cual).
+    """
+    if not ENABLED or not _puede_ser_imagen(content_type): return None
+    workdir = tempfile.mkdtemp(prefix="img-", dir=WORK_DIR)
+    src = os.path.join(workdir, "src")
+    try:
+        with open(src, "wb") as out:
+            if isinstance(data, (bytes, bytearray)): out.write(data)
+            else: shutil.copyfileobj(data, out, 64 * 1024)
+        future = get_pool().submit(_process, src, os.path.join(workdir, "main.jpg"), os.path.join(workdir, "thumb.jpg"),
+                                   MAX_SIDE, THUMB_SIDE, QUALITY, THUMB_QUALITY)
+        return Processed(workdir, future.result(timeout=TIMEOUT))
+    except Exception as e:
+        print(f"No se pudo procesar la imagen, se sube el original: {e}")
+        shutil.rmtree(workdir, ignore_errors=True)
+        return None
+    finally:
+        if hasattr(data, "seek"): data.seek(0)
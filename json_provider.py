@@ -0,0 +1,55 @@
+# json_provider.py
+# Proveedor JSON de Flask basado en orjson (serializa varias veces más rápido
+# que json). Como el proveedor por defecto: llaves ordenadas, fechas en formato
+# HTTP vía default y salida indentada en debug. La salida NO es idéntica byte
+# a byte: el texto no ASCII va en UTF-8 en vez de escapes \uXXXX
+# (ensure_ascii=False) y los float siguen el formato de orjson (1e-05 sale
+# como 0.00001). Si orjson no está instalado, JSON_PROVIDER=default o
+# app.json.ensure_ascii = True, se usa el de Flask.
+from __future__ import annotations
+from typing import Any
+import os
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # dependencia opcional
+    orjson = None
+
+JSON_PROVIDER = os.getenv("JSON_PROVIDER", "orjson")
+# Argumentos de json.dumps que orjson puede imitar; con otros se usa json
+_SUPPORTED_KWARGS = {"default", "sort_keys", "indent", "separators"}
+
+class OrjsonProvider(DefaultJSONProvider):
+    # orjson siempre escribe UTF-8; con True se delega en json
+    ensure_ascii = False
+
+    def _option(self, sort_keys: bool, indent: bool) -> int:
+        option = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+                  | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        if sort_keys: option |= orjson.OPT_SORT_KEYS
+        if indent: option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if self.ensure_ascii or set(kwargs) - _SUPPORTED_KWARGS or kwargs.get("indent") not in (None, 2):
+            return super().dumps(obj, **kwargs)
+        option = self._option(kwargs.get("sort_keys", self.sort_keys), bool(kwargs.get("indent")))
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode("utf-8")
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if kwargs: return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        if self.ensure_ascii: return super().response(*args, **kwargs)
+        # Directo a bytes: sin pasar por str
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default,
+                            option=self._option(self.sort_keys, indent) | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+def init_app(app) -> None:
+    if orjson is not None and JSON_PROVIDER == "orjson":
+        app.json = OrjsonProvider(app)
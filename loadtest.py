@@ -0,0 +1,362 @@
+# loadtest.py
+# Prueba de carga de punta a punta contra todas las rutas de app.py.
+#
+# En proceso (por defecto) usa el test client de Flask con fake_supabase
+# y latencia simulada; con --url manda HTTP real a un servidor levantado con
+# SUPABASE_FAKE=1 (misma semilla → mismos ids).
+#
+# Uso:
+#   python loadtest.py traffic --requests 2000 --concurrency 16 --latency-ms 30
+#   python loadtest.py traffic --url http://localhost:5050 --out actual.json --baseline base.json
+#   python loadtest.py upload-mem --sizes 1 4 12 --concurrency 4 [--legacy]
+#   python loadtest.py json --parcelas 2000 --repeat 20
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import io
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from uuid import uuid4
+
+from werkzeug.test import EnvironBuilder
+
+import fake_supabase
+
+# ---------- Tráfico ----------
+# (nombre, peso, generador) — el generador recibe (rnd, ids) y devuelve
+# (método, ruta, kwargs de EnvironBuilder). Pesos aproximados al uso real de la app.
+Scenario = Tuple[str, int, Callable[[random.Random, Dict[str, List[str]]], Tuple[str, str, Dict[str, Any]]]]
+
+def _photo(rnd: random.Random, size: int = 200_000) -> io.BytesIO:
+    return io.BytesIO(b"\xff\xd8\xff\xe0" + rnd.randbytes(size))
+
+def _parcelas_csv(rnd: random.Random, rows: int = 50) -> bytes:
+    lines = ["nombre,hectareas,tipo,estado,municipio,latitud,longitud"]
+    for i in range(rows):
+        lines.append(f"Importada {i},{rnd.uniform(0.5, 20):.2f},{rnd.choice(['Arábica', 'Robusta'])},Chiapas,Tapachula,"
+                     f"{rnd.uniform(14.5, 17.9):.6f},{rnd.uniform(-94.1, -90.4):.6f}")
+    return "\n".join(lines).encode()
+
+SCENARIOS: List[Scenario] = [
+    ("GET /", 1, lambda r, ids: ("GET", "/", {})),
+    ("POST /login", 3, lambda r, ids: ("POST", "/login", {"json": {"email": f"user{r.randrange(len(ids['users']))}@pearco.test", "password": "secret"}})),
+    ("GET /reports", 2, lambda r, ids: ("GET", "/reports", {})),
+    ("GET /summary", 2, lambda r, ids: ("GET", "/summary", {})),
+    ("GET /alerts", 20, lambda r, ids: ("GET", "/alerts", {"query_string": {"idusuario": r.choice(ids["users"])}})),
+    ("GET /alerts (delta)", 10, lambda r, ids: ("GET", "/alerts", {"query_string": {"idusuario": r.choice(ids["users"]), "limit": 50}})),
+    ("POST /alerts/complete", 3, lambda r, ids: ("POST", "/alerts/complete", {"json": {"idalerta": r.choice(ids["alerts"]), "isCompleted": r.random() < 0.5}})),
+    ("POST /alerts/complete/batch", 1, lambda r, ids: ("POST", "/alerts/complete/batch", {"json": {"idusuario": r.choice(ids["users"]), "items": [{"idalerta": a, "isCompleted": r.random() < 0.5} for a in r.sample(ids["alerts"], 5)]}})),
+    ("POST /alerts/delete/batch", 1, lambda r, ids: ("POST", "/alerts/delete/batch", {"json": {"idusuario": r.choice(ids["users"]), "ids": r.sample(ids["alerts"], 3)}})),
+    ("DELETE /alerts/<id>", 1, lambda r, ids: ("DELETE", f"/alerts/{r.choice(ids['alerts'])}", {})),
+    ("GET /caficultores", 5, lambda r, ids: ("GET", "/caficultores", {})),
+    ("POST /caficultores", 1, lambda r, ids: ("POST", "/caficultores", {"json": {"id": r.randrange(10_000, 10**9), "name": "Nuevo", "lastname": "Caficultor", "gender": "M", "telephone": "", "email": "", "address": "Chiapas", "birthDate": "1990-05-01"}})),
+    ("PUT /caficultores/<id>", 1, lambda r, ids: ("PUT", f"/caficultores/{r.randrange(1, 20)}", {"json": {"address": "Veracruz"}})),
+    ("DELETE /caficultores/<id>", 1, lambda r, ids: ("DELETE", f"/caficultores/{r.randrange(10**9, 2 * 10**9)}", {})),
+    ("GET /parcelas", 8, lambda r, ids: ("GET", "/parcelas", {})),
+    ("GET /parcelas (page)", 6, lambda r, ids: ("GET", "/parcelas", {"query_string": {"limit": 50, "fields": "nombre,hectareas,tipo,ubicacion.municipio"}})),
+    ("GET /parcelas/<id>", 6, lambda r, ids: ("GET", f"/parcelas/{r.choice(ids['parcelas'])}", {})),
+    ("GET /parcelas/near", 4, lambda r, ids: ("GET", "/parcelas/near", {"query_string": {"lat": round(r.uniform(14.5, 17.9), 4), "lon": round(r.uniform(-94.1, -90.4), 4), "k": 10}})),
+    ("GET /parcelas/bbox", 2, lambda r, ids: ("GET", "/parcelas/bbox", {"query_string": (lambda la, lo: {"min_lat": la, "min_lon": lo, "max_lat": la + 0.5, "max_lon": lo + 0.5})(round(r.uniform(14.5, 17.4), 4), round(r.uniform(-94.1, -90.9), 4))})),
+    ("POST /parcelas", 2, lambda r, ids: ("POST", "/parcelas", {"json": {"nombre": "Nueva", "hectareas": 3.5, "tipo": "Arábica", "ubicacion": {"estado": "Chiapas", "municipio": "Tapachula", "latitud": round(r.uniform(14.5, 17.9), 6), "longitud": round(r.uniform(-94.1, -90.4), 6)}}})),
+    ("POST /parcelas/bulk", 1, lambda r, ids: ("POST", "/parcelas/bulk", {"data": _parcelas_csv(r), "content_type": "text/csv"})),
+    ("PUT /parcelas/<id>", 2, lambda r, ids: ("PUT", f"/parcelas/{r.choice(ids['parcelas'])}", {"json": {"hectareas": round(r.uniform(1, 10), 2), "ubicacion": {"municipio": "Tapachula"}}})),
+    ("DELETE /parcelas/<id>", 1, lambda r, ids: ("DELETE", "/parcelas/00000000-0000-4000-8000-000000000000", {})),
+    ("GET /risk/<region>/<y>/<m>", 15, lambda r, ids: ("GET", f"/risk/{r.choice(ids['regions'])}/2025/{r.randint(1, 12)}", {})),
+    ("GET /risk_series/<region>/<y>", 8, lambda r, ids: ("GET", f"/risk_series/{r.choice(ids['regions'])}/2025", {})),
+    ("GET /parcelas/<id>/risk/<y>/<m>", 6, lambda r, ids: ("GET", f"/parcelas/{r.choice(ids['parcelas'])}/risk/2025/{r.randint(1, 12)}", {})),
+    ("GET /parcelas/<id>/risk_series/<y>", 3, lambda r, ids: ("GET", f"/parcelas/{r.choice(ids['parcelas'])}/risk_series/2025", {})),
+    ("GET /risk/regions/<y>/<m>", 4, lambda r, ids: ("GET", f"/risk/regions/2025/{r.randint(1, 12)}", {})),
+    ("POST /risk/batch", 2, lambda r, ids: ("POST", "/risk/batch", {"json": {"keys": [{"region_id": reg, "year": 2025, "month": m} for reg in ids["regions"] for m in range(1, 13)]}})),
+    ("GET /risk/cache", 1, lambda r, ids: ("GET", "/risk/cache", {})),
+    ("POST /upload_image", 2, lambda r, ids: ("POST", "/upload_image", {"data": {"user_id": r.choice(ids["users"]), "file": (_photo(r), "foto.jpg", "image/jpeg")}})),
+    ("POST /diagnostic (json)", 3, lambda r, ids: ("POST", "/diagnostic", {"json": {"idUsuario": r.choice(ids["users"]), "diagnostico": r.choice(ids["diseases"]), "imagen_url": "https://fake.supabase.local/x.jpg"}})),
+    ("POST /diagnostic (async)", 1, lambda r, ids: ("POST", "/diagnostic", {"query_string": {"async": 1}, "data": {"idUsuario": r.choice(ids["users"]), "diagnostico": r.choice(ids["diseases"]), "file": (_photo(r), "foto.jpg", "image/jpeg")}})),
+    ("POST /diagnostic (multipart)", 1, lambda r, ids: ("POST", "/diagnostic", {"data": {"idUsuario": r.choice(ids["users"]), "diagnostico": r.choice(ids["diseases"]), "file": (_photo(r), "foto.jpg", "image/jpeg")}})),
+    ("GET /diagnoses", 8, lambda r, ids: ("GET", "/diagnoses", {"query_string": {"idusuario": r.choice(ids["users"]), "limit": "20"}})),
+    ("GET /metrics", 1, lambda r, ids: ("GET", "/metrics", {})),
+]
+
+def _schedule(n: int, ids: Dict[str, List[str]], seed: int) -> List[Tuple[str, str, str, Dict[str, Any]]]:
+    rnd = random.Random(seed)
+    names = [s[0] for s in SCENARIOS]; weights = [s[1] for s in SCENARIOS]
+    gens = {s[0]: s[2] for s in SCENARIOS}
+    out = []
+    for name in rnd.choices(names, weights=weights, k=n):
+        method, path, kwargs = gens[name](rnd, ids)
+        out.append((name, method, path, kwargs))
+    return out
+
+# ---------- Clientes ----------
+def _in_process_sender(latency_ms: float, jitter_ms: float, seed: int):
+    import app as app_module
+    import metrics
+    fake = fake_supabase.FakeSupabase(latency_ms=latency_ms, jitter_ms=jitter_ms, seed=seed)
+    fake_supabase.seed_data(fake, seed=seed)
+    app_module.supabase = metrics.instrument(fake)
+    app_module.init_worker()  # este proceso hace de servidor: los trabajos async se procesan
+    local = threading.local()
+
+    def send(method: str, path: str, kwargs: Dict[str, Any]) -> int:
+        if not hasattr(local, "client"): local.client = app_module.app.test_client()
+        resp = local.client.open(path, method=method, **kwargs)
+        resp.close()
+        return resp.status_code
+    return send, fake
+
+def _http_sender(base_url: str):
+    def send(method: str, path: str, kwargs: Dict[str, Any]) -> int:
+        builder = EnvironBuilder(path=path, method=method, **kwargs)
+        env = builder.get_environ()
+        body = env["wsgi.input"].read() or None
+        url = base_url.rstrip("/") + path + (f"?{env['QUERY_STRING']}" if env.get("QUERY_STRING") else "")
+        headers = {"Content-Type": env["CONTENT_TYPE"]} if env.get("CONTENT_TYPE") else {}
+        req = urllib.request.Request(url, data=body, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(req, timeout=60) as resp:
+                resp.read()
+                return resp.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+    return send
+
+# ---------- Estadística ----------
+def _percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values: return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+def summarize(samples: List[Tuple[str, float, int]], wall: float) -> Dict[str, Any]:
+    by_name: Dict[str, List[Tuple[float, int]]] = {}
+    for name, elapsed, status in samples:
+        by_name.setdefault(name, []).append((elapsed, status))
+    endpoints = {}
+    for name, rows in sorted(by_name.items()):
+        lat = sorted(e * 1000 for e, _ in rows)
+        endpoints[name] = {
+            "count": len(rows),
+            "errors": sum(1 for _, s in rows if s >= 500),
+            "client_errors": sum(1 for _, s in rows if 400 <= s < 500),
+            "p50_ms": round(_percentile(lat, 50), 2),
+            "p95_ms": round(_percentile(lat, 95), 2),
+            "p99_ms": round(_percentile(lat, 99), 2),
+            "rps": round(len(rows) / wall, 2) if wall else 0.0,
+        }
+    all_lat = sorted(e * 1000 for _, e, _ in samples)
+    return {
+        "total": {"count": len(samples), "wall_s": round(wall, 3), "rps": round(len(samples) / wall, 2) if wall else 0.0,
+                  "p50_ms": round(_percentile(all_lat, 50), 2), "p95_ms": round(_percentile(all_lat, 95), 2),
+                  "p99_ms": round(_percentile(all_lat, 99), 2),
+                  "errors": sum(1 for _, _, s in samples if s >= 500)},
+        "endpoints": endpoints,
+    }
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"{'endpoint':38} {'n':>6} {'5xx':>4} {'4xx':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>8}")
+    for name, s in report["endpoints"].items():
+        print(f"{name:38} {s['count']:>6} {s['errors']:>4} {s['client_errors']:>4} {s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f} {s['rps']:>8.1f}")
+    t = report["total"]
+    print(f"{'TOTAL':38} {t['count']:>6} {t['errors']:>4} {'':>4} {t['p50_ms']:>8.1f} {t['p95_ms']:>8.1f} {t['p99_ms']:>8.1f} {t['rps']:>8.1f}")
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: float, min_delta_ms: float,
+            min_samples: int) -> List[str]:
+    """Devuelve las regresiones de p95 por endpoint respecto al baseline."""
+    problems = []
+    for name, s in report["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(name)
+        if not base or min(s["count"], base["count"]) < min_samples: continue
+        limit = base["p95_ms"] * (1 + max_regression)
+        if s["p95_ms"] > limit and s["p95_ms"] - base["p95_ms"] > min_delta_ms:
+            problems.append(f"{name}: p95 {s['p95_ms']:.1f}ms vs {base['p95_ms']:.1f}ms")
+        if s["errors"] > base.get("errors", 0):
+            problems.append(f"{name}: {s['errors']} errores 5xx (baseline {base.get('errors', 0)})")
+    return problems
+
+# ---------- Subcomandos ----------
+def run_traffic(args) -> int:
+    ids_fake = fake_supabase.FakeSupabase()
+    ids = fake_supabase.seed_data(ids_fake, seed=args.seed)
+    ids["alerts"] = [a["idalerta"] for a in ids_fake.tables["alertas"]]
+
+    if args.url: send = _http_sender(args.url)
+    else: send, _ = _in_process_sender(args.latency_ms, args.jitter_ms, args.seed)
+
+    for _, method, path, kwargs in _schedule(args.warmup, ids, args.seed + 1):
+        send(method, path, kwargs)
+
+    schedule = _schedule(args.requests, ids, args.seed + 2)
+    samples: List[Tuple[str, float, int]] = []
+    lock = threading.Lock()
+
+    def worker(item):
+        name, method, path, kwargs = item
+        start = time.perf_counter()
+        try: status = send(method, path, kwargs)
+        except Exception as e:
+            print(f"🚨 {name}: {e}"); status = 599
+        elapsed = time.perf_counter() - start
+        with lock: samples.append((name, elapsed, status))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(worker, schedule))
+    report = summarize(samples, time.perf_counter() - start)
+    report["config"] = {k: getattr(args, k) for k in ("requests", "concurrency", "latency_ms", "jitter_ms", "url", "seed")}
+    print_report(report)
+
+    if args.out:
+        with open(args.out, "w") as fh: json.dump(report, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline) as fh: baseline = json.load(fh)
+        problems = compare(report, baseline, args.max_regression, args.min_delta_ms, args.min_samples)
+        if problems:
+            print("\nRegresiones:"); [print(f"  - {p}") for p in problems]
+            return 1
+        print("\nSin regresiones respecto al baseline.")
+    return 0
+
+def _upload_environ(path: str, rnd: random.Random, size: int) -> Dict[str, Any]:
+    fields = {"user_id": "bench"} if path == "/upload_image" else {"idUsuario": "bench", "diagnostico": "roya"}
+    fields["file"] = (_photo(rnd, size), "foto.jpg", "image/jpeg")
+    return EnvironBuilder(path=path, method="POST", data=fields).get_environ()
+
+def run_upload_mem(args) -> int:
+    """Pico de memoria Python (tracemalloc) al subir fotos de varios tamaños en paralelo."""
+    import tracemalloc
+    import app as app_module
+    import metrics
+    fake = fake_supabase.FakeSupabase(latency_ms=args.latency_ms)
+    fake_supabase.seed_data(fake, seed=args.seed)
+    app_module.supabase = metrics.instrument(fake)
+    if args.legacy:
+        # camino anterior: todo el archivo a bytes antes de subirlo
+        def legacy(f, owner, ext, ct):
+            dest = f"{owner}/{uuid4()}.{ext}"
+            return {"image_url": app_module._upload_to_storage(f.read(), dest, ct), "path": dest,
+                    "thumbnail_url": None, "thumbnail_path": None}
+        app_module._upload_file_storage = legacy
+
+    def call(environ) -> int:
+        out = {}
+        def start_response(status, headers, exc_info=None): out["status"] = int(status.split()[0])
+        body = app_module.app(environ, start_response)
+        for _ in body: pass
+        if hasattr(body, "close"): body.close()
+        return out["status"]
+
+    rnd = random.Random(args.seed)
+    print(f"{'size MB':>8} {'conc':>5} {'peak MB':>9} {'per upload':>11} {'status':>8}  ({'legacy' if args.legacy else 'streaming'})")
+    for mb in args.sizes:
+        size = int(mb * 1024 * 1024)
+        # los cuerpos se arman antes de medir: solo cuenta lo que asigna la app
+        environs = [_upload_environ(args.path, rnd, size) for _ in range(args.concurrency)]
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            statuses = list(pool.map(call, environs))
+        peak = (tracemalloc.get_traced_memory()[1] - base) / (1024 * 1024)
+        tracemalloc.stop()
+        print(f"{mb:>8.1f} {args.concurrency:>5} {peak:>9.2f} {peak / args.concurrency:>11.2f} {','.join(sorted(set(map(str, statuses)))):>8}")
+    return 0
+
+# ---------- Serialización y compresión ----------
+def _json_payloads(args) -> List[Tuple[str, Any]]:
+    """Obtiene (nombre, objeto) de las respuestas reales de cada endpoint sobre el fake."""
+    import app as app_module
+    fake = fake_supabase.FakeSupabase()
+    ids = fake_supabase.seed_data(fake, users=args.users, parcelas=args.parcelas,
+                                  diagnoses_per_user=args.diagnoses_per_user, seed=args.seed)
+    app_module.supabase = fake
+    client = app_module.app.test_client()
+    user = ids["users"][0]
+    paths = [("/parcelas", "/parcelas"), ("/caficultores", "/caficultores"),
+             ("/diagnoses", f"/diagnoses?idusuario={user}"),
+             ("/diagnoses (cursor)", f"/diagnoses?idusuario={user}&cursor=&limit=200"),
+             ("/risk_series", f"/risk_series/{ids['regions'][0]}/2025"),
+             ("/risk/regions", "/risk/regions/2025/6?drivers=1")]
+    out = []
+    for name, path in paths:
+        resp = client.get(path, headers={"Accept-Encoding": "identity"})
+        if resp.status_code != 200: print(f"  {name}: status {resp.status_code}, se omite"); continue
+        out.append((name, json.loads(resp.get_data())))
+    return out
+
+def _timed(fn: Callable[[], Any], repeat: int) -> Tuple[Any, float]:
+    fn()  # calentamiento
+    start = time.perf_counter()
+    for _ in range(repeat): result = fn()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+def run_json(args) -> int:
+    """Tiempo de serialización (json vs orjson) y tamaño comprimido por endpoint."""
+    from flask.json.provider import DefaultJSONProvider
+    import app as app_module
+    import compression
+    import json_provider
+    if json_provider.orjson is None: print("orjson no está instalado"); return 1
+    flask_app = app_module.app
+    std, fast = DefaultJSONProvider(flask_app), json_provider.OrjsonProvider(flask_app)
+    encodings = compression.encodings()
+
+    header = f"{'endpoint':<20} {'raw KB':>8} {'json ms':>8} {'orjson ms':>9} {'x':>5}"
+    for enc in encodings: header += f" {enc + ' KB':>8} {enc + ' ms':>7}"
+    print(header)
+    for name, obj in _json_payloads(args):
+        with flask_app.app_context():
+            raw, t_std = _timed(lambda: std.dumps(obj, separators=(",", ":")).encode(), args.repeat)
+            raw_fast, t_fast = _timed(lambda: fast.dumps(obj).encode(), args.repeat)
+        if json.loads(raw) != json.loads(raw_fast): print(f"  {name}: ¡las salidas difieren!"); return 1
+        line = f"{name:<20} {len(raw) / 1024:>8.1f} {t_std:>8.2f} {t_fast:>9.2f} {t_std / max(t_fast, 1e-9):>5.1f}"
+        for enc in encodings:
+            packed, t_enc = _timed(lambda: compression.compress(raw_fast, enc), args.repeat)
+            line += f" {len(packed) / 1024:>8.1f} {t_enc:>7.2f}"
+        print(line)
+    return 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Pruebas de carga de la API de PearCo")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    t = sub.add_parser("traffic", help="Reproduce tráfico mixto contra todas las rutas")
+    t.add_argument("--requests", type=int, default=2000)
+    t.add_argument("--concurrency", type=int, default=16)
+    t.add_argument("--warmup", type=int, default=50)
+    t.add_argument("--latency-ms", type=float, default=30.0, help="Latencia simulada por llamada a Supabase")
+    t.add_argument("--jitter-ms", type=float, default=10.0)
+    t.add_argument("--url", help="Servidor a probar (arrancado con SUPABASE_FAKE=1); si falta, en proceso")
+    t.add_argument("--seed", type=int, default=0)
+    t.add_argument("--out", help="Guarda el reporte en JSON")
+    t.add_argument("--baseline", help="Reporte JSON previo; falla si p95 empeora")
+    t.add_argument("--max-regression", type=float, default=0.20, help="Tolerancia relativa de p95 (0.20 = +20%%)")
+    t.add_argument("--min-delta-ms", type=float, default=5.0, help="Ignora diferencias de p95 menores a esto")
+    t.add_argument("--min-samples", type=int, default=20, help="No compara endpoints con menos muestras")
+    t.set_defaults(func=run_traffic)
+
+    u = sub.add_parser("upload-mem", help="Mide el pico de memoria por subida de imagen")
+    u.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 12], help="Tamaños de foto en MB")
+    u.add_argument("--concurrency", type=int, default=4)
+    u.add_argument("--path", choices=["/upload_image", "/diagnostic"], default="/upload_image")
+    u.add_argument("--latency-ms", type=float, default=0.0)
+    u.add_argument("--legacy", action="store_true", help="Lee el archivo completo antes de subirlo (comportamiento anterior)")
+    u.add_argument("--seed", type=int, default=0)
+    u.set_defaults(func=run_upload_mem)
+
+    j = sub.add_parser("json", help="Compara serialización json/orjson y compresión por endpoint")
+    j.add_argument("--parcelas", type=int, default=2000)
+    j.add_argument("--users", type=int, default=200)
+    j.add_argument("--diagnoses-per-user", type=int, default=200)
+    j.add_argument("--repeat", type=int, default=20)
+    j.add_argument("--seed", type=int, default=0)
+    j.set_defaults(func=run_json)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
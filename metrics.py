@@ -0,0 +1,150 @@
+# metrics.py
+# Instrumentación del cliente de Supabase: cada .execute(), .rpc() y llamada
+# a Storage se mide y se etiqueta con tabla, operación y ruta de Flask.
+# Se exporta en formato Prometheus por /metrics y como header por petición.
+from __future__ import annotations
+from typing import Any, Callable, Dict, Optional
+from contextvars import ContextVar
+import os
+import threading
+import time
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest, multiprocess,
+)
+
+QUERY_COUNT_HEADER = "X-Query-Count"
+QUERY_TIME_HEADER = "X-Query-Time-Ms"
+
+QUERY_DURATION = Histogram(
+    "supabase_query_duration_seconds", "Duración de cada llamada a Supabase",
+    ["table", "operation", "route"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+QUERY_TOTAL = Counter(
+    "supabase_queries_total", "Llamadas a Supabase", ["table", "operation", "route", "status"],
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_supabase_queries", "Llamadas a Supabase por petición HTTP", ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144),
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Duración de las peticiones HTTP", ["route", "method", "status"],
+)
+
+# Estado de la petición en curso. Es un dict mutable para que los hilos de
+# fanout (que copian el contexto) sumen sobre el mismo contador.
+_current: ContextVar[Optional[Dict[str, Any]]] = ContextVar("supabase_request_stats", default=None)
+
+# Métodos del query builder que definen la operación
+_VERBS = {"select", "insert", "update", "upsert", "delete"}
+# Métodos de Storage que no hacen HTTP (no cuentan como consulta)
+_LOCAL_STORAGE_METHODS = {"get_public_url"}
+
+# ---------- Medición ----------
+def _timed(table: str, operation: str, fn: Callable[[], Any]) -> Any:
+    stats = _current.get()
+    route = stats["route"] if stats else "-"
+    status = "ok"
+    start = time.perf_counter()
+    try:
+        return fn()
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        QUERY_DURATION.labels(table, operation, route).observe(elapsed)
+        QUERY_TOTAL.labels(table, operation, route, status).inc()
+        if stats is not None:
+            with stats["lock"]:
+                stats["count"] += 1
+                stats["seconds"] += elapsed
+
+class _Tracked:
+    """Envuelve un query builder y mide su .execute()."""
+    def __init__(self, target, table: str, operation: str):
+        self._target = target
+        self._table = table
+        self._operation = operation
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        # Propiedades que devuelven el builder (p. ej. .not_) también se envuelven
+        if not callable(attr):
+            return _Tracked(attr, self._table, self._operation) if hasattr(attr, "execute") else attr
+
+        def call(*args, **kwargs):
+            if name == "execute":
+                return _timed(self._table, self._operation, lambda: attr(*args, **kwargs))
+            result = attr(*args, **kwargs)
+            if hasattr(result, "execute"):
+                return _Tracked(result, self._table, name if name in _VERBS else self._operation)
+            return result
+        return call
+
+class _TrackedBucket:
+    def __init__(self, target, bucket: str):
+        self._target = target
+        self._bucket = bucket
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr) or name in _LOCAL_STORAGE_METHODS: return attr
+        return lambda *args, **kwargs: _timed(f"storage:{self._bucket}", name, lambda: attr(*args, **kwargs))
+
+class _TrackedStorage:
+    def __init__(self, target):
+        self._target = target
+
+    def from_(self, bucket: str):
+        return _TrackedBucket(self._target.from_(bucket), bucket)
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+class InstrumentedClient:
+    """Proxy del cliente de Supabase con la misma interfaz que usan los módulos."""
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name: str):
+        return _Tracked(self._client.table(name), name, "select")
+
+    def from_(self, name: str):
+        return self.table(name)
+
+    def rpc(self, fn: str, params: Optional[dict] = None, *args, **kwargs):
+        return _Tracked(self._client.rpc(fn, params or {}, *args, **kwargs), f"rpc:{fn}", "rpc")
+
+    @property
+    def storage(self):
+        return _TrackedStorage(self._client.storage)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+def instrument(client):
+    return None if client is None else InstrumentedClient(client)
+
+# ---------- Ciclo de la petición ----------
+def start_request(route: Optional[str]) -> None:
+    _current.set({"route": route or "-", "count": 0, "seconds": 0.0,
+                  "start": time.perf_counter(), "lock": threading.Lock()})
+
+def finish_request(response, method: str):
+    stats = _current.get()
+    if stats is None: return response
+    REQUEST_QUERIES.labels(stats["route"]).observe(stats["count"])
+    REQUEST_DURATION.labels(stats["route"], method, str(response.status_code)).observe(time.perf_counter() - stats["start"])
+    response.headers[QUERY_COUNT_HEADER] = str(stats["count"])
+    response.headers[QUERY_TIME_HEADER] = f"{stats['seconds'] * 1000:.1f}"
+    _current.set(None)
+    return response
+
+def render():
+    """Devuelve (cuerpo, content_type) para /metrics; agrega workers si PROMETHEUS_MULTIPROC_DIR está definido."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -2,13 +2,41 @@
 
 from flask import jsonify # Keep jsonify import here, might be needed if you add other non-route functions later
 from supabase import Client
+import os
 import traceback
+import cursors
+import parcelas_geo
+
+PARCELA_FIELDS = ("nombre", "hectareas", "tipo")
+UBICACION_FIELDS = ("estado", "municipio", "latitud", "longitud")
+# crear_parcelas (tablas.sql) inserta ubicación + parcela en una transacción y
+# un solo viaje; con PARCELAS_CREATE_RPC=0 se usan los dos inserts de antes
+# (mientras la función no exista en la base).
+CREATE_RPC = os.getenv("PARCELAS_CREATE_RPC", "1") == "1"
+# GET /parcelas?limit=&cursor=&fields=
+PAGE_DEFAULT = 100
+PAGE_MAX = 1000
+FULL_SELECT = "*, ubicacion(*)"
+PARCELA_COLUMNS = ("idparcela", "nombre", "hectareas", "tipo", "idubicacion")
+UBICACION_COLUMNS = ("idubicacion",) + UBICACION_FIELDS
+
+def crear_parcelas_rpc(supabase: Client, items: list) -> list:
+    """
+    items: [{nombre, hectareas, tipo, ubicacion: {estado, municipio, latitud, longitud}}].
+    Devuelve un resultado por elemento, en orden: {"ok": True, "parcela": {..., "ubicacion": {...}}}
+    o {"ok": False, "error": "..."}. Cada elemento es atómico por separado.
+    """
+    resp = supabase.rpc("crear_parcelas", {"items": items}).execute()
+    resultados = resp.data or []
+    for r in resultados:
+        if r.get("ok"): parcelas_geo.on_upsert(r["parcela"])
+    return resultados
 
 # --- Crear Parcela ---
 def crear_parcela(supabase: Client, data: dict):
     ubic = data.get("ubicacion") or {}
-    missing_parcela = [f for f in ("nombre", "hectareas", "tipo") if f not in data]
-    missing_ubic = [f for f in ("estado", "municipio", "latitud", "longitud") if f not in ubic]
+    missing_parcela = [f for f in PARCELA_FIELDS if f not in data]
+    missing_ubic = [f for f in UBICACION_FIELDS if f not in ubic]
     if missing_parcela or missing_ubic:
         print(f"Validation failed - Missing fields: Parcela={missing_parcela}, Ubicacion={missing_ubic}")
         # Return dict, not jsonify
@@ -16,7 +44,30 @@ def crear_parcela(supabase: Client, data: dict):
             "success": False, "error": "Datos incompletos",
             "missing": {"parcela": missing_parcela, "ubicacion": missing_ubic}
         }, 400)
+    if not CREATE_RPC: return _crear_parcela_dos_pasos(supabase, data, ubic)
 
+    try:
+        item = {f: data.get(f) for f in PARCELA_FIELDS}
+        item["ubicacion"] = {f: ubic.get(f) for f in UBICACION_FIELDS}
+        resultados = crear_parcelas_rpc(supabase, [item])
+        if not resultados:
+            print("Error creating parcela: RPC returned no data.")
+            return ({"success": False, "error": "No se pudo crear parcela (inesperado)"}, 500)
+        if not resultados[0].get("ok"):
+            print(f"Error creating parcela: {resultados[0].get('error')}")
+            return ({"success": False, "error": f"No se pudo crear parcela: {resultados[0].get('error')}"}, 500)
+
+        parcela_creada = resultados[0]["parcela"]
+        print(f"Parcela created: {parcela_creada.get('idparcela')}")
+        return ({"success": True, "data": parcela_creada}, 201)
+
+    except Exception as e:
+        print(f"🚨 Unexpected error in crear_parcela: {str(e)}")
+        print(traceback.format_exc())
+        return ({"success": False, "error": "Error interno servidor."}, 500)
+
+def _crear_parcela_dos_pasos(supabase: Client, data: dict, ubic: dict):
+    """Camino anterior: ubicación y parcela por separado, con borrado compensatorio."""
     id_ubicacion_creada = None
     try:
         ubicacion_payload = {
@@ -65,6 +116,7 @@ def crear_parcela(supabase: Client, data: dict):
 
         parcela_creada = parcela_resp.data[0]
         parcela_creada["ubicacion"] = ubicacion_creada
+        parcelas_geo.on_upsert(parcela_creada)
         print(f"Parcela created: {parcela_creada.get('idparcela')}")
         # Return dict
         return ({"success": True, "data": parcela_creada}, 201)
@@ -81,10 +133,34 @@ def crear_parcela(supabase: Client, data: dict):
         return ({"success": False, "error": "Error interno servidor."}, 500)
 
 # --- Obtener Todas las Parcelas ---
-def obtener_parcelas(supabase: Client):
+def select_de_campos(fields: str) -> str:
+    """
+    fields=nombre,hectareas,ubicacion.latitud -> select de PostgREST. "ubicacion"
+    trae la ubicación completa; sin campos de ubicación no se hace el embed.
+    idparcela va siempre (es la llave del cursor). Lanza ValueError con campos
+    desconocidos o sin ningún campo (fields= vacío).
+    """
+    propias, de_ubicacion, ubicacion_completa = ["idparcela"], [], False
+    campos = [f.strip() for f in fields.split(",") if f.strip()]
+    if not campos: raise ValueError("'fields' no puede estar vacío")
+    for campo in campos:
+        if campo == "ubicacion": ubicacion_completa = True
+        elif campo.startswith("ubicacion."):
+            col = campo[len("ubicacion."):]
+            if col not in UBICACION_COLUMNS: raise ValueError(f"Campo desconocido: {campo}")
+            if col not in de_ubicacion: de_ubicacion.append(col)
+        elif campo in PARCELA_COLUMNS:
+            if campo not in propias: propias.append(campo)
+        else: raise ValueError(f"Campo desconocido: {campo}")
+    select = ", ".join(propias)
+    if ubicacion_completa: select += ", ubicacion(*)"
+    elif de_ubicacion: select += f", ubicacion({', '.join(de_ubicacion)})"
+    return select
+
+def obtener_parcelas(supabase: Client, columns: str = FULL_SELECT):
     try:
         print("Fetching all parcelas with ubicacion...")
-        response = supabase.table("parcela").select("*, ubicacion(*)").execute()
+        response = supabase.table("parcela").select(columns).execute()
 
         if hasattr(response, 'error') and response.error:
              print(f"Error Supabase fetching parcelas: {response.error}")
@@ -102,6 +178,31 @@ def obtener_parcelas(supabase: Client):
         # Return dict
         return ({"success": False, "error": "Error interno servidor."}, 500)
 
+# --- Página de Parcelas (por llave idparcela) ---
+def listar_parcelas(supabase: Client, cursor: str = None, limit: int = PAGE_DEFAULT, columns: str = FULL_SELECT):
+    """
+    Devuelve tupla: ({"success", "data", "next_cursor", "has_more"}, status_code),
+    ordenado por idparcela. Lanza ValueError si el cursor no es válido.
+    """
+    q = supabase.table("parcela").select(columns)
+    if cursor: q = q.gt("idparcela", cursors.decode_id(cursor))
+    try:
+        response = q.order("idparcela").limit(limit + 1).execute()
+        if hasattr(response, 'error') and response.error:
+             print(f"Error Supabase fetching parcelas page: {response.error}")
+             return ({"success": False, "error": f"Error al obtener: {response.error.message}"}, 500)
+
+        data = response.data or []
+        has_more = len(data) > limit
+        data = data[:limit]
+        return ({"success": True, "data": data, "has_more": has_more,
+                 "next_cursor": cursors.encode_id(data[-1]["idparcela"]) if has_more else None}, 200)
+
+    except Exception as e:
+        print(f"🚨 Unexpected error in listar_parcelas: {str(e)}")
+        print(traceback.format_exc())
+        return ({"success": False, "error": "Error interno servidor."}, 500)
+
 # --- Obtener Una Parcela por ID ---
 def obtener_parcela(supabase: Client, idParcela: str):
     try:
@@ -128,45 +229,61 @@ def obtener_parcela(supabase: Client, idParcela: str):
         return ({"success": False, "error": "Error interno servidor."}, 500)
 
 # --- Modificar Parcela ---
+def _modificar_ubicacion(supabase: Client, idParcela: str, ubic: dict):
+    """Devuelve None si todo salió bien, o la tupla de error para la ruta."""
+    parcela_resp = supabase.table("parcela").select("idubicacion").eq("idparcela", idParcela).limit(1).execute()
+
+    if hasattr(parcela_resp, 'error') and parcela_resp.error:
+         print(f"Error finding idubicacion for {idParcela}: {parcela_resp.error}")
+         return ({"success": False, "error": f"Error buscar parcela: {parcela_resp.error.message}"}, 500)
+    if not parcela_resp.data:
+        print(f"Parcela {idParcela} not found for ubicacion update.")
+        return ({"success": False, "error": "Parcela no encontrada"}, 404)
+
+    current_idUbicacion = parcela_resp.data[0].get("idubicacion")
+    if not current_idUbicacion:
+         print(f"Error: Parcela {idParcela} has no idubicacion.")
+         return ({"success": False, "error": "Parcela sin ubicación asociada"}, 500)
+
+    ubicacion_payload = {k: ubic[k] for k in ("estado", "municipio", "latitud", "longitud") if k in ubic}
+    if ubicacion_payload:
+        print(f"Updating ubicacion {current_idUbicacion}: {ubicacion_payload}")
+        upd_ubic_resp = supabase.table("ubicacion").update(ubicacion_payload).eq("idubicacion", current_idUbicacion).execute()
+        if hasattr(upd_ubic_resp, 'error') and upd_ubic_resp.error:
+             print(f"Error updating ubicacion {current_idUbicacion}: {upd_ubic_resp.error}")
+             return ({"success": False, "error": f"Error actualizar ubicación: {upd_ubic_resp.error.message}"}, 500)
+    else: print("No fields to update for ubicacion.")
+    return None
+
+def _modificar_datos_parcela(supabase: Client, idParcela: str, parcela_payload: dict):
+    """Devuelve None si todo salió bien, o la tupla de error para la ruta."""
+    print(f"Updating parcela {idParcela}: {parcela_payload}")
+    upd_parc_resp = supabase.table("parcela").update(parcela_payload).eq("idparcela", idParcela).execute()
+    if hasattr(upd_parc_resp, 'error') and upd_parc_resp.error:
+         print(f"Error updating parcela {idParcela}: {upd_parc_resp.error}")
+         return ({"success": False, "error": f"Error actualizar parcela: {upd_parc_resp.error.message}"}, 500)
+    return None
+
 def modificar_parcela(supabase: Client, idParcela: str, data: dict):
     try:
         print(f"Modifying parcela: {idParcela} with data: {data}")
+        # Secuencial: si la ubicación falla (404/500) la parcela no se toca,
+        # así el cliente nunca recibe un error con media escritura aplicada.
         if "ubicacion" in data and isinstance(data["ubicacion"], dict):
-            parcela_resp = supabase.table("parcela").select("idubicacion").eq("idparcela", idParcela).limit(1).execute()
-
-            if hasattr(parcela_resp, 'error') and parcela_resp.error:
-                 print(f"Error finding idubicacion for {idParcela}: {parcela_resp.error}")
-                 return ({"success": False, "error": f"Error buscar parcela: {parcela_resp.error.message}"}, 500)
-            if not parcela_resp.data:
-                print(f"Parcela {idParcela} not found for ubicacion update.")
-                return ({"success": False, "error": "Parcela no encontrada"}, 404)
-
-            current_idUbicacion = parcela_resp.data[0].get("idubicacion")
-            if not current_idUbicacion:
-                 print(f"Error: Parcela {idParcela} has no idubicacion.")
-                 return ({"success": False, "error": "Parcela sin ubicación asociada"}, 500)
-
-            ubicacion_payload = {k: data["ubicacion"][k] for k in ("estado", "municipio", "latitud", "longitud") if k in data["ubicacion"]}
-            if ubicacion_payload:
-                print(f"Updating ubicacion {current_idUbicacion}: {ubicacion_payload}")
-                upd_ubic_resp = supabase.table("ubicacion").update(ubicacion_payload).eq("idubicacion", current_idUbicacion).execute()
-                if hasattr(upd_ubic_resp, 'error') and upd_ubic_resp.error:
-                     print(f"Error updating ubicacion {current_idUbicacion}: {upd_ubic_resp.error}")
-                     return ({"success": False, "error": f"Error actualizar ubicación: {upd_ubic_resp.error.message}"}, 500)
-            else: print("No fields to update for ubicacion.")
+            error = _modificar_ubicacion(supabase, idParcela, data["ubicacion"])
+            if error is not None: return error
 
         parcela_payload = {k: data[k] for k in ("nombre", "hectareas", "tipo") if k in data}
         if parcela_payload:
-            print(f"Updating parcela {idParcela}: {parcela_payload}")
-            upd_parc_resp = supabase.table("parcela").update(parcela_payload).eq("idparcela", idParcela).execute()
-            if hasattr(upd_parc_resp, 'error') and upd_parc_resp.error:
-                 print(f"Error updating parcela {idParcela}: {upd_parc_resp.error}")
-                 return ({"success": False, "error": f"Error actualizar parcela: {upd_parc_resp.error.message}"}, 500)
+            error = _modificar_datos_parcela(supabase, idParcela, parcela_payload)
+            if error is not None: return error
         else: print("No fields to update for parcela.")
 
         print(f"Modification complete for {idParcela}. Fetching...")
         # Return tuple from obtener_parcela
-        return obtener_parcela(supabase, idParcela)
+        response, status_code = obtener_parcela(supabase, idParcela)
+        if status_code == 200: parcelas_geo.on_upsert(response["data"])
+        return response, status_code
 
     except Exception as e:
         print(f"🚨 Unexpected error in modificar_parcela ID {idParcela}: {str(e)}")
@@ -212,6 +329,7 @@ def eliminar_parcela(supabase: Client, idParcela: str):
             else: print(f"Ubicacion {idUbicacion} deleted.")
         else: print(f"No associated ubicacion for {idParcela}.")
 
+        parcelas_geo.on_delete(idParcela)
         print(f"Parcela {idParcela} deletion complete.")
         # Return dict
         return ({"success": True, "data": f"Parcela {idParcela} eliminada"}, 200)
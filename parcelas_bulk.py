@@ -0,0 +1,124 @@
+# parcelas_bulk.py
+# POST /parcelas/bulk: importa miles de parcelas desde CSV o NDJSON. Las filas
+# válidas se mandan a la RPC crear_parcelas en lotes de CHUNK_SIZE (un viaje
+# por lote, cada fila atómica) y el resultado de cada fila se va entregando
+# conforme termina su lote.
+from __future__ import annotations
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import csv
+import io
+import json
+import os
+import parcelas
+
+MAX_ROWS = int(os.getenv("PARCELAS_BULK_MAX_ROWS", "20000"))
+CHUNK_SIZE = int(os.getenv("PARCELAS_BULK_CHUNK_SIZE", "200"))
+# Columnas del CSV (la ubicación va plana); "client_id" es opcional y se devuelve tal cual
+CSV_COLUMNS = parcelas.PARCELA_FIELDS + parcelas.UBICACION_FIELDS
+NUMERIC_FIELDS = {"hectareas": (0, None), "latitud": (-90, 90), "longitud": (-180, 180)}
+
+class BulkError(Exception):
+    """Archivo mal formado en conjunto (no una fila en particular)."""
+
+# ---------- Lectura ----------
+def _anidar(fila: Dict[str, Any]) -> Dict[str, Any]:
+    """Fila plana (CSV o NDJSON sin "ubicacion") a la forma de POST /parcelas."""
+    if isinstance(fila.get("ubicacion"), dict): return fila
+    out = {k: v for k, v in fila.items() if k not in parcelas.UBICACION_FIELDS}
+    out["ubicacion"] = {k: fila.get(k) for k in parcelas.UBICACION_FIELDS}
+    return out
+
+def parse_csv(stream) -> List[Dict[str, Any]]:
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    faltan = [c for c in CSV_COLUMNS if c not in (reader.fieldnames or [])]
+    if faltan: raise BulkError(f"Faltan columnas en el CSV: {', '.join(faltan)}")
+    out = []
+    try:
+        for fila in reader:
+            if len(out) >= MAX_ROWS: raise BulkError(f"Máximo {MAX_ROWS} parcelas por solicitud")
+            out.append(_anidar({k: (v.strip() if isinstance(v, str) else v) for k, v in fila.items() if k}))
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise BulkError(f"CSV inválido (fila {len(out) + 1}): {e}")
+    return out
+
+def parse_ndjson(stream) -> List[Dict[str, Any]]:
+    """Un objeto por línea, con "ubicacion" anidada como en POST /parcelas o plana como en el CSV."""
+    out = []
+    for n, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line: continue
+        if len(out) >= MAX_ROWS: raise BulkError(f"Máximo {MAX_ROWS} parcelas por solicitud")
+        try:
+            fila = json.loads(line)
+            if not isinstance(fila, dict): raise ValueError()
+        except ValueError:
+            out.append({"_error": f"Línea {n}: JSON inválido"}); continue
+        out.append(_anidar(fila))
+    return out
+
+# ---------- Validación ----------
+def _numero(campo: str, valor) -> Optional[str]:
+    try: x = float(valor)
+    except (TypeError, ValueError): return f"{campo} debe ser numérico"
+    lo, hi = NUMERIC_FIELDS[campo]
+    if (lo is not None and x < lo) or (hi is not None and x > hi): return f"{campo} fuera de rango"
+    return None
+
+def normalizar(fila: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Devuelve (elemento para crear_parcelas, None) o (None, error)."""
+    if fila.get("_error"): return None, fila["_error"]
+    ubic = fila.get("ubicacion") or {}
+    faltan = [f for f in parcelas.PARCELA_FIELDS if fila.get(f) in (None, "")]
+    faltan += [f for f in parcelas.UBICACION_FIELDS if ubic.get(f) in (None, "")]
+    if faltan: return None, f"Faltan campos: {', '.join(faltan)}"
+    item = {f: fila[f] for f in parcelas.PARCELA_FIELDS}
+    item["ubicacion"] = {f: ubic[f] for f in parcelas.UBICACION_FIELDS}
+    for campo in NUMERIC_FIELDS:
+        valor = item[campo] if campo in item else item["ubicacion"][campo]
+        error = _numero(campo, valor)
+        if error: return None, error
+        if campo in item: item[campo] = float(valor)
+        else: item["ubicacion"][campo] = float(valor)
+    return item, None
+
+# ---------- Importación ----------
+def _resultado(n: int, fila: Dict[str, Any], status: str, **campos) -> Dict[str, Any]:
+    out = {"row": n, "status": status, **campos}
+    if fila.get("client_id") is not None: out["client_id"] = fila["client_id"]
+    return out
+
+def importar(supabase, filas: List[Dict[str, Any]], chunk_size: int = CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Genera un resultado por fila (row = número de fila de datos, desde 1):
+    created (con idparcela/idubicacion), invalid o failed; al final
+    {"summary": {...}}. Las filas inválidas se reportan en cuanto se leen.
+    """
+    resumen = {"created": 0, "invalid": 0, "failed": 0}
+    lote: List[Tuple[int, Dict[str, Any], Dict[str, Any]]] = []
+
+    def enviar() -> Iterator[Dict[str, Any]]:
+        try:
+            resultados = parcelas.crear_parcelas_rpc(supabase, [item for _, _, item in lote])
+        except Exception as e:
+            print(f"🚨 Error en lote de parcelas (filas {lote[0][0]}-{lote[-1][0]}): {e}")
+            resultados = [{"ok": False, "error": str(e)}] * len(lote)
+        for (n, fila, _), r in zip(lote, resultados + [{"ok": False, "error": "Sin resultado"}] * (len(lote) - len(resultados))):
+            if r.get("ok"):
+                resumen["created"] += 1
+                p = r["parcela"]
+                yield _resultado(n, fila, "created", idparcela=p.get("idparcela"), idubicacion=p.get("idubicacion"))
+            else:
+                resumen["failed"] += 1
+                yield _resultado(n, fila, "failed", error=r.get("error"))
+        lote.clear()
+
+    for n, fila in enumerate(filas, 1):
+        item, error = normalizar(fila)
+        if error:
+            resumen["invalid"] += 1
+            yield _resultado(n, fila, "invalid", error=error)
+            continue
+        lote.append((n, fila, item))
+        if len(lote) >= chunk_size: yield from enviar()
+    if lote: yield from enviar()
+    yield {"summary": {**resumen, "rows": len(filas)}}
@@ -0,0 +1,232 @@
+# parcelas_geo.py
+# Índice espacial en memoria (rejilla de CELL_DEG grados) sobre las
+# coordenadas de ubicacion para GET /parcelas/near y GET /parcelas/bbox.
+# Se carga la primera vez que se consulta y se recarga cada TTL_SECONDS
+# (otros workers pudieron escribir); las altas, cambios y bajas de este
+# worker lo actualizan al momento desde parcelas.py.
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+import heapq
+import math
+import os
+import threading
+import time
+import risk
+
+CELL_DEG = float(os.getenv("PARCELAS_GEO_CELL_DEG", "0.1"))  # ~11 km
+TTL_SECONDS = float(os.getenv("PARCELAS_GEO_TTL_SECONDS", "300"))
+NEAR_MAX_K = 100
+BBOX_MAX_LIMIT = 5000
+EARTH_KM = 6371.0088
+KM_PER_DEG = math.pi * EARTH_KM / 180
+
+Cell = Tuple[int, int]
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def _cell(lat: float, lon: float) -> Cell:
+    return (math.floor(lat / CELL_DEG), math.floor(lon / CELL_DEG))
+
+def _coords(parcela: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    u = parcela.get("ubicacion") or {}
+    try: return float(u["latitud"]), float(u["longitud"])
+    except (KeyError, TypeError, ValueError): return None
+
+class GridIndex:
+    """
+    Puntos por celda; no es seguro entre hilos (lo protege el lock del módulo).
+    Por defecto indexa parcelas (idparcela + ubicacion embebida); key y coords
+    permiten indexar otras filas con coordenadas.
+    """
+    def __init__(self, key: str = "idparcela", coords: Callable[[Dict[str, Any]], Optional[Tuple[float, float]]] = _coords):
+        self.key = key
+        self.coords = coords
+        self.points: Dict[str, Tuple[float, float, Dict[str, Any]]] = {}
+        self.cells: Dict[Cell, Set[str]] = {}
+        # celdas extremas ocupadas alguna vez (no se encogen al borrar); limitan los anillos de near()
+        self.bounds: Optional[List[int]] = None
+
+    def upsert(self, parcela: Dict[str, Any]) -> None:
+        pid = parcela.get(self.key)
+        if not pid: return
+        self.remove(pid)
+        coords = self.coords(parcela)
+        if coords is None: return
+        self.points[pid] = (coords[0], coords[1], parcela)
+        cell = _cell(*coords)
+        self.cells.setdefault(cell, set()).add(pid)
+        b = self.bounds
+        if b is None: self.bounds = [cell[0], cell[0], cell[1], cell[1]]
+        else: b[:] = [min(b[0], cell[0]), max(b[1], cell[0]), min(b[2], cell[1]), max(b[3], cell[1])]
+
+    def remove(self, pid: str) -> None:
+        old = self.points.pop(pid, None)
+        if old is None: return
+        cell = _cell(old[0], old[1])
+        ids = self.cells.get(cell)
+        if ids is not None:
+            ids.discard(pid)
+            if not ids: del self.cells[cell]
+
+    def near(self, lat: float, lon: float, k: int, max_km: Optional[float] = None) -> List[Tuple[float, Dict[str, Any]]]:
+        """k más cercanas por anillos de celdas alrededor del punto; para cuando ya ninguna celda sin ver puede estar más cerca."""
+        if not self.cells: return []
+        c_lat, c_lon = _cell(lat, lon)
+        max_ring = max(abs(c_lat - self.bounds[0]), abs(c_lat - self.bounds[1]),
+                       abs(c_lon - self.bounds[2]), abs(c_lon - self.bounds[3]))
+        best: List[Tuple[float, str]] = []  # heap de (-distancia, id) con las k mejores
+        for r in range(max_ring + 1):
+            if (2 * r + 1) ** 2 > 4 * len(self.cells):
+                # punto lejos de todo: sale más barato medir contra todas las parcelas
+                return self._near_scan(lat, lon, k, max_km)
+            for cell in self._ring(c_lat, c_lon, r):
+                for pid in self.cells.get(cell, ()):
+                    p_lat, p_lon, _ = self.points[pid]
+                    d = haversine_km(lat, lon, p_lat, p_lon)
+                    if max_km is not None and d > max_km: continue
+                    if len(best) < k: heapq.heappush(best, (-d, pid))
+                    elif d < -best[0][0]: heapq.heapreplace(best, (-d, pid))
+            # distancia mínima a cualquier punto fuera del bloque ya revisado
+            south, north = (c_lat - r) * CELL_DEG, (c_lat + r + 1) * CELL_DEG
+            west, east = (c_lon - r) * CELL_DEG, (c_lon + r + 1) * CELL_DEG
+            cos_lat = math.cos(math.radians(min(90.0, max(abs(south), abs(north)))))
+            bound = min(min(lat - south, north - lat) * KM_PER_DEG, min(lon - west, east - lon) * KM_PER_DEG * cos_lat)
+            if (len(best) == k and -best[0][0] <= bound) or (max_km is not None and bound > max_km): break
+        return sorted(((-nd, self.points[pid][2]) for nd, pid in best), key=lambda t: t[0])
+
+    def _near_scan(self, lat: float, lon: float, k: int, max_km: Optional[float]) -> List[Tuple[float, Dict[str, Any]]]:
+        dists = ((haversine_km(lat, lon, p_lat, p_lon), parcela) for p_lat, p_lon, parcela in self.points.values())
+        if max_km is not None: dists = (t for t in dists if t[0] <= max_km)
+        return heapq.nsmallest(k, dists, key=lambda t: t[0])
+
+    @staticmethod
+    def _ring(c_lat: int, c_lon: int, r: int):
+        if r == 0:
+            yield (c_lat, c_lon); return
+        for dc in range(-r, r + 1):
+            yield (c_lat - r, c_lon + dc); yield (c_lat + r, c_lon + dc)
+        for dr in range(-r + 1, r):
+            yield (c_lat + dr, c_lon - r); yield (c_lat + dr, c_lon + r)
+
+    def bbox(self, south: float, west: float, north: float, east: float, limit: int) -> List[Dict[str, Any]]:
+        lo, hi = _cell(south, west), _cell(north, east)
+        span = (hi[0] - lo[0] + 1) * (hi[1] - lo[1] + 1)
+        # caja grande: recorrer las celdas ocupadas sale más barato que todas las de la caja
+        if span > len(self.cells):
+            cells = [c for c in self.cells if lo[0] <= c[0] <= hi[0] and lo[1] <= c[1] <= hi[1]]
+        else:
+            cells = [(i, j) for i in range(lo[0], hi[0] + 1) for j in range(lo[1], hi[1] + 1) if (i, j) in self.cells]
+        out = []
+        for cell in sorted(cells):
+            for pid in sorted(self.cells[cell]):
+                p_lat, p_lon, parcela = self.points[pid]
+                if south <= p_lat <= north and west <= p_lon <= east:
+                    out.append(parcela)
+                    if len(out) >= limit: return out
+        return out
+
+# ---------- Índice del worker ----------
+_lock = threading.Lock()
+_load_lock = threading.Lock()
+_state: Dict[str, Any] = {"index": None, "loaded_at": 0.0, "loading": False, "pending": [], "loads": 0, "queries": 0}
+
+def _cargar(supabase) -> GridIndex:
+    def make_query():
+        return supabase.table("parcela").select("*, ubicacion(*)").order("idparcela")
+    index = GridIndex()
+    for parcela in risk.fetch_all(make_query): index.upsert(parcela)
+    return index
+
+def _fresco() -> Optional[GridIndex]:
+    index = _state["index"]
+    if index is not None and time.monotonic() - _state["loaded_at"] < TTL_SECONDS: return index
+    return None
+
+def get_index(supabase) -> GridIndex:
+    with _lock:
+        index = _state["index"]
+        if _fresco() is not None: return index
+    # Un solo hilo recarga; mientras, los demás usan el índice anterior si lo hay
+    if not _load_lock.acquire(blocking=index is None): return index
+    try:
+        with _lock:
+            if _fresco() is not None: return _state["index"]
+            _state["loading"] = True; _state["pending"] = []
+        nuevo = _cargar(supabase)
+        with _lock:
+            # cambios hechos por este worker mientras se cargaba
+            for op in _state["pending"]: op(nuevo)
+            _state.update(index=nuevo, loaded_at=time.monotonic())
+            _state["loads"] += 1
+            return nuevo
+    finally:
+        with _lock: _state["loading"] = False; _state["pending"] = []
+        _load_lock.release()
+
+def _aplicar(op: Callable[[GridIndex], None]) -> None:
+    with _lock:
+        if _state["loading"]: _state["pending"].append(op)
+        if _state["index"] is not None: op(_state["index"])
+
+def on_upsert(parcela: Dict[str, Any]) -> None:
+    """Llamar con la parcela (con "ubicacion" embebida) tras crearla o modificarla."""
+    parcela = dict(parcela)
+    _aplicar(lambda index: index.upsert(parcela))
+
+def on_delete(id_parcela: str) -> None:
+    _aplicar(lambda index: index.remove(id_parcela))
+
+def coordenadas(supabase, id_parcela: str) -> Optional[Tuple[float, float]]:
+    """(lat, lon) de la parcela desde el índice; None si no está o no tiene coordenadas."""
+    index = get_index(supabase)
+    with _lock:
+        point = index.points.get(id_parcela)
+        return (point[0], point[1]) if point is not None else None
+
+def todas_coordenadas(supabase) -> Dict[str, Tuple[float, float]]:
+    index = get_index(supabase)
+    with _lock:
+        return {pid: (p[0], p[1]) for pid, p in index.points.items()}
+
+def invalidate() -> None:
+    with _lock:
+        _state["index"] = None; _state["loaded_at"] = 0.0
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        index = _state["index"]
+        return {
+            "parcelas": len(index.points) if index is not None else 0,
+            "cells": len(index.cells) if index is not None else 0,
+            "cell_deg": CELL_DEG,
+            "loads": _state["loads"],
+            "queries": _state["queries"],
+            "age_seconds": time.monotonic() - _state["loaded_at"] if index is not None else None,
+            "ttl_seconds": TTL_SECONDS,
+        }
+
+# ---------- Consultas (para las rutas) ----------
+def cercanas(supabase, lat: float, lon: float, k: int = 10, max_km: Optional[float] = None):
+    """Devuelve tupla: (dict, status_code). Cada parcela lleva "distance_km"."""
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180): return ({"success": False, "error": "Coordenadas fuera de rango"}, 400)
+    if not 1 <= k <= NEAR_MAX_K: return ({"success": False, "error": f"'k' debe estar entre 1 y {NEAR_MAX_K}"}, 400)
+    if max_km is not None and max_km <= 0: return ({"success": False, "error": "'max_km' debe ser positivo"}, 400)
+    index = get_index(supabase)
+    with _lock:
+        _state["queries"] += 1
+        hits = index.near(lat, lon, k, max_km)
+    return ({"success": True, "data": [{**p, "distance_km": round(d, 3)} for d, p in hits]}, 200)
+
+def en_caja(supabase, south: float, west: float, north: float, east: float, limit: int = 1000):
+    """Devuelve tupla: (dict, status_code) con las parcelas dentro de la caja."""
+    if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+        return ({"success": False, "error": "Caja inválida: se espera min_lat <= max_lat y min_lon <= max_lon"}, 400)
+    if not 1 <= limit <= BBOX_MAX_LIMIT: return ({"success": False, "error": f"'limit' debe estar entre 1 y {BBOX_MAX_LIMIT}"}, 400)
+    index = get_index(supabase)
+    with _lock:
+        _state["queries"] += 1
+        hits = index.bbox(south, west, north, east, limit + 1)
+    return ({"success": True, "data": hits[:limit], "truncated": len(hits) > limit}, 200)
@@ -0,0 +1,193 @@
+# parcelas_region.py
+# Región de riesgo de cada parcela: la del centroide (tabla region) más
+# cercano a su ubicación. La tabla parcela -> región se calcula completa en
+# memoria a partir del índice de parcelas_geo y se mantiene por worker, así
+# el riesgo de una parcela cuesta lo mismo que el de su región.
+# La tabla region se llena con: python parcelas_region.py load regiones.csv
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+import csv
+import os
+import sys
+import threading
+import time
+import parcelas_geo
+import risk_snapshots
+
+REGIONS_TTL_SECONDS = float(os.getenv("PARCELAS_REGION_TTL_SECONDS", "3600"))
+# Más lejos que esto de todo centroide, la parcela no tiene región
+MAX_KM = float(os.getenv("PARCELAS_REGION_MAX_KM", "150"))
+# Ids que no existen (o sin coordenadas): se recuerdan un rato para no consultar cada vez
+UNKNOWN_TTL_SECONDS = float(os.getenv("PARCELAS_REGION_UNKNOWN_TTL_SECONDS", "60"))
+UNKNOWN_MAX = 10000
+
+def _region_coords(fila: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    try: return float(fila["latitud"]), float(fila["longitud"])
+    except (KeyError, TypeError, ValueError): return None
+
+_lock = threading.Lock()
+_load_lock = threading.Lock()
+# regions: índice de centroides; tabla: idparcela -> (lat, lon, region_id, distance_km);
+# desconocidas: idparcela -> expira (monotonic)
+_cache: Dict[str, Any] = {"regions": None, "loaded_at": 0.0, "tabla": {}, "hits": 0, "misses": 0,
+                          "generation": 0, "desconocidas": OrderedDict()}
+
+def _cargar_regiones(supabase) -> parcelas_geo.GridIndex:
+    resp = supabase.table("region").select("region_id, latitud, longitud").execute()
+    index = parcelas_geo.GridIndex(key="region_id", coords=_region_coords)
+    for fila in resp.data or []: index.upsert(fila)
+    return index
+
+def _asignar(regions: parcelas_geo.GridIndex, lat: float, lon: float) -> Tuple[Optional[str], Optional[float]]:
+    hits = regions.near(lat, lon, 1, MAX_KM)
+    if not hits: return None, None
+    d, fila = hits[0]
+    return fila["region_id"], round(d, 3)
+
+def _fresco() -> Optional[parcelas_geo.GridIndex]:
+    regions = _cache["regions"]
+    if regions is not None and time.monotonic() - _cache["loaded_at"] < REGIONS_TTL_SECONDS: return regions
+    return None
+
+def _regiones(supabase) -> parcelas_geo.GridIndex:
+    """Centroides con TTL; al recargarlos se recalcula la tabla de todas las parcelas."""
+    with _lock:
+        regions = _cache["regions"]
+        if _fresco() is not None: return regions
+    # Un solo hilo recarga; mientras, los demás usan los centroides anteriores si los hay
+    if not _load_lock.acquire(blocking=regions is None): return regions
+    try:
+        with _lock:
+            if _fresco() is not None: return _cache["regions"]
+            generation = _cache["generation"]
+        regions = _cargar_regiones(supabase)
+        tabla = {pid: (lat, lon, *_asignar(regions, lat, lon))
+                 for pid, (lat, lon) in parcelas_geo.todas_coordenadas(supabase).items()}
+        with _lock:
+            # una invalidación durante la carga la descarta (pudo leer la tabla region vieja)
+            if _cache["generation"] == generation:
+                _cache.update(regions=regions, loaded_at=time.monotonic(), tabla=tabla)
+        return regions
+    finally:
+        _load_lock.release()
+
+def _desconocida(id_parcela: str) -> bool:
+    with _lock:
+        expira = _cache["desconocidas"].get(id_parcela)
+        if expira is None: return False
+        if expira > time.monotonic(): return True
+        del _cache["desconocidas"][id_parcela]
+        return False
+
+def _recordar_desconocida(id_parcela: str) -> None:
+    with _lock:
+        desconocidas = _cache["desconocidas"]
+        desconocidas[id_parcela] = time.monotonic() + UNKNOWN_TTL_SECONDS
+        desconocidas.move_to_end(id_parcela)
+        while len(desconocidas) > UNKNOWN_MAX: desconocidas.popitem(last=False)
+
+def _coordenadas(supabase, id_parcela: str) -> Optional[Tuple[float, float]]:
+    coords = parcelas_geo.coordenadas(supabase, id_parcela)
+    if coords is not None: return coords
+    if _desconocida(id_parcela): return None
+    # Creada en otro worker después de cargar el índice: se trae y se agrega
+    resp = supabase.table("parcela").select("*, ubicacion(*)").eq("idparcela", id_parcela).limit(1).execute()
+    if resp.data: parcelas_geo.on_upsert(resp.data[0])
+    coords = parcelas_geo.coordenadas(supabase, id_parcela) if resp.data else None
+    if coords is None: _recordar_desconocida(id_parcela)
+    return coords
+
+def region_de(supabase, id_parcela: str) -> Optional[Dict[str, Any]]:
+    """
+    {"region_id", "distance_km"} de la parcela (region_id None si ningún
+    centroide está a menos de MAX_KM). None si la parcela no existe o no
+    tiene coordenadas.
+    """
+    regions = _regiones(supabase)
+    coords = _coordenadas(supabase, id_parcela)
+    if coords is None: return None
+    with _lock:
+        fila = _cache["tabla"].get(id_parcela)
+        # la entrada vale mientras la parcela no se haya movido
+        if fila is not None and fila[:2] == coords:
+            _cache["hits"] += 1
+            return {"region_id": fila[2], "distance_km": fila[3]}
+        _cache["misses"] += 1
+    region_id, distance = _asignar(regions, *coords)
+    with _lock: _cache["tabla"][id_parcela] = (coords[0], coords[1], region_id, distance)
+    return {"region_id": region_id, "distance_km": distance}
+
+def invalidate() -> None:
+    with _lock:
+        _cache.update(regions=None, loaded_at=0.0, tabla={}, desconocidas=OrderedDict())
+        _cache["generation"] += 1
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        regions = _cache["regions"]
+        return {
+            "regions": len(regions.points) if regions is not None else 0,
+            "parcelas": len(_cache["tabla"]),
+            "unknown": len(_cache["desconocidas"]),
+            "hits": _cache["hits"],
+            "misses": _cache["misses"],
+            "age_seconds": time.monotonic() - _cache["loaded_at"] if regions is not None else None,
+            "ttl_seconds": REGIONS_TTL_SECONDS,
+            "max_km": MAX_KM,
+        }
+
+# ---------- Riesgo (para las rutas) ----------
+def _resolver(supabase, id_parcela: str):
+    if not _regiones(supabase).points:
+        return None, ({"error": "Sin centroides de región cargados (ver python parcelas_region.py load)"}, 503)
+    region = region_de(supabase, id_parcela)
+    if region is None: return None, ({"error": "Parcela no encontrada o sin coordenadas"}, 404)
+    if region["region_id"] is None: return None, ({"error": f"Parcela a más de {MAX_KM:g} km de toda región con datos de riesgo"}, 404)
+    return region, None
+
+def riesgo(supabase, id_parcela: str, year: int, month: int):
+    """Devuelve tupla: (riesgo de la región de la parcela, status_code)."""
+    region, error = _resolver(supabase, id_parcela)
+    if error: return error
+    payload = risk_snapshots.serve_risk_json(supabase, region["region_id"], year, month)
+    return ({**payload, "idparcela": id_parcela, "region_distance_km": region["distance_km"]}, 200)
+
+def serie(supabase, id_parcela: str, year: int):
+    """Devuelve tupla: ({"idparcela", "region_id", "region_distance_km", "series"}, status_code)."""
+    region, error = _resolver(supabase, id_parcela)
+    if error: return error
+    series: List[Dict[str, Any]] = risk_snapshots.serve_risk_series_json(supabase, region["region_id"], year)
+    return ({"idparcela": id_parcela, "region_id": region["region_id"],
+             "region_distance_km": region["distance_km"], "series": series}, 200)
+
+# ---------- Carga de centroides ----------
+def leer_csv(path: str) -> List[Dict[str, Any]]:
+    """Filas region_id,nombre,latitud,longitud (nombre opcional). ValueError en la primera fila inválida."""
+    filas = []
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        for n, fila in enumerate(csv.DictReader(f), 1):
+            region_id = (fila.get("region_id") or "").strip()
+            coords = _region_coords(fila)
+            if not region_id or coords is None or not (-90 <= coords[0] <= 90 and -180 <= coords[1] <= 180):
+                raise ValueError(f"Fila {n}: se esperan region_id, latitud y longitud válidos")
+            filas.append({"region_id": region_id, "nombre": (fila.get("nombre") or "").strip() or None,
+                          "latitud": coords[0], "longitud": coords[1]})
+    return filas
+
+def cargar(supabase, filas: List[Dict[str, Any]]) -> int:
+    """Upsert de los centroides por region_id; los workers los toman al vencer su TTL (o al invalidar)."""
+    if filas: supabase.table("region").upsert(filas, on_conflict="region_id").execute()
+    return len(filas)
+
+if __name__ == "__main__":
+    # Cliente propio: importar app arrancaría el resto del servicio
+    from dotenv import load_dotenv
+    from supabase import create_client
+    if len(sys.argv) != 3 or sys.argv[1] != "load": sys.exit("Uso: python parcelas_region.py load regiones.csv")
+    load_dotenv()
+    url, key = os.getenv("NEXT_PUBLIC_SUPABASE_URL"), os.getenv("NEXT_PUBLIC_SUPABASE_ANON_KEY")
+    if not url or not key: sys.exit("NEXT_PUBLIC_SUPABASE_URL / NEXT_PUBLIC_SUPABASE_ANON_KEY no configuradas")
+    try: filas = leer_csv(sys.argv[2])
+    except (OSError, ValueError) as e: sys.exit(str(e))
+    print(f"{cargar(create_client(url, key), filas)} regiones cargadas")
@@ -1,16 +1,59 @@
 # risk.py
 from __future__ import annotations
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
+import os
+import threading
+import time
+import fanout
+
+DISEASES = ["roya","broca","ojogallo","antracnosis"]
+
+# ---------- Cache de disease_prior ----------
+# La tabla es diminuta (4 enfermedades x 12 meses) y casi no cambia:
+# se carga completa una vez por worker y se refresca cada PRIOR_TTL_SECONDS.
+PRIOR_TTL_SECONDS = float(os.getenv("RISK_PRIOR_TTL_SECONDS", "3600"))
+
+_prior_lock = threading.Lock()
+_prior_cache: Dict[str, Any] = {"data": None, "loaded_at": 0.0, "hits": 0, "misses": 0, "generation": 0}
+
+def get_priors(supabase) -> Dict[Tuple[str, int], float]:
+    with _prior_lock:
+        data = _prior_cache["data"]
+        if data is not None and time.monotonic() - _prior_cache["loaded_at"] < PRIOR_TTL_SECONDS:
+            _prior_cache["hits"] += 1
+            return data
+        _prior_cache["misses"] += 1
+        generation = _prior_cache["generation"]
+    data = _get_priors_all(supabase)
+    with _prior_lock:
+        # Si se invalidó mientras se cargaba, estos datos pueden ser previos al cambio: no se guardan
+        if _prior_cache["generation"] == generation:
+            _prior_cache["data"] = data
+            _prior_cache["loaded_at"] = time.monotonic()
+    return data
+
+def invalidate_prior_cache() -> None:
+    """Fuerza recargar disease_prior en la siguiente consulta."""
+    with _prior_lock:
+        _prior_cache["data"] = None
+        _prior_cache["loaded_at"] = 0.0
+        _prior_cache["generation"] += 1
+
+def prior_cache_stats() -> Dict[str, Any]:
+    with _prior_lock:
+        data = _prior_cache["data"]
+        age = time.monotonic() - _prior_cache["loaded_at"] if data is not None else None
+        return {
+            "hits": _prior_cache["hits"],
+            "misses": _prior_cache["misses"],
+            "entries": len(data) if data is not None else 0,
+            "age_seconds": age,
+            "ttl_seconds": PRIOR_TTL_SECONDS,
+        }
 
 # ---------- Helpers de datos ----------
 def _get_prior(supabase, disease: str, month: int) -> Optional[float]:
-    resp = supabase.table("disease_prior") \
-        .select("prior") \
-        .eq("disease", disease) \
-        .eq("month", month) \
-        .limit(1).execute()
-    rows = resp.data or []
-    return float(rows[0]["prior"]) if rows else None
+    return get_priors(supabase).get((disease, month))
 
 def _get_weather(supabase, region_id: str, year: int, month: int) -> Dict[str, Any]:
     resp = supabase.table("weather_monthly") \
@@ -26,6 +69,52 @@ def _get_factors(supabase, region_id: str, year: int, month: int) -> Dict[str, A
         .limit(1).execute()
     return (resp.data or [{}])[0]
 
+# ---------- Lecturas en bloque ----------
+# PostgREST corta cada respuesta en max-rows (1000 por defecto en Supabase),
+# así que las lecturas grandes se piden por páginas con un orden estable.
+PAGE_SIZE = 1000
+
+def fetch_all(make_query, page_size: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+    """make_query() debe devolver un query builder nuevo (ordenado) en cada llamada."""
+    rows: List[Dict[str, Any]] = []
+    offset = 0
+    while True:
+        page = make_query().range(offset, offset + page_size - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < page_size: return rows
+        offset += page_size
+
+# ---------- Helpers por año (una consulta por tabla) ----------
+def _get_priors_all(supabase) -> Dict[Tuple[str, int], float]:
+    resp = supabase.table("disease_prior").select("disease,month,prior").execute()
+    out = {}
+    for r in resp.data or []:
+        key = (r["disease"], int(r["month"]))
+        if key not in out:  # igual que .limit(1): se queda con la primera fila
+            out[key] = float(r["prior"])
+    return out
+
+def _by_month(rows: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    out = {}
+    for r in rows:
+        m = int(r.pop("month"))
+        if m not in out: out[m] = r
+    return out
+
+def _get_weather_year(supabase, region_id: str, year: int) -> Dict[int, Dict[str, Any]]:
+    resp = supabase.table("weather_monthly") \
+        .select("month,t_mean_c,rh_mean,rain_days,leaf_wet_hours,cloudy_days") \
+        .eq("region_id", region_id).eq("year", year) \
+        .execute()
+    return _by_month(resp.data or [])
+
+def _get_factors_year(supabase, region_id: str, year: int) -> Dict[int, Dict[str, Any]]:
+    resp = supabase.table("farm_factors") \
+        .select("month,shade_level,leftover_fruit,defoliation_prev") \
+        .eq("region_id", region_id).eq("year", year) \
+        .execute()
+    return _by_month(resp.data or [])
+
 def _cat(v: float) -> str:
     if v >= 0.66: return "Alto"
     if v >= 0.33: return "Medio"
@@ -115,11 +204,7 @@ def _mult_antracnosis(w: Dict[str, Any], f: Dict[str, Any]) -> (float, List[str]
     return m, drivers
 
 # ---------- Cálculo por mes ----------
-def _compute_one(supabase, region_id: str, year: int, month: int, disease: str) -> Dict[str, Any]:
-    prior = _get_prior(supabase, disease, month)
-    w = _get_weather(supabase, region_id, year, month)
-    f = _get_factors(supabase, region_id, year, month)
-
+def _score(disease: str, prior: Optional[float], w: Dict[str, Any], f: Dict[str, Any]) -> Dict[str, Any]:
     if prior is None:
         # sin prior → no hay base estacional
         return {"disease": disease, "risk": 0.0, "category": "Bajo", "uncertainty": 1.0, "drivers": ["Sin prior"]}
@@ -147,9 +232,22 @@ def _compute_one(supabase, region_id: str, year: int, month: int, disease: str)
         "drivers": drivers or []
     }
 
+def _read_month(supabase, region_id: str, year: int, month: int) -> Tuple[Dict[Tuple[str, int], float], Dict[str, Any], Dict[str, Any]]:
+    # priors (cache), clima y factores son independientes: se piden en paralelo
+    r = fanout.run_parallel({
+        "priors": lambda: get_priors(supabase),
+        "weather": lambda: _get_weather(supabase, region_id, year, month),
+        "factors": lambda: _get_factors(supabase, region_id, year, month),
+    })
+    return r["priors"], r["weather"], r["factors"]
+
+def _compute_one(supabase, region_id: str, year: int, month: int, disease: str) -> Dict[str, Any]:
+    priors, w, f = _read_month(supabase, region_id, year, month)
+    return _score(disease, priors.get((disease, month)), w, f)
+
 def risk_json(supabase, region_id: str, year: int, month: int) -> Dict[str, Any]:
-    diseases = ["roya","broca","ojogallo","antracnosis"]
-    results = [_compute_one(supabase, region_id, year, month, d) for d in diseases]
+    priors, w, f = _read_month(supabase, region_id, year, month)
+    results = [_score(d, priors.get((d, month)), w, f) for d in DISEASES]
     return {
         "region_id": region_id,
         "year": year,
@@ -158,7 +256,20 @@ def risk_json(supabase, region_id: str, year: int, month: int) -> Dict[str, Any]
     }
 
 def risk_series_json(supabase, region_id: str, year: int) -> List[Dict[str, Any]]:
+    # 3 consultas para el año completo en vez de 12 meses x 4 enfermedades x 3
+    r = fanout.run_parallel({
+        "priors": lambda: get_priors(supabase),
+        "weather": lambda: _get_weather_year(supabase, region_id, year),
+        "factors": lambda: _get_factors_year(supabase, region_id, year),
+    })
+    priors, weather, factors = r["priors"], r["weather"], r["factors"]
     out = []
     for m in range(1, 13):
-        out.append(risk_json(supabase, region_id, year, m))
+        w = weather.get(m, {}); f = factors.get(m, {})
+        out.append({
+            "region_id": region_id,
+            "year": year,
+            "month": m,
+            "results": [_score(d, priors.get((d, m)), w, f) for d in DISEASES]
+        })
     return out
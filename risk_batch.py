@@ -0,0 +1,204 @@
+# risk_batch.py
+# Motor vectorizado de riesgo: calcula las 4 enfermedades para muchas
+# combinaciones (region, año, mes) en una sola pasada con NumPy.
+# Replica exactamente las reglas de risk._mult_* y risk._score.
+from __future__ import annotations
+from typing import Dict, Any, List, Optional, Tuple
+import os
+import numpy as np
+import risk
+
+MAX_KEYS = int(os.getenv("RISK_BATCH_MAX_KEYS", "5000"))
+
+WEATHER_COLS = ("t_mean_c", "rh_mean", "rain_days", "leaf_wet_hours")
+
+# ---------- Columnas ----------
+def _num(rows: List[Dict[str, Any]], key: str) -> np.ndarray:
+    return np.array([np.nan if r.get(key) is None else float(r[key]) for r in rows], dtype=float)
+
+def _columns(weather: List[Dict[str, Any]], factors: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    cols = {k: _num(weather, k) for k in WEATHER_COLS}
+    cols["shade_alta"] = np.array([(f.get("shade_level") or "").lower() == "alta" for f in factors], dtype=bool)
+    cols["shade_none"] = np.array([f.get("shade_level") is None for f in factors], dtype=bool)
+    cols["leftover"] = np.array([bool(f.get("leftover_fruit") or False) for f in factors], dtype=bool)
+    cols["defol"] = np.array([bool(f.get("defoliation_prev") or False) for f in factors], dtype=bool)
+    return cols
+
+# ---------- Reglas por enfermedad ----------
+# Cada paso es (factor, máscara, driver). Los pasos se aplican en el mismo
+# orden que en risk._mult_*, para que los productos en coma flotante coincidan.
+# El driver recibe las filas originales para formatear igual que el cálculo escalar.
+def _steps_roya(c):
+    t, rh, wet, rain = c["t_mean_c"], c["rh_mean"], c["leaf_wet_hours"], c["rain_days"]
+    return [
+        (1.15, (t >= 20) & (t <= 25), lambda w, f: f"T óptima {w['t_mean_c']:.0f}°C"),
+        (0.85, t >= 30, None),
+        (0.90, t < 17, None),
+        (1.10, rh >= 80, lambda w, f: f"HR {w['rh_mean']:.0f}%"),
+        (0.90, rh < 60, None),
+        (1.10, wet >= 6, lambda w, f: f"Mojado foliar {w['leaf_wet_hours']}h"),
+        (1.05, rain >= 10, lambda w, f: f"{w['rain_days']} días lluvia"),
+        (1.08, c["shade_alta"], lambda w, f: "Sombra alta"),
+    ]
+
+def _steps_broca(c):
+    t, rh, rain = c["t_mean_c"], c["rh_mean"], c["rain_days"]
+    return [
+        (1.12, (t >= 20) & (t <= 27), lambda w, f: f"T favorable {w['t_mean_c']:.0f}°C"),
+        (0.88, t < 18, None),
+        (1.06, rh >= 80, lambda w, f: f"HR {w['rh_mean']:.0f}%"),
+        (1.08, rain >= 8, lambda w, f: f"{w['rain_days']} días lluvia (vuelos)"),
+        (1.04, c["shade_alta"], None),
+        (1.10, c["leftover"], lambda w, f: "Fruto remanente"),
+    ]
+
+def _steps_ojogallo(c):
+    t, rh, wet, rain = c["t_mean_c"], c["rh_mean"], c["leaf_wet_hours"], c["rain_days"]
+    return [
+        (1.12, (t >= 17) & (t <= 23), lambda w, f: f"T fresca {w['t_mean_c']:.0f}°C"),
+        (0.85, t >= 28, None),
+        (1.10, rh >= 85, lambda w, f: f"HR {w['rh_mean']:.0f}%"),
+        (1.08, wet >= 6, lambda w, f: f"Mojado {w['leaf_wet_hours']}h"),
+        (1.05, rain >= 12, None),
+        (1.10, c["shade_alta"], lambda w, f: "Sombra alta"),
+    ]
+
+def _steps_antracnosis(c):
+    t, rh, rain = c["t_mean_c"], c["rh_mean"], c["rain_days"]
+    return [
+        (1.10, (t >= 20) & (t <= 25), lambda w, f: f"T {w['t_mean_c']:.0f}°C"),
+        (1.08, rh >= 85, lambda w, f: f"HR {w['rh_mean']:.0f}%"),
+        (1.06, rain >= 10, lambda w, f: f"{w['rain_days']} días lluvia"),
+        (1.10, c["defol"], lambda w, f: "Defoliación previa"),
+    ]
+
+_STEPS = {
+    "roya": _steps_roya,
+    "broca": _steps_broca,
+    "ojogallo": _steps_ojogallo,
+    "antracnosis": _steps_antracnosis,
+}
+
+# ---------- Motor ----------
+def score_columns(weather: List[Dict[str, Any]], factors: List[Dict[str, Any]],
+                  priors: Dict[str, List[Optional[float]]]) -> List[List[Dict[str, Any]]]:
+    """
+    weather[i], factors[i] y priors[enfermedad][i] describen la fila i.
+    Devuelve, por fila, la lista de resultados de risk.DISEASES en orden.
+    """
+    n = len(weather)
+    if n == 0: return []
+    c = _columns(weather, factors)
+
+    # incertidumbre: base 0.2 + 0.15 por variable faltante
+    missing = c["shade_none"].astype(int)
+    for k in WEATHER_COLS:
+        missing = missing + np.isnan(c[k]).astype(int)
+    uncertainty = np.clip(0.2 + 0.15 * missing, 0.0, 1.0)
+
+    out: List[List[Dict[str, Any]]] = [[] for _ in range(n)]
+    # Las comparaciones con NaN dan False, igual que el "if x is not None" escalar
+    with np.errstate(invalid="ignore"):
+        for disease in risk.DISEASES:
+            steps = _STEPS.get(disease, _steps_antracnosis)(c)
+            m = np.ones(n)
+            for factor, mask, _ in steps:
+                m = np.where(mask, m * factor, m)
+            prior = np.array([np.nan if p is None else p for p in priors[disease]], dtype=float)
+            has_prior = ~np.isnan(prior)
+            rv = np.clip(prior * m, 0.0, 1.0)
+            cat = np.select([rv >= 0.66, rv >= 0.33], ["Alto", "Medio"], "Bajo")
+
+            for i in range(n):
+                if not has_prior[i]:
+                    out[i].append({"disease": disease, "risk": 0.0, "category": "Bajo", "uncertainty": 1.0, "drivers": ["Sin prior"]})
+                    continue
+                drivers = [fmt(weather[i], factors[i]) for _, mask, fmt in steps if fmt is not None and mask[i]]
+                out[i].append({
+                    "disease": disease,
+                    "risk": float(rv[i]),
+                    "category": str(cat[i]),
+                    "uncertainty": float(uncertainty[i]),
+                    "drivers": drivers
+                })
+    return out
+
+# ---------- Datos en bloque ----------
+def index_by_key(rows: List[Dict[str, Any]]) -> Dict[Tuple[str, int, int], Dict[str, Any]]:
+    out = {}
+    for r in rows:
+        key = (str(r.pop("region_id")), int(r.pop("year")), int(r.pop("month")))
+        if key not in out: out[key] = r  # igual que .limit(1)
+    return out
+
+def _fetch(supabase, table: str, cols: str, regions: List[str], years: List[int]) -> Dict[Tuple[str, int, int], Dict[str, Any]]:
+    rows = risk.fetch_all(lambda: supabase.table(table)
+        .select(f"region_id,year,month,{cols}")
+        .in_("region_id", regions).in_("year", years)
+        .order("region_id").order("year").order("month"))
+    return index_by_key(rows)
+
+def score_keys(supabase, keys: List[Tuple[str, int, int]]) -> List[Dict[str, Any]]:
+    """Calcula risk_json para cada (region_id, year, month) con 2 consultas + cache de priors."""
+    if not keys: return []
+    regions = sorted({k[0] for k in keys}); years = sorted({k[1] for k in keys})
+    weather = _fetch(supabase, "weather_monthly", "t_mean_c,rh_mean,rain_days,leaf_wet_hours,cloudy_days", regions, years)
+    factors = _fetch(supabase, "farm_factors", "shade_level,leftover_fruit,defoliation_prev", regions, years)
+    priors = risk.get_priors(supabase)
+
+    results = score_columns(
+        [weather.get(k, {}) for k in keys],
+        [factors.get(k, {}) for k in keys],
+        {d: [priors.get((d, k[2])) for k in keys] for d in risk.DISEASES}
+    )
+    return [
+        {"region_id": region_id, "year": year, "month": month, "results": res}
+        for (region_id, year, month), res in zip(keys, results)
+    ]
+
+def regions_month_json(supabase, year: int, month: int, drivers: bool = False) -> Dict[str, Any]:
+    """Riesgo de todas las regiones con datos en (año, mes): 2 consultas sin importar cuántas regiones haya."""
+    def load(table: str, cols: str):
+        return index_by_key(risk.fetch_all(lambda: supabase.table(table)
+            .select(f"region_id,year,month,{cols}")
+            .eq("year", year).eq("month", month)
+            .order("region_id")))
+    weather = load("weather_monthly", "t_mean_c,rh_mean,rain_days,leaf_wet_hours,cloudy_days")
+    factors = load("farm_factors", "shade_level,leftover_fruit,defoliation_prev")
+    priors = risk.get_priors(supabase)
+
+    keys = sorted(set(weather) | set(factors))
+    results = score_columns(
+        [weather.get(k, {}) for k in keys],
+        [factors.get(k, {}) for k in keys],
+        {d: [priors.get((d, month)) for _ in keys] for d in risk.DISEASES}
+    )
+    regions = []
+    for k, res in zip(keys, results):
+        if not drivers:
+            for r in res: r.pop("drivers")
+        regions.append({"region_id": k[0], "results": res})
+    return {"year": year, "month": month, "regions": regions}
+
+def risk_batch_json(supabase, data: dict):
+    """
+    Espera {"keys": [{"region_id": ..., "year": ..., "month": ...}, ...]}.
+    Devuelve tupla: (dict, status_code)
+    """
+    items = data.get("keys")
+    if not isinstance(items, list) or not items:
+        return ({"success": False, "error": "'keys' debe ser una lista no vacía"}, 400)
+    if len(items) > MAX_KEYS:
+        return ({"success": False, "error": f"Máximo {MAX_KEYS} claves por solicitud"}, 413)
+
+    keys = []
+    for i, item in enumerate(items):
+        try:
+            key = (str(item["region_id"]), int(item["year"]), int(item["month"]))
+        except (KeyError, TypeError, ValueError):
+            return ({"success": False, "error": f"Clave inválida en posición {i}"}, 400)
+        if not 1 <= key[2] <= 12:
+            return ({"success": False, "error": f"Mes fuera de rango en posición {i}"}, 400)
+        keys.append(key)
+
+    return ({"success": True, "data": score_keys(supabase, keys)}, 200)
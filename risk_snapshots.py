@@ -0,0 +1,147 @@
+# risk_snapshots.py
+# Snapshots materializados de riesgo en la tabla risk_snapshot.
+# refresh_snapshots() recalcula solo las celdas (region, año, mes) cuyas
+# entradas cambiaron desde la última corrida; los endpoints de riesgo
+# sirven desde aquí con una sola lectura y caen al cálculo en vivo si falta.
+from __future__ import annotations
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime, timezone
+import hashlib
+import json
+import os
+import sys
+import risk
+import risk_batch
+
+SNAPSHOT_TABLE = "risk_snapshot"
+SERVE_SNAPSHOTS = os.getenv("RISK_SERVE_SNAPSHOTS", "1") == "1"
+UPSERT_CHUNK = 500
+
+Key = Tuple[str, int, int]
+
+# ---------- Lectura (servir) ----------
+def snapshot_one(supabase, region_id: str, year: int, month: int) -> Optional[Dict[str, Any]]:
+    resp = supabase.table(SNAPSHOT_TABLE) \
+        .select("payload") \
+        .eq("region_id", region_id).eq("year", year).eq("month", month) \
+        .limit(1).execute()
+    rows = resp.data or []
+    return rows[0]["payload"] if rows else None
+
+def snapshot_series(supabase, region_id: str, year: int) -> Optional[List[Dict[str, Any]]]:
+    resp = supabase.table(SNAPSHOT_TABLE) \
+        .select("month,payload") \
+        .eq("region_id", region_id).eq("year", year) \
+        .order("month").execute()
+    by_month = {int(r["month"]): r["payload"] for r in resp.data or []}
+    if len(by_month) < 12: return None
+    return [by_month[m] for m in range(1, 13)]
+
+def serve_risk_json(supabase, region_id: str, year: int, month: int) -> Dict[str, Any]:
+    if SERVE_SNAPSHOTS:
+        try:
+            payload = snapshot_one(supabase, region_id, year, month)
+            if payload is not None: return payload
+        except Exception as e:
+            print(f"Snapshot no disponible ({region_id}/{year}/{month}): {e}")
+    return risk.risk_json(supabase, region_id, year, month)
+
+def serve_risk_series_json(supabase, region_id: str, year: int) -> List[Dict[str, Any]]:
+    if SERVE_SNAPSHOTS:
+        try:
+            series = snapshot_series(supabase, region_id, year)
+            if series is not None: return series
+        except Exception as e:
+            print(f"Snapshot no disponible ({region_id}/{year}): {e}")
+    return risk.risk_series_json(supabase, region_id, year)
+
+# ---------- Recalculo incremental ----------
+def _load_inputs(supabase, table: str, cols: str, years: Optional[List[int]]) -> Dict[Key, Dict[str, Any]]:
+    def make_query():
+        q = supabase.table(table).select(f"region_id,year,month,{cols}")
+        if years: q = q.in_("year", years)
+        return q.order("region_id").order("year").order("month")
+    return risk_batch.index_by_key(risk.fetch_all(make_query))
+
+def _load_hashes(supabase, years: Optional[List[int]]) -> Dict[Key, str]:
+    def make_query():
+        q = supabase.table(SNAPSHOT_TABLE).select("region_id,year,month,input_hash")
+        if years: q = q.in_("year", years)
+        return q.order("region_id").order("year").order("month")
+    return {
+        (str(r["region_id"]), int(r["year"]), int(r["month"])): r["input_hash"]
+        for r in risk.fetch_all(make_query)
+    }
+
+def _input_hash(w: Dict[str, Any], f: Dict[str, Any], priors: Dict[str, Optional[float]]) -> str:
+    raw = json.dumps({"w": w, "f": f, "p": priors}, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _delete_cells(supabase, cells: List[Key]) -> None:
+    """Un DELETE por año: or=(and(region_id.eq.X,month.in.(...)),...)."""
+    por_anio: Dict[int, Dict[str, List[int]]] = {}
+    for region_id, year, month in cells:
+        por_anio.setdefault(year, {}).setdefault(region_id, []).append(month)
+    for year, regiones in sorted(por_anio.items()):
+        filtro = ",".join(
+            f'and(region_id.eq."{region_id}",month.in.({",".join(str(m) for m in sorted(meses))}))'
+            for region_id, meses in sorted(regiones.items())
+        )
+        supabase.table(SNAPSHOT_TABLE).delete().eq("year", year).or_(filtro).execute()
+
+def refresh_snapshots(supabase, years: Optional[List[int]] = None, full: bool = False) -> Dict[str, int]:
+    """
+    Recalcula los snapshots de las celdas cuyas entradas cambiaron
+    (o todas con full=True). Devuelve conteos de la corrida.
+    """
+    weather = _load_inputs(supabase, "weather_monthly", "t_mean_c,rh_mean,rain_days,leaf_wet_hours,cloudy_days", years)
+    factors = _load_inputs(supabase, "farm_factors", "shade_level,leftover_fruit,defoliation_prev", years)
+    priors = risk._get_priors_all(supabase)  # lectura fresca, no la cache del worker
+    # Se cargan también en full: sin ellas no se sabría qué celdas quedaron huérfanas
+    existing = _load_hashes(supabase, years)
+
+    keys = sorted(set(weather) | set(factors))
+    changed: List[Key] = []; hashes: Dict[Key, str] = {}
+    for k in keys:
+        month_priors = {d: priors.get((d, k[2])) for d in risk.DISEASES}
+        h = _input_hash(weather.get(k, {}), factors.get(k, {}), month_priors)
+        if full or existing.get(k) != h:
+            changed.append(k); hashes[k] = h
+
+    results = risk_batch.score_columns(
+        [weather.get(k, {}) for k in changed],
+        [factors.get(k, {}) for k in changed],
+        {d: [priors.get((d, k[2])) for k in changed] for d in risk.DISEASES}
+    )
+    computed_at = datetime.now(timezone.utc).isoformat()
+    rows = [{
+        "region_id": k[0], "year": k[1], "month": k[2],
+        "payload": {"region_id": k[0], "year": k[1], "month": k[2], "results": res},
+        "input_hash": hashes[k],
+        "computed_at": computed_at,
+    } for k, res in zip(changed, results)]
+    for i in range(0, len(rows), UPSERT_CHUNK):
+        supabase.table(SNAPSHOT_TABLE) \
+            .upsert(rows[i:i + UPSERT_CHUNK], on_conflict="region_id,year,month", returning="minimal") \
+            .execute()
+
+    # celdas cuyas entradas ya no existen: se borran para no servir datos viejos
+    stale = [k for k in existing if k not in weather and k not in factors]
+    _delete_cells(supabase, stale)
+
+    return {"scanned": len(keys), "recomputed": len(changed), "unchanged": len(keys) - len(changed), "deleted": len(stale)}
+
+# ---------- CLI (cron) ----------
+# Uso: python risk_snapshots.py [--full] [año ...]
+if __name__ == "__main__":
+    # Cliente propio: importar app arrancaría el resto del servicio
+    from dotenv import load_dotenv
+    from supabase import create_client
+    load_dotenv()
+    url, key = os.getenv("NEXT_PUBLIC_SUPABASE_URL"), os.getenv("NEXT_PUBLIC_SUPABASE_ANON_KEY")
+    if not url or not key: sys.exit("NEXT_PUBLIC_SUPABASE_URL / NEXT_PUBLIC_SUPABASE_ANON_KEY no configuradas")
+    client = create_client(url, key)
+    args = sys.argv[1:]
+    full = "--full" in args
+    years = [int(a) for a in args if a != "--full"] or None
+    print(refresh_snapshots(client, years=years, full=full))
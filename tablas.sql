@@ -129,4 +129,116 @@ create index if not exists idx_usuarioalerta_usuario on UsuarioAlerta (IdUsuario
 create index if not exists idx_usuarioalerta_alerta on UsuarioAlerta (IdAlerta);
 create index if not exists idx_reportes_usuario on Reportes (IdUsuario);
 create index if not exists idx_reportes_enfermedad on Reportes (IdEnfermedad);
-create index if not exists idx_fotos_usuario on Fotos (IdUsuario);
\ No newline at end of file
+create index if not exists idx_fotos_usuario on Fotos (IdUsuario);
+-- =====================================
+-- TABLA: risk_snapshot (riesgo precalculado por region/año/mes)
+-- La llena risk_snapshots.refresh_snapshots(); input_hash permite
+-- recalcular solo las celdas cuyas entradas cambiaron.
+-- =====================================
+create table if not exists risk_snapshot (
+    region_id text not null,
+    year int not null,
+    month int not null check (month between 1 and 12),
+    payload jsonb not null,
+    input_hash text not null,
+    computed_at timestamptz default now(),
+    primary key (region_id, year, month)
+);
+
+-- =====================================
+-- Sincronización incremental de alertas (GET /alerts?cursor=...)
+-- actualizado_en marca altas y cambios; las bajas quedan en
+-- usuarioalerta_eliminada para que el cliente pueda aplicarlas.
+-- =====================================
+alter table UsuarioAlerta add column if not exists actualizado_en timestamptz not null default now();
+create index if not exists idx_usuarioalerta_sync on UsuarioAlerta (IdUsuario, actualizado_en, IdAlerta);
+
+create or replace function usuarioalerta_touch() returns trigger as $$
+begin
+    new.actualizado_en := clock_timestamp();
+    return new;
+end;
+$$ language plpgsql;
+
+drop trigger if exists trg_usuarioalerta_touch on UsuarioAlerta;
+create trigger trg_usuarioalerta_touch before insert or update on UsuarioAlerta
+    for each row execute function usuarioalerta_touch();
+
+create table if not exists usuarioalerta_eliminada (
+    IdUsuario uuid not null,
+    IdAlerta uuid not null,
+    eliminado_en timestamptz not null default now(),
+    primary key (IdUsuario, IdAlerta)
+);
+create index if not exists idx_usuarioalerta_eliminada_sync on usuarioalerta_eliminada (IdUsuario, eliminado_en, IdAlerta);
+
+create or replace function usuarioalerta_tombstone() returns trigger as $$
+begin
+    insert into usuarioalerta_eliminada (IdUsuario, IdAlerta, eliminado_en)
+    values (old.IdUsuario, old.IdAlerta, clock_timestamp())
+    on conflict (IdUsuario, IdAlerta) do update set eliminado_en = excluded.eliminado_en;
+    return old;
+end;
+$$ language plpgsql;
+
+drop trigger if exists trg_usuarioalerta_tombstone on UsuarioAlerta;
+create trigger trg_usuarioalerta_tombstone after delete on UsuarioAlerta
+    for each row execute function usuarioalerta_tombstone();
+
+-- Miniatura generada al subir la foto del diagnóstico (ver images.py)
+alter table diagnostico_foto add column if not exists thumbnail_url text;
+
+-- Paginación por llave de GET /diagnoses?cursor=... (fecha, iddiagnostico)
+create index if not exists idx_diagnostico_foto_usuario_keyset on diagnostico_foto (idusuario, fecha desc, iddiagnostico desc);
+create index if not exists idx_diagnostico_foto_keyset on diagnostico_foto (fecha desc, iddiagnostico desc);
+
+-- =====================================
+-- RPC crear_parcelas(items): ubicación + parcela en una sola llamada.
+-- Cada elemento va en su propio bloque (subtransacción): si falla, no
+-- queda la ubicación huérfana y los demás elementos siguen. Devuelve un
+-- resultado por elemento, en orden: {ok, parcela} o {ok: false, error}.
+-- La usan POST /parcelas (un elemento) y POST /parcelas/bulk (por lotes).
+-- =====================================
+create or replace function crear_parcelas(items jsonb) returns jsonb as $$
+declare
+    item jsonb;
+    ubic Ubicacion;
+    parc Parcela;
+    resultados jsonb := '[]'::jsonb;
+begin
+    for item in select value from jsonb_array_elements(items) loop
+        begin
+            insert into Ubicacion (Estado, Municipio, Latitud, Longitud)
+            values (item->'ubicacion'->>'estado', item->'ubicacion'->>'municipio',
+                    (item->'ubicacion'->>'latitud')::double precision,
+                    (item->'ubicacion'->>'longitud')::double precision)
+            returning * into ubic;
+
+            insert into Parcela (Nombre, Hectareas, Tipo, IdUbicacion)
+            values (item->>'nombre', (item->>'hectareas')::double precision, item->>'tipo', ubic.IdUbicacion)
+            returning * into parc;
+
+            resultados := resultados || jsonb_build_array(jsonb_build_object(
+                'ok', true, 'parcela', to_jsonb(parc) || jsonb_build_object('ubicacion', to_jsonb(ubic))));
+        exception when others then
+            resultados := resultados || jsonb_build_array(jsonb_build_object('ok', false, 'error', sqlerrm));
+        end;
+    end loop;
+    return resultados;
+end;
+$$ language plpgsql;
+
+-- =====================================
+-- TABLA: region (centroide de cada region_id de weather_monthly /
+-- farm_factors). Cada parcela toma la región del centroide más cercano
+-- (ver parcelas_region.py) para GET /parcelas/<id>/risk/...
+-- Se crea vacía; cargar los centroides desde un CSV
+-- region_id,nombre,latitud,longitud con:
+--   python parcelas_region.py load regiones.csv
+-- =====================================
+create table if not exists region (
+    region_id text primary key,
+    nombre text,
+    latitud double precision not null,
+    longitud double precision not null
+);
@@ -0,0 +1,139 @@
+# uploads.py
+# Subidas de imágenes sin cargar el archivo completo en RAM: el multipart se
+# vuelca a un archivo temporal a partir de SPOOL_BYTES y a Storage se le pasa
+# el descriptor, que httpx envía por trozos. Las rutas en Storage se derivan
+# del hash del contenido, así un reintento del cliente no sube otra copia.
+from __future__ import annotations
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+from collections import OrderedDict
+from contextlib import contextmanager
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from flask import Request
+
+MAX_UPLOAD_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(15 * 1024 * 1024)))
+# Hasta este tamaño el archivo se queda en memoria; arriba va a disco
+SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(512 * 1024)))
+SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+# Holgura para los demás campos del formulario en el límite de la petición
+FORM_OVERHEAD_BYTES = 1024 * 1024
+# Rutas que reciben varias fotos en una petición y su límite de cuerpo
+BATCH_MAX_BYTES = int(os.getenv("UPLOAD_BATCH_MAX_BYTES", str(200 * 1024 * 1024)))
+LARGE_BODY_PATHS = {"/diagnostic/batch"}
+# Entradas (usuario, hash) recordadas por worker
+HASH_INDEX_SIZE = int(os.getenv("UPLOAD_HASH_INDEX_SIZE", "10000"))
+CHUNK_SIZE = 64 * 1024
+# Extensiones con las que se guardan las fotos (en JOBS_DIR y en Storage): el
+# nombre que manda el cliente nunca llega tal cual a una ruta
+ALLOWED_EXTENSIONS = ("jpg", "jpeg", "png", "webp", "heic")
+MIME_EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/heic": "heic", "image/heif": "heic"}
+EXTENSION_ERROR = f"Tipo de archivo no permitido; se aceptan {', '.join(ALLOWED_EXTENSIONS)}"
+
+class UploadTooLarge(Exception):
+    def __init__(self, size: int, limit: int = MAX_UPLOAD_BYTES):
+        super().__init__(f"El archivo pesa {size} bytes; el máximo es {limit}")
+        self.size = size
+        self.limit = limit
+
+class UploadRequest(Request):
+    """Request de Flask que manda cada archivo del multipart a un SpooledTemporaryFile propio."""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES, dir=SPOOL_DIR)
+
+    @property
+    def max_content_length(self):
+        if self.path in LARGE_BODY_PATHS: return BATCH_MAX_BYTES
+        return super().max_content_length
+
+def max_content_length() -> int:
+    """Valor para MAX_CONTENT_LENGTH: Werkzeug corta con 413 antes de leer el cuerpo."""
+    return MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES
+
+@contextmanager
+def open_upload(file_storage, max_bytes: int = MAX_UPLOAD_BYTES) -> Iterator[Tuple[Union[bytes, io.FileIO], int]]:
+    """
+    Entrega (contenido, tamaño) listo para storage.upload(): bytes si el archivo
+    es pequeño, o un FileIO sobre el temporal en disco (se lee por trozos).
+    Lanza UploadTooLarge si excede max_bytes.
+    """
+    stream = file_storage.stream
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size > max_bytes: raise UploadTooLarge(size, max_bytes)
+
+    if size <= SPOOL_BYTES:
+        yield stream.read(), size
+        return
+
+    # Ya está en disco: se duplica el descriptor en vez de copiar el archivo
+    fh = io.FileIO(os.dup(stream.fileno()), "r")
+    try:
+        fh.seek(0)
+        yield fh, size
+    finally:
+        fh.close()
+
+# ---------- Deduplicación por contenido ----------
+def content_hash(data) -> str:
+    """sha256 del contenido (bytes o archivo abierto, que queda de nuevo al inicio)."""
+    if isinstance(data, (bytes, bytearray)): return hashlib.sha256(data).hexdigest()
+    h = hashlib.sha256()
+    data.seek(0)
+    while True:
+        chunk = data.read(CHUNK_SIZE)
+        if not chunk: break
+        h.update(chunk)
+    data.seek(0)
+    return h.hexdigest()
+
+def safe_ext(filename: Optional[str], mimetype: Optional[str] = None) -> Optional[str]:
+    """
+    Extensión para guardar el archivo: la del nombre si está permitida, si no
+    la del tipo MIME; "jpg" si no trae ni extensión ni tipo (como antes).
+    None si no hay ninguna válida (la ruta responde 400).
+    """
+    ext = filename.rsplit(".", 1)[-1].lower() if filename and "." in filename else None
+    if ext in ALLOWED_EXTENSIONS: return ext
+    tipo = (mimetype or "").split(";", 1)[0].strip().lower()
+    if tipo in MIME_EXTENSIONS: return MIME_EXTENSIONS[tipo]
+    if ext is None and tipo in ("", "application/octet-stream"): return "jpg"
+    return None
+
+def is_duplicate(e: Exception) -> bool:
+    """
+    True si Storage rechazó la subida porque el objeto ya existe (upsert=False).
+    storage3 deja el statusCode del cuerpo de error (409, a veces como texto)
+    en StorageApiError.status; se mira el código, no el mensaje.
+    """
+    status = getattr(e, "status", None)
+    if status is None: status = getattr(e, "statusCode", None)
+    return str(status) == "409"
+
+_index_lock = threading.Lock()
+_index: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+_index_stats = {"hits": 0, "misses": 0}
+
+def dedup_lookup(owner: str, digest: str) -> Optional[Dict[str, Any]]:
+    """Resultado de una subida previa del mismo contenido por el mismo usuario en este worker."""
+    with _index_lock:
+        found = _index.get((owner, digest))
+        if found is None:
+            _index_stats["misses"] += 1
+            return None
+        _index.move_to_end((owner, digest))
+        _index_stats["hits"] += 1
+        return dict(found)
+
+def dedup_remember(owner: str, digest: str, result: Dict[str, Any]) -> None:
+    with _index_lock:
+        _index[(owner, digest)] = dict(result)
+        _index.move_to_end((owner, digest))
+        while len(_index) > HASH_INDEX_SIZE: _index.popitem(last=False)
+
+def dedup_stats() -> Dict[str, Any]:
+    with _index_lock:
+        return {**_index_stats, "entries": len(_index), "max_entries": HASH_INDEX_SIZE}